@@ -11,11 +11,13 @@ bl_info = {
 }
 
 import bpy  # noqa
+from . import helpers  # noqa
 from . import operators  # noqa
 from . import layout  # noqa
 
 
 def register():
+    helpers.register()
     layout.register()
     operators.register()
 
@@ -23,3 +25,4 @@ def register():
 def unregister():
     layout.unregister()
     operators.unregister()
+    helpers.unregister()
@@ -0,0 +1,122 @@
+"""
+Index of the objects in the *.blend files in the assets folder, so that the add-on does not have to open
+these files to find out what they contain. The manifest is written by install_tools.build, which runs this
+script in a headless Blender:
+
+blender --background --factory-startup -noaudio --python ./asset_manifest.py
+
+Reading the manifest does not need bpy.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+ASSETS_PATH = Path(__file__).resolve().parent.joinpath("assets")
+MANIFEST_PATH = ASSETS_PATH.joinpath("manifest.json")
+
+# Largest deviation from the identity quaternion for an object to count as not rotated
+_ROTATION_TOLERANCE = 1.E-7
+
+# The parsed manifest, and the modification time of the manifest file when it was parsed
+_manifest = (None, dict())
+
+# Content hash of each assets file, with the size and modification time of the file when it was hashed
+_file_hashes = dict()
+
+
+def objects(filename: str):
+    """
+    Get the manifest entries for all objects in an assets file.
+
+    Args:
+        filename (str): Name of the *.blend file in the assets folder
+
+    Returns:
+        dict of str: dict: Object name --> type, vertex count, bounding box and rotation state. 'None' if
+                           there is no up to date manifest for this file, then the file has to be opened.
+    """
+    global _manifest
+    try:
+        modified_time = os.path.getmtime(MANIFEST_PATH)
+        if _manifest[0] != modified_time:
+            with open(MANIFEST_PATH) as manifest_file:
+                _manifest = (modified_time, json.load(manifest_file))
+    except (OSError, ValueError):
+        return None
+
+    entry = _manifest[1].get(filename)
+    try:
+        # The modification time is not kept by e.g. git, and a file saved again can have the same size, so
+        # compare the contents
+        if entry is None or entry["file_size"] != os.path.getsize(ASSETS_PATH.joinpath(filename)) or \
+                entry.get("sha1") != _file_hash(ASSETS_PATH.joinpath(filename)):
+            return None
+    except OSError:
+        return None
+
+    return entry["objects"]
+
+def _file_hash(file_path: Path) -> str:
+    """
+    SHA-1 of a file. Kept until the size or modification time of the file changes, so the file is only read
+    again after it has changed.
+    """
+    stat = os.stat(file_path)
+    cached = _file_hashes.get(str(file_path))
+    if cached is None or cached[0] != (stat.st_size, stat.st_mtime_ns):
+        sha1 = hashlib.sha1()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                sha1.update(block)
+        cached = ((stat.st_size, stat.st_mtime_ns), sha1.hexdigest())
+        _file_hashes[str(file_path)] = cached
+
+    return cached[1]
+
+def write():
+    """
+    Open all *.blend files in the assets folder and write the manifest. Must be run from within Blender.
+    """
+    import bpy
+    import numpy as np
+
+    manifest = dict()
+    for file_path in sorted(ASSETS_PATH.glob("*.blend")):
+        with bpy.data.libraries.load(str(file_path)) as (data_from, data_to):
+            object_names = list(data_from.objects)
+            data_to.objects = object_names
+
+        manifest_objects = dict()
+        for name, obj in zip(object_names, data_to.objects):
+            rotation = np.array(obj.matrix_world.to_quaternion())
+
+            # The objects are not in any scene and never evaluated, so their bound_box may be all zeros
+            if obj.type == 'MESH' and len(obj.data.vertices) > 0:
+                corners = np.empty(len(obj.data.vertices) * 3, dtype=np.float32)
+                obj.data.vertices.foreach_get("co", corners)
+                corners = corners.reshape(-1, 3)
+            else:
+                corners = np.array(obj.bound_box)
+
+            manifest_objects[name] = {
+                "type": obj.type,
+                "vertex_count": len(obj.data.vertices) if obj.type == 'MESH' else 0,
+                "bound_box_min": np.amin(corners, axis=0).tolist(),
+                "bound_box_max": np.amax(corners, axis=0).tolist(),
+                "rotation_quaternion": rotation.tolist(),
+                "not_rotated": bool(np.linalg.norm(rotation - np.array([1, 0, 0, 0])) < _ROTATION_TOLERANCE),
+            }
+            bpy.data.objects.remove(obj, do_unlink=True)
+
+        manifest[file_path.name] = {"file_size": os.path.getsize(file_path), "sha1": _file_hash(file_path),
+                                    "objects": manifest_objects}
+        print(f"Indexed {len(manifest_objects)} object(s) in '{file_path.name}'")
+
+    with open(MANIFEST_PATH, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    print(f"Wrote '{MANIFEST_PATH}'")
+
+
+if __name__ == "__main__":
+    write()
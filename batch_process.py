@@ -0,0 +1,239 @@
+"""
+Process a folder of 3D scans without user interaction, e.g. over night. Run as follows:
+
+blender --background -noaudio --python ./batch_process.py -- --input scans/ --job job.json --output results/
+
+Every scan is processed by its own Blender worker process, and several workers are run in parallel. The job
+is a JSON file that overrides any of the settings in DEFAULT_JOB. A report with timing per step, and what
+failed, is written to the output folder.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import importlib
+import json
+import math
+import os
+from pathlib import Path
+import subprocess
+import sys
+import time
+import traceback
+
+ADDON_PATH = Path(__file__).resolve().parent
+
+DEFAULT_JOB = {
+    # Steps are run in this order, leave out any that are not wanted. "foot_angle" can be added after "align"
+    "steps": ["import", "align", "toe_box", "cosmetics", "apply_modifiers", "export"],
+    # Alignment. The scan is rotated (degrees around X, Y and Z) and optionally mirrored, then transforms are
+    # applied. After this, the toes should point along +X and the leg along +Z
+    "rotation_degrees": [0, 0, 0],
+    "mirror": False,
+    # Rotate the scan into place from its shape after the rotation above, see ORTHOPEN_OT_align_scan
+    "auto_align": False,
+    # Foot angle. The ankle is detected, and the foot is rotated this many degrees around it, about the
+    # sideways X axis of the bone that is added at the ankle
+    "foot_angle_degrees": 0,
+    # Cosmetics, see ORTHOPEN_OT_leg_prosthesis_generate
+    "max_circumference": 0.35,
+    "cosmetics_height": 0.2,
+    "clip_position_z": 0.1,
+    # 'UNIFORM' or 'PROFILE', fit the cosmetics to the measured circumference at each height of the scan
+    "fitting_mode": "UNIFORM",
+}
+
+# Objects that are imported as a reference, and should not be exported
+_TEMPLATE_NAMES = ["Foot_ref"]
+
+
+def run_batch(input_path: str, job_path: str, output_path: str, workers: int, blender: str):
+    """
+    Process all STL files in a folder, one Blender worker process per scan.
+
+    Returns:
+        list of dict: One report per scan, see process_scan()
+    """
+    scan_paths = sorted([path for path in Path(input_path).iterdir() if path.suffix.lower() == ".stl"])
+    os.makedirs(output_path, exist_ok=True)
+
+    # Threads are enough here, they only wait for the Blender processes
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        reports = list(executor.map(lambda scan_path: _run_worker(scan_path, job_path, output_path, blender),
+                                    scan_paths))
+
+    with open(Path(output_path, "batch_report.json"), "w") as report_file:
+        json.dump(reports, report_file, indent=2)
+
+    print(f"\n{'scan':<40} {'time [s]':>9}  result")
+    for report in reports:
+        result = "OK" if report["error"] is None else f"FAILED at '{report['failed_step']}'"
+        print(f"{Path(report['scan']).name:<40} {report['wall_time']:>9.1f}  {result}")
+    failures = len([report for report in reports if report["error"] is not None])
+    print(f"\nProcessed {len(reports)} scan(s) in {time.perf_counter() - start:.1f} s, {failures} failed. "
+          f"See '{Path(output_path, 'batch_report.json')}'")
+
+    return reports
+
+def process_scan(scan_path: str, job: dict, output_path: str) -> dict:
+    """
+    Run all steps of a job on one scan. Must be run from within Blender.
+
+    Returns:
+        dict: Report with the time for each step, and the failed step and traceback if something failed
+    """
+    import bpy
+    # The add-on is imported by its folder name, like Blender does
+    sys.path.insert(0, str(ADDON_PATH.parent))
+    addon = importlib.import_module(ADDON_PATH.name)
+    addon.register()
+
+    # Start from an empty scene, e.g. without the default cube
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj, do_unlink=True)
+
+    steps = {
+        "import": _import,
+        "align": _align,
+        "foot_angle": _foot_angle,
+        "toe_box": _toe_box,
+        "cosmetics": _cosmetics,
+        "apply_modifiers": _apply_modifiers,
+        "export": _export,
+    }
+
+    report = {"scan": str(scan_path), "timings": dict(), "failed_step": None, "error": None}
+    state = {"addon": addon, "scan_path": Path(scan_path), "output_path": Path(output_path), "job": job}
+    for step in job["steps"]:
+        start = time.perf_counter()
+        try:
+            steps[step](state)
+        except Exception:
+            report["failed_step"] = step
+            report["error"] = traceback.format_exc()
+            break
+        finally:
+            report["timings"][step] = time.perf_counter() - start
+
+    return report
+
+def _run_worker(scan_path: Path, job_path: str, output_path: str, blender: str) -> dict:
+    report_path = Path(output_path, f"{scan_path.stem}.report.json")
+    if report_path.exists():
+        os.remove(report_path)
+
+    start = time.perf_counter()
+    completed = subprocess.run([blender, "--background", "--factory-startup", "-noaudio", "--python", __file__, "--",
+                                "--worker", "--input", str(scan_path), "--job", str(job_path),
+                                "--output", str(output_path)],
+                               capture_output=True, text=True)
+
+    # The worker writes its own report, unless Blender crashed
+    try:
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+    except (OSError, ValueError):
+        report = {"scan": str(scan_path), "timings": dict(), "failed_step": None,
+                  "error": f"Blender exited with code {completed.returncode}:\n{completed.stderr[-2000:]}"}
+
+    report["wall_time"] = time.perf_counter() - start
+    return report
+
+def _select_only(obj):
+    import bpy
+    bpy.ops.object.select_all(action='DESELECT')
+    obj.select_set(True)
+    bpy.context.view_layer.objects.active = obj
+
+def _import(state: dict):
+    import bpy
+    bpy.ops.orthopen.import_file(filepath=str(state["scan_path"]))
+    key_imported_scan = state["addon"].operators._KEY_IMPORTED_SCAN
+    state["scan"] = [obj for obj in bpy.data.objects
+                     if key_imported_scan in obj.keys() and obj.name not in _TEMPLATE_NAMES][0]
+
+def _align(state: dict):
+    import bpy
+    scan = state["scan"]
+    scan.rotation_euler = [math.radians(angle) for angle in state["job"]["rotation_degrees"]]
+    if state["job"]["mirror"]:
+        scan.scale[1] *= -1
+
+    _select_only(scan)
+    if state["job"]["auto_align"]:
+        bpy.ops.orthopen.align_scan()
+    bpy.ops.orthopen.model_transform_all()
+
+def _foot_angle(state: dict):
+    import bpy
+    _select_only(state["scan"])
+    result = bpy.ops.orthopen.set_foot_pivot(use_detected_ankle=True, use_posing_proxy=False)
+    if result != {'FINISHED'}:
+        raise RuntimeError(f"Could not find the ankle of '{state['scan'].name}'")
+
+    # The operator leaves the armature active in pose mode, with its single bone along the foot
+    armature = bpy.context.active_object
+    bone = armature.pose.bones[0]
+    bone.rotation_mode = 'XYZ'
+    bone.rotation_euler = (math.radians(state["job"]["foot_angle_degrees"]), 0, 0)
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+def _toe_box(state: dict):
+    import bpy
+    _select_only(state["scan"])
+    bpy.ops.orthopen.generate_toe_box()
+
+def _cosmetics(state: dict):
+    import bpy
+    job = state["job"]
+    bpy.ops.orthopen.leg_prosthesis_generate(set_max_circumference=job["max_circumference"],
+                                             set_height=job["cosmetics_height"],
+                                             set_clip_position_z=job["clip_position_z"],
+                                             fitting_mode=job["fitting_mode"],
+                                             use_interactive_placement=False)
+
+def _apply_modifiers(state: dict):
+    import bpy
+    for obj in [obj for obj in bpy.context.scene.objects if obj.type == 'MESH' and obj.name not in _TEMPLATE_NAMES]:
+        _select_only(obj)
+        bpy.ops.orthopen.permanent_modifiers()
+
+def _export(state: dict):
+    import bpy
+    helpers, stl = state["addon"].helpers, state["addon"].stl
+    for obj in bpy.context.scene.objects:
+        if obj.type == 'MESH' and obj.name not in _TEMPLATE_NAMES:
+            vertices, triangles = helpers.evaluated_triangles(obj)
+            stl.write_binary(str(state["output_path"].joinpath(f"{state['scan_path'].stem}_{obj.name}.stl")),
+                             vertices, triangles)
+
+
+if __name__ == "__main__":
+    # Only parse arguments after "--", the rest are for Blender
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Process a folder of 3D scans with OrthOpen")
+    parser.add_argument('--input', '-i', type=str, required=True, help="Folder with STL files")
+    parser.add_argument('--job', '-j', type=str, default="", help="JSON file with settings, see DEFAULT_JOB")
+    parser.add_argument('--output', '-o', type=str, required=True, help="Folder for results and reports")
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1,
+                        help="Number of Blender processes to run in parallel")
+    parser.add_argument('--blender', '-b', type=str, default="",
+                        help="Blender executable for the workers. Defaults to the Blender running this script")
+    parser.add_argument('--worker', action='store_true', help="Process the single scan given by --input. Internal")
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        job = dict(DEFAULT_JOB)
+        if args.job != "":
+            with open(args.job) as job_file:
+                job.update(json.load(job_file))
+
+        report = process_scan(args.input, job, args.output)
+        with open(Path(args.output, f"{Path(args.input).stem}.report.json"), "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    else:
+        blender = args.blender
+        if blender == "":
+            import bpy
+            blender = bpy.app.binary_path
+
+        run_batch(args.input, args.job, args.output, args.workers, blender)
@@ -0,0 +1,133 @@
+"""
+Benchmarks of the geometry module on synthetic leg scans. Does not need Blender.
+
+Run as follows: python ./benchmark_geometry.py [--sizes 10000 100000]
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+import geometry
+
+DEFAULT_SIZES = [10000, 100000, 1000000, 2000000]
+
+
+def synthetic_leg(vertex_count: int, seed: int = 0):
+    """
+    Points on a leg standing on the XY plane with the toes along +X, 0.5 m high like a typical scan
+    """
+    rng = np.random.default_rng(seed)
+    foot = rng.uniform((-0.05, -0.045, 0), (0.2, 0.045, 0.08), size=(vertex_count // 3, 3))
+    angles = rng.uniform(0, 2 * np.pi, size=vertex_count - vertex_count // 3)
+    leg = np.column_stack([0.05 * np.cos(angles), 0.05 * np.sin(angles),
+                           rng.uniform(0.08, 0.5, size=angles.shape[0])])
+    return np.vstack([foot, leg])
+
+
+def synthetic_tube(face_count: int):
+    """
+    A closed tube with about the given number of triangles, 0.5 m high with a wavy radius like a leg
+    """
+    around = max(int(np.sqrt(face_count / 2)), 3)
+    rings = max(face_count // (2 * around), 1) + 1
+    angles = np.linspace(0, 2 * np.pi, around, endpoint=False)
+    z = np.linspace(0, 0.5, rings)
+    radius = 0.05 + 0.01 * np.sin(10 * z)
+    vertices = np.column_stack([np.outer(radius, np.cos(angles)).ravel(), np.outer(radius, np.sin(angles)).ravel(),
+                                np.repeat(z, around)])
+
+    i = np.arange(around)
+    below = (np.arange(rings - 1) * around)[:, np.newaxis]
+    above = below + around
+    triangles = np.vstack([np.column_stack([(below + i).ravel(), (below + (i + 1) % around).ravel(),
+                                            (above + (i + 1) % around).ravel()]),
+                           np.column_stack([(below + i).ravel(), (above + (i + 1) % around).ravel(),
+                                            (above + i).ravel()])])
+    return vertices, triangles
+
+
+def _bound_box(vertices: np.ndarray):
+    low, high = np.amin(vertices, axis=0), np.amax(vertices, axis=0)
+    return np.array([[x, y, z] for x in (low[0], high[0]) for y in (low[1], high[1]) for z in (low[2], high[2])])
+
+
+def report(name: str, sizes: list, function, repeat: int = 5):
+    """
+    Print the best time of a function, called with a synthetic leg of each size.
+    """
+    print(f"\n{name}")
+    print(f"{'vertices':>10} {'time [ms]':>10} {'Mvertices/s':>12}")
+    for size in sizes:
+        leg = synthetic_leg(size)
+        seconds = min(timeit.repeat(lambda: function(leg), number=1, repeat=repeat))
+        print(f"{size:>10} {1000 * seconds:>10.2f} {size / seconds / 1E6:>12.1f}")
+
+
+def report_points_in_polygons(sizes: list, polygon_count: int, corners: int = 200, repeat: int = 5):
+    """
+    Print the best time to classify random points against a number of circular cross-sections of a leg.
+    """
+    print(f"\npoints_in_polygons, {polygon_count} polygon(s) with {corners} corners")
+    print(f"{'points':>10} {'time [ms]':>10} {'Mpoints/s':>12}")
+    angles = np.linspace(0, 2 * np.pi, corners, endpoint=False)
+    polygons = [(0.04 + 0.002 * i) * np.column_stack([np.cos(angles), np.sin(angles)]) for i in range(polygon_count)]
+    for size in sizes:
+        points = np.random.default_rng(0).uniform(-0.06, 0.06, size=(size, 2))
+        seconds = min(timeit.repeat(lambda: geometry.points_in_polygons(points, polygons), number=1, repeat=repeat))
+        print(f"{size:>10} {1000 * seconds:>10.2f} {size * polygon_count / seconds / 1E6:>12.1f}")
+
+
+def report_slice_mesh(sizes: list, height_count: int = 200, repeat: int = 3):
+    """
+    Print the best time to cut a leg-like tube at a number of heights.
+    """
+    print(f"\nslice_mesh, {height_count} heights")
+    print(f"{'faces':>10} {'time [ms]':>10} {'Mfaces/s':>12}")
+    heights = np.linspace(0.001, 0.499, height_count)
+    for size in sizes:
+        vertices, triangles = synthetic_tube(size)
+        seconds = min(timeit.repeat(lambda: geometry.slice_mesh(vertices, triangles, heights), number=1,
+                                    repeat=repeat))
+        print(f"{triangles.shape[0]:>10} {1000 * seconds:>10.2f} {triangles.shape[0] / seconds / 1E6:>12.1f}")
+
+
+def report_offset_shell(sizes: list, repeat: int = 5):
+    """
+    Print the best time to build a shell around a leg-like tube once, and then to offset it again, e.g. for a
+    new thickness.
+    """
+    print("\nshell_topology and area_weighted_normals once, then offset_shell")
+    print(f"{'faces':>10} {'topology [ms]':>14} {'offset [ms]':>12}")
+    for size in sizes:
+        vertices, triangles = synthetic_tube(size)
+        topology_seconds = min(timeit.repeat(lambda: (geometry.shell_topology(triangles),
+                                                      geometry.area_weighted_normals(vertices, triangles)),
+                                             number=1, repeat=repeat))
+        vertex_indices, _ = geometry.shell_topology(triangles)
+        normals = geometry.area_weighted_normals(vertices, triangles)[vertex_indices]
+        offset_seconds = min(timeit.repeat(lambda: geometry.offset_shell(vertices[vertex_indices], normals, 0.003),
+                                           number=1, repeat=repeat))
+        print(f"{triangles.shape[0]:>10} {1000 * topology_seconds:>14.2f} {1000 * offset_seconds:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the geometry module on synthetic leg scans")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Number of vertices, or faces for the mesh benchmarks")
+    args = parser.parse_args()
+
+    matrix_world = np.eye(4)
+    matrix_world[:3, 3] = [0.1, 0.2, 0.3]
+    unit_box = _bound_box(np.array([[-1, -1, -1], [1, 1, 1]]))
+
+    report("transform_points", args.sizes, lambda leg: geometry.transform_points(leg, matrix_world))
+    report("foot_weights", args.sizes, lambda leg: geometry.foot_weights(leg[:, 2], ankle_z=0.08))
+    report("toe_box_matrix", args.sizes,
+           lambda leg: geometry.toe_box_matrix(leg, matrix_world, _bound_box(leg), unit_box))
+    report("leg_alignment", args.sizes, lambda leg: geometry.leg_alignment(leg, matrix_world))
+    report("clamp_origin", args.sizes, lambda leg: geometry.clamp_origin(leg, np.array([0.05, 0, 0.3])))
+    report_points_in_polygons(args.sizes, polygon_count=1)
+    report_points_in_polygons(args.sizes, polygon_count=10)
+    report_slice_mesh(args.sizes)
+    report_offset_shell(args.sizes)
@@ -0,0 +1,317 @@
+"""
+Benchmarks that are run from within Blender, on synthetic meshes of increasing size.
+
+Run as follows: blender --background -noaudio --python ./benchmark_in_blender.py -- [--sizes 10000 100000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import bpy
+import mathutils
+import numpy as np
+
+# TODO(parlove@paxec.se): These statements import from the local git repository,
+# would be better to call the operator as registered within Blender
+from orthopen import geometry, helpers, stl
+from orthopen.operators import ORTHOPEN_OT_set_foot_pivot
+
+DEFAULT_SIZES = [10000, 100000, 500000, 2000000]
+
+
+def _synthetic_leg(vertex_count: int):
+    """
+    A point cloud roughly the size of a leg scan, 0.5 m high. Faces are not needed for these benchmarks.
+    """
+    mesh = bpy.data.meshes.new("benchmark_leg")
+    mesh.vertices.add(vertex_count)
+    vertices = np.random.default_rng(0).uniform((-0.1, -0.05, 0), (0.15, 0.05, 0.5), size=(vertex_count, 3))
+    mesh.vertices.foreach_set("co", vertices.astype(np.float32).ravel())
+    mesh.update()
+
+    leg = bpy.data.objects.new("benchmark_leg", mesh)
+    bpy.context.scene.collection.objects.link(leg)
+    bpy.context.view_layer.objects.active = leg
+
+    return leg
+
+def _synthetic_surface(vertex_count: int):
+    """
+    A wavy square grid surface with about the given number of vertices, as vertex and triangle arrays
+    """
+    side = max(int(np.sqrt(vertex_count)), 2)
+    x, y = np.meshgrid(np.linspace(0, 0.3, side), np.linspace(0, 0.3, side))
+    vertices = np.column_stack([x.ravel(), y.ravel(), 0.01 * np.sin(40 * x.ravel()) * np.cos(40 * y.ravel())])
+
+    # Two triangles per grid cell
+    index = np.arange(side * side).reshape(side, side)
+    corners = [index[:-1, :-1].ravel(), index[:-1, 1:].ravel(), index[1:, 1:].ravel(), index[1:, :-1].ravel()]
+    triangles = np.vstack([np.column_stack([corners[0], corners[1], corners[2]]),
+                           np.column_stack([corners[0], corners[2], corners[3]])])
+
+    return vertices, triangles
+
+def _synthetic_tube(vertex_count: int, radius: float = 0.05, height: float = 0.4):
+    """
+    An open tube around the Z axis with about the given number of vertices, as vertex and quad arrays.
+    It is closed around at every height, like a leg scan.
+    """
+    around = max(int(np.sqrt(4 * vertex_count)), 3)
+    rings = max(vertex_count // around, 2)
+    angle, z = np.meshgrid(np.linspace(0, 2 * np.pi, around, endpoint=False), np.linspace(0, height, rings))
+    vertices = np.column_stack([radius * np.cos(angle.ravel()), radius * np.sin(angle.ravel()), z.ravel()])
+
+    index = np.arange(rings * around).reshape(rings, around)
+    following = np.roll(index, -1, axis=1)
+    quads = np.column_stack([index[:-1].ravel(), following[:-1].ravel(), following[1:].ravel(), index[1:].ravel()])
+
+    return vertices, quads
+
+def _remove(object: bpy.types.Object):
+    mesh = object.data
+    bpy.data.objects.remove(object, do_unlink=True)
+    bpy.data.meshes.remove(mesh)
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+def _legacy_weight_paint(foot: bpy.types.VertexGroup, ankle_point: mathutils.Vector):
+    """
+    ORTHOPEN_OT_set_foot_pivot._weight_paint as it was before it was vectorized
+    """
+    foot.add(index=[v.index for v in bpy.context.active_object.data.vertices], weight=0, type='REPLACE')
+
+    for vertex in bpy.context.active_object.data.vertices:
+        diff_from_ankle = vertex.co - ankle_point
+
+        if diff_from_ankle.z >= 0:
+            DEFORM_ZONE = 0.02
+            weight = np.clip(1 - diff_from_ankle.z / DEFORM_ZONE, 0, 1)
+        else:
+            weight = 1
+
+        foot.add(index=[vertex.index], weight=weight, type='REPLACE')
+
+def benchmark_weight_paint(sizes: list):
+    print("\nWeight painting the foot (ORTHOPEN_OT_set_foot_pivot._weight_paint)")
+    print(f"{'vertices':>10} {'loop [s]':>10} {'numpy [s]':>10} {'speedup':>8} {'max diff':>9}")
+
+    ankle_point = mathutils.Vector((0, 0, 0.1))
+    for size in sizes:
+        leg = _synthetic_leg(size)
+        legacy_group = leg.vertex_groups.new(name="legacy")
+        vectorized_group = leg.vertex_groups.new(name="vectorized")
+
+        legacy_time = _timed(_legacy_weight_paint, legacy_group, ankle_point)
+        vectorized_time = _timed(ORTHOPEN_OT_set_foot_pivot._weight_paint, vectorized_group, ankle_point)
+
+        # Compare a sample of the weights, reading all of them back would take longer than the benchmark
+        sample = np.random.default_rng(1).choice(size, size=min(size, 1000), replace=False)
+        max_diff = max(abs(legacy_group.weight(int(i)) - vectorized_group.weight(int(i))) for i in sample)
+
+        print(f"{size:>10} {legacy_time:>10.3f} {vectorized_time:>10.3f} {legacy_time / vectorized_time:>8.1f} "
+              f"{max_diff:>9.4f}")
+        _remove(leg)
+
+def benchmark_stl_import(sizes: list):
+    print("\nImporting binary STL (ORTHOPEN_OT_import_file)")
+    print(f"{'vertices':>10} {'size [MB]':>10} {'stock [s]':>10} {'fast [s]':>10} {'speedup':>8}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, f"surface_{size}.stl")
+            stl.write_binary(path, *_synthetic_surface(size))
+
+            old_objects = set(bpy.data.objects)
+            stock_time = _timed(bpy.ops.import_mesh.stl, filepath=path)
+            fast_time = _timed(lambda: helpers.add_mesh_object("fast_import", *stl.read(path)))
+
+            print(f"{size:>10} {os.path.getsize(path) / 1E6:>10.1f} {stock_time:>10.3f} {fast_time:>10.3f} "
+                  f"{stock_time / fast_time:>8.1f}")
+            for object in set(bpy.data.objects) - old_objects:
+                _remove(object)
+
+def benchmark_spatial_index(sizes: list, query_count: int = 100):
+    print(f"\nNeighbourhood queries, {query_count} points with a 15 mm radius (helpers.vertices_near)")
+    print(f"{'vertices':>10} {'kd tree [s]':>12} {'sort [s]':>9} {'linear [ms]':>12} {'slab [ms]':>10} "
+          f"{'speedup':>8}")
+
+    RADIUS = 0.015
+    for size in sizes:
+        leg = _synthetic_leg(size)
+        points = helpers.vertex_coordinates(leg)[np.random.default_rng(1).choice(size, size=query_count)]
+
+        # What the first query costs, the tree is only built for comparison
+        tree_time = _timed(helpers.kd_tree, leg)
+        sort_time = _timed(helpers.vertex_order, leg, 2)
+
+        def linear():
+            vertices_world = helpers.vertex_coordinates(leg, space='WORLD')
+            for point in points:
+                np.flatnonzero(np.linalg.norm(vertices_world - point, axis=1) <= RADIUS)
+
+        def slab():
+            for point in points:
+                helpers.vertices_near(leg, point, RADIUS)
+
+        linear_time, slab_time = _timed(linear), _timed(slab)
+        print(f"{size:>10} {tree_time:>12.3f} {sort_time:>9.3f} {1000 * linear_time / query_count:>12.3f} "
+              f"{1000 * slab_time / query_count:>10.3f} {linear_time / slab_time:>8.1f}")
+        _remove(leg)
+
+def benchmark_deviation(sizes: list, search_distance: float = 0.01):
+    print("\nDistance from every vertex to another surface 2 mm away (helpers.nearest_surface_points)")
+    print(f"{'vertices':>10} {'build [s]':>10} {'query [s]':>10} {'bounded [s]':>12} {'Mvertices/s':>12}")
+
+    for size in sizes:
+        vertices, triangles = _synthetic_surface(size)
+        reference = helpers.add_mesh_object("benchmark_reference", vertices + [0, 0, 0.002], triangles)
+
+        # The first query builds the BVH tree of the reference. Compare with the search distance of
+        # ORTHOPEN_OT_deviation_heatmap, at its default color range
+        build_time = _timed(helpers.nearest_surface_points, reference, vertices[:1])
+        query_time = _timed(helpers.nearest_surface_points, reference, vertices)
+        bounded_time = _timed(helpers.nearest_surface_points, reference, vertices, max_distance=search_distance)
+        print(f"{len(vertices):>10} {build_time:>10.3f} {query_time:>10.3f} {bounded_time:>12.3f} "
+              f"{len(vertices) / bounded_time / 1E6:>12.2f}")
+        _remove(reference)
+
+def benchmark_registration(sizes: list):
+    print("\nSnapping a moved copy of a surface back onto it (geometry.register_points, helpers.closest_point_search)")
+    print(f"{'vertices':>10} {'total [s]':>10} {'builds [s]':>11} {'queries [s]':>12} {'iterations':>11} "
+          f"{'us/query':>9} {'error [mm]':>11}")
+
+    moved = np.array(mathutils.Matrix.Translation((0.004, -0.002, 0.003)) @ mathutils.Matrix.Rotation(0.05, 4, 'Z'))
+    for size in sizes:
+        vertices, _ = _synthetic_surface(size)
+
+        # A tree is built for each level and queried once per point, time those calls on their own
+        query_counts, query_times, build_times = [], [], []
+
+        def closest_point_search(points):
+            start = time.perf_counter()
+            search = helpers.closest_point_search(points)
+            build_times.append(time.perf_counter() - start)
+
+            def timed_search(queries):
+                query_counts.append(len(queries))
+                start = time.perf_counter()
+                indices = search(queries)
+                query_times.append(time.perf_counter() - start)
+                return indices
+            return timed_search
+
+        start = time.perf_counter()
+        matrix, residuals = geometry.register_points(geometry.transform_points(vertices, moved), vertices,
+                                                     closest_point_search)
+        total_time = time.perf_counter() - start
+
+        # How far the snapped copy is from where it started
+        error = np.amax(np.linalg.norm(geometry.transform_points(vertices, matrix @ moved) - vertices, axis=1))
+        print(f"{len(vertices):>10} {total_time:>10.3f} {sum(build_times):>11.3f} {sum(query_times):>12.3f} "
+              f"{len(residuals):>11} {1E6 * sum(query_times) / max(sum(query_counts), 1):>9.2f} "
+              f"{1000 * error:>11.3f}")
+
+def benchmark_ankle_smoothing(sizes: list, repeat: int = 3):
+    print("\nCorrective smoothing of a 30 mm band of a 0.5 m leg (ORTHOPEN_OT_set_foot_pivot)")
+    print(f"{'vertices':>10} {'band':>8} {'band group [s]':>15} {'whole leg [s]':>14} {'band only [s]':>14}")
+
+    def evaluation_time(vertices, faces, band=None):
+        leg = helpers.add_mesh_object("benchmark_leg", vertices, faces)
+        # Stands in for the armature, every change of the displacement evaluates the smoothing again
+        displace = leg.modifiers.new(name="displace", type='DISPLACE')
+        smooth = leg.modifiers.new(name="smooth", type='CORRECTIVE_SMOOTH')
+        smooth.factor = 1
+        smooth.iterations = ORTHOPEN_OT_set_foot_pivot._SMOOTH_ITERATIONS
+        if band is not None:
+            group = leg.vertex_groups.new(name="band")
+            group.add(index=np.flatnonzero(band).tolist(), weight=1, type='REPLACE')
+            smooth.vertex_group = group.name
+
+        def evaluate(strength):
+            displace.strength = strength
+            bpy.context.view_layer.update()
+
+        seconds = min(_timed(evaluate, 0.001 * (i + 1)) for i in range(repeat))
+        _remove(leg)
+        return seconds
+
+    for size in sizes:
+        vertices, quads = _synthetic_tube(size, 0.05, 0.5)
+        band = (vertices[:, 2] >= 0.1) & (vertices[:, 2] <= 0.13)
+
+        # The band on its own, as a mesh of just those vertices
+        band_index = np.cumsum(band) - 1
+        band_quads = band_index[quads[np.all(band[quads], axis=1)]]
+
+        print(f"{size:>10} {np.count_nonzero(band):>8} {evaluation_time(vertices, quads, band):>15.3f} "
+              f"{evaluation_time(vertices, quads):>14.3f} {evaluation_time(vertices[band], band_quads):>14.3f}")
+
+def benchmark_profile_refit(sizes: list, cosmetics_size: int = 20000):
+    print("\nRefitting the cosmetics to a measured profile after a redo (helpers.circumference_profile)")
+    print(f"{'vertices':>10} {'measure [ms]':>13} {'redo [ms]':>10}")
+
+    cosmetics = helpers.add_mesh_object("benchmark_cosmetics", *_synthetic_tube(cosmetics_size, 0.04, 0.2))
+    for size in sizes:
+        scan = helpers.add_mesh_object("benchmark_scan", *_synthetic_tube(size))
+        measure_time = _timed(helpers.circumference_profile, scan)
+
+        def redo():
+            # A redo undoes first, and the depsgraph reports the geometry of both objects as changed
+            for id_data in (scan, scan.data, cosmetics, cosmetics.data):
+                helpers.clear_cached_geometry(id_data)
+            heights, profile = helpers.circumference_profile(scan)
+            fitted = geometry.fit_rings_to_profile(helpers.vertex_coordinates(cosmetics),
+                                                   np.array(cosmetics.matrix_world), heights, profile)
+            cosmetics.data.vertices.foreach_set("co", fitted.astype(np.float32).ravel())
+            cosmetics.data.update()
+
+        print(f"{size:>10} {1000 * measure_time:>13.1f} {1000 * _timed(redo):>10.1f}")
+        _remove(scan)
+    _remove(cosmetics)
+
+def benchmark_splint_shell_redo(sizes: list):
+    print("\nChanging the thickness of a splint shell in the redo panel (orthopen.generate_splint_shell)")
+    print(f"{'vertices':>10} {'first [ms]':>11} {'redo [ms]':>10}")
+
+    for size in sizes:
+        scan = helpers.add_mesh_object("benchmark_scan", *_synthetic_tube(size))
+        scan.scale = (1.2, 1.2, 1.0)
+        # Cover the lower half of the tube
+        scan.data.vertices.foreach_set("select", helpers.vertex_coordinates(scan)[:, 2] < 0.2)
+
+        def generate(thickness):
+            # A redo undoes first, which removes the shell and reports the geometry of the scan as changed
+            for shell in [o for o in bpy.data.objects if o.name.startswith("benchmark_scan_shell")]:
+                _remove(shell)
+            helpers.clear_cached_geometry(scan)
+            helpers.clear_cached_geometry(scan.data)
+            bpy.ops.object.select_all(action='DESELECT')
+            bpy.context.view_layer.objects.active = scan
+            bpy.ops.orthopen.generate_splint_shell(thickness=thickness)
+
+        first_time = _timed(generate, 0.003)
+        print(f"{size:>10} {1000 * first_time:>11.1f} {1000 * _timed(generate, 0.004):>10.1f}")
+        for shell in [o for o in bpy.data.objects if o.name.startswith("benchmark_scan_shell")]:
+            _remove(shell)
+        _remove(scan)
+
+if __name__ == "__main__":
+    import sys
+    # Only parse arguments after "--", the rest are for Blender
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(description="Benchmark OrthOpen functions on synthetic meshes")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Number of vertices")
+    args = parser.parse_args(argv)
+
+    benchmark_weight_paint(args.sizes)
+    benchmark_stl_import(args.sizes)
+    benchmark_spatial_index(args.sizes)
+    benchmark_deviation(args.sizes)
+    benchmark_registration(args.sizes)
+    benchmark_ankle_smoothing(args.sizes)
+    benchmark_profile_refit(args.sizes)
+    benchmark_splint_shell_redo(args.sizes)
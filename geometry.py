@@ -0,0 +1,1059 @@
+"""
+Geometry computations on plain numpy arrays of vertices, faces and matrices. Does not depend on bpy, so
+this can be unit tested, profiled and run in worker processes outside of Blender. The operators only
+have to read the arrays from Blender and write back the results.
+
+Matrices are 4x4 homogeneous transformation matrices, and points are row vectors (Nx3).
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# Closed or open contours where a mesh was cut by horizontal planes, see slice_mesh()
+CrossSections = namedtuple('CrossSections', ['height_index', 'perimeter', 'area', 'closed', 'contours'])
+
+# A cylinder, e.g. a prosthesis tube, see fit_cylinder()
+Cylinder = namedtuple('Cylinder', ['center', 'axis', 'radius'])
+
+# How far a part is from a scan, and where it goes into it, see clearance()
+Clearance = namedtuple('Clearance', ['min_distance', 'region_count', 'penetrating_vertices', 'intersecting_faces'])
+
+
+def transform_points(points: np.ndarray, matrix: np.ndarray):
+    """
+    Apply a transformation matrix to points.
+
+    Args:
+        points (np.array): Nx3 array
+        matrix (np.array): 4x4 transformation matrix
+
+    Returns:
+        np.array: Nx3 array of transformed points
+    """
+    matrix = np.asarray(matrix)
+
+    # For order of multiplication, remember (A * B)^T = B^T * A^T
+    return np.asarray(points) @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+def object_size(bound_box: np.ndarray, scale: np.ndarray):
+    """
+    Calculate the size of an object.
+
+    Args:
+        bound_box (np.array): 8x3 corners of the bounding box in object coordinates
+        scale (np.array): Scale of the object along x, y, z
+
+    Returns:
+        np.array: Size in x,y,z direction
+    """
+    diff = np.amax(bound_box, axis=0) - np.amin(bound_box, axis=0)
+
+    # The bounding box has to be scaled
+    return diff * np.asarray(scale)
+
+
+def bound_box_world(bound_box: np.ndarray, matrix_world: np.ndarray):
+    """
+    Get the corners of a bounding box in world coordinates.
+
+    Args:
+        bound_box (np.array): 8x3 corners of the bounding box in object coordinates
+        matrix_world (np.array): 4x4 object to world transformation
+
+    Returns:
+        np.array: 8x3 corners in world coordinates
+    """
+    return transform_points(bound_box, matrix_world)
+
+
+def box_distances(points: np.ndarray, bound_box: np.ndarray):
+    """
+    Distance from points to a bounding box. No surface inside the box is closer than this, so it is a cheap
+    way to skip points before searching for the closest surface point.
+
+    Args:
+        points (np.array): Nx3 points
+        bound_box (np.array): 8x3 corners of an axis aligned bounding box
+
+    Returns:
+        np.array: N distances, 0 for points inside the box
+    """
+    box_min, box_max = np.amin(bound_box, axis=0), np.amax(bound_box, axis=0)
+    outside = np.maximum(np.maximum(box_min - points, points - box_max), 0)
+    return np.linalg.norm(outside, axis=1)
+
+
+def foot_weights(vertices_z: np.ndarray, ankle_z: float, deform_zone: float = 0.02, levels: int = 64):
+    """
+    Weights for deforming a foot around the ankle with an armature. Everything below the ankle moves
+    as a solid object, and then the weight decreases linearly from 1 to 0 in a zone above the ankle.
+
+    Args:
+        vertices_z (np.array): Z coordinate of each vertex
+        ankle_z (float): Z coordinate of the ankle
+        deform_zone (float): Height of the zone above the ankle where the weight goes to zero
+        levels (int): Weights are rounded to this many levels between 0 and 1. Writing weights to
+                      Blender is expensive per weight value, see ORTHOPEN_OT_set_foot_pivot._weight_paint
+
+    Returns:
+        np.array: Weight of each vertex
+    """
+    weights = np.clip(1 - (np.asarray(vertices_z) - ankle_z) / deform_zone, 0, 1)
+    return np.round(weights * levels) / levels
+
+
+def toe_box_matrix(leg_vertices: np.ndarray, leg_matrix_world: np.ndarray, leg_bound_box: np.ndarray,
+                   toe_box_bound_box: np.ndarray, x_order: np.ndarray = None):
+    """
+    Scale and position a toe box so it fits around the toes of a foot. The leg is assumed to be aligned
+    with toes along +X and the leg along +Z.
+
+    Args:
+        leg_vertices (np.array): Nx3 vertices of the leg, object coordinates
+        leg_matrix_world (np.array): 4x4 object to world transformation of the leg
+        leg_bound_box (np.array): 8x3 bounding box of the leg, object coordinates
+        toe_box_bound_box (np.array): 8x3 bounding box of the toe box mesh, object coordinates
+        x_order (np.array): Optional indices of the leg vertices sorted by X, e.g. cached by helpers. Then
+                            only the toes are visited, instead of all vertices
+
+    Returns:
+        np.array: 4x4 world matrix for the toe box
+    """
+    if x_order is None:
+        x_min, x_max = np.amin(leg_vertices[:, 0]), np.amax(leg_vertices[:, 0])
+    else:
+        x_min, x_max = leg_vertices[x_order[0], 0], leg_vertices[x_order[-1], 0]
+
+    # Due to the L-shaped geometry of a leg and a foot, we can get the approximate length of the foot like this
+    foot_length_x = x_max - x_min
+
+    # The toes point in the x direction, so we find the toes by selecting all vertices
+    # a bit behind the largest x coordinate
+    sel_range_x_to_get_toes_only = foot_length_x * 0.22
+    if x_order is None:
+        toe_vertices = leg_vertices[leg_vertices[:, 0] > (x_max - sel_range_x_to_get_toes_only), :]
+    else:
+        # The toes are at the end of the sort order, search it without gathering all X coordinates
+        first_toe = np.searchsorted(leg_vertices[:, 0], x_max - sel_range_x_to_get_toes_only, side='right',
+                                    sorter=x_order)
+        toe_vertices = leg_vertices[x_order[first_toe:], :]
+    toe_size = np.amax(toe_vertices, axis=0) - np.amin(toe_vertices, axis=0)
+
+    # Calculate how the toe box should be scaled to fit around the toes
+    toe_box_size = np.amax(toe_box_bound_box, axis=0) - np.amin(toe_box_bound_box, axis=0)
+    RATIO_OF_FOOT_BOX_SHOULD_COVER = 0.45
+    CLEARANCE_IN_FRONT_OF_TOES = 0.015
+    target_scale = np.array([(RATIO_OF_FOOT_BOX_SHOULD_COVER * foot_length_x + CLEARANCE_IN_FRONT_OF_TOES) /
+                             toe_box_size[0],
+                             toe_size[1] / toe_box_size[1],
+                             toe_size[2] / toe_box_size[2]])
+
+    # Place toe box at center of toes, with the closed end a little bit in front of the toes
+    target_position = transform_points(np.mean(toe_vertices, axis=0, keepdims=True), leg_matrix_world)[0]
+    toe_box_origin_to_x_max = np.amax(toe_box_bound_box[:, 0]) * target_scale[0]
+    foot_x_max = (np.amax(bound_box_world(leg_bound_box, leg_matrix_world), axis=0))[0]
+    target_position[0] = foot_x_max - toe_box_origin_to_x_max + CLEARANCE_IN_FRONT_OF_TOES
+
+    # Compose homog. transformation matrix
+    mat = np.eye(4)
+    mat[:3, :3] = np.diag(target_scale)
+    mat[:3, 3] = target_position
+    return mat
+
+
+def clamp_origin(vertices_world: np.ndarray, intersection_world: np.ndarray):
+    """
+    Estimate the center of a prosthesis tube at the height of a point on its surface.
+
+    Args:
+        vertices_world (np.array): Nx3 vertices of the tube, world coordinates
+        intersection_world (np.array): Point on the tube surface, world coordinates
+
+    Returns:
+        np.array: Center point of the tube, 'None' if it could not be estimated
+    """
+    # Assume the prosthesis tube is perfectly cylindrical and parallel to the world Z-axis. Select
+    # vertices symmetrically around the ray cast intersection.
+    squared_distances_z = (vertices_world[:, 2] - intersection_world[2])**2
+    Z_SELECTION_METERS = 0.015
+    selected_vertices = vertices_world[squared_distances_z < Z_SELECTION_METERS**2, :]
+
+    # Likely to happen for a tube created in blender, these have few vertices along their length per default
+    MINIMUM_VERTICES_FOR_VALID_RESULT = 5
+
+    if selected_vertices.shape[0] < MINIMUM_VERTICES_FOR_VALID_RESULT:
+        return None
+
+    # This should be the center point of a vertical tube section
+    return np.mean(selected_vertices, axis=0)
+
+
+def points_in_polygons(points: np.ndarray, polygons: list):
+    """
+    Check which points are inside each of a number of polygons, using the crossing number algorithm: a
+    point is inside if a ray from it in the +X direction crosses the polygon border an odd number of times.
+    Points exactly on a border may be classified as either inside or outside.
+
+    All points and polygon edges are processed at once. Points are sorted by Y, so each edge is only
+    compared to the points in its Y range, rather than to all points.
+
+    Args:
+        points (np.array): Nx2 array of points
+        polygons (list): Polygons as Kx2 arrays of corners, in order. The last corner connects to the first
+
+    Returns:
+        np.array: PxN array of bool, True where point n is inside polygon p
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(polygons) == 0 or points.shape[0] == 0:
+        return np.zeros((len(polygons), points.shape[0]), dtype=bool)
+
+    # All edges of all polygons, from each corner to the next
+    starts = [np.asarray(polygon, dtype=np.float64).reshape(-1, 2) for polygon in polygons]
+    ends = np.vstack([np.roll(start, -1, axis=0) for start in starts])
+    polygon_of_edge = np.repeat(np.arange(len(starts)), [start.shape[0] for start in starts])
+    starts = np.vstack(starts)
+
+    # Edges cross horizontal lines with y in the half open range [y_low, y_high), so a ray through a
+    # corner is only counted once. Horizontal edges are never crossed
+    y_low, y_high = np.minimum(starts[:, 1], ends[:, 1]), np.maximum(starts[:, 1], ends[:, 1])
+    order = np.argsort(points[:, 1], kind='stable')
+    sorted_y = points[order, 1]
+    first = np.searchsorted(sorted_y, y_low, side='left')
+    count = np.searchsorted(sorted_y, y_high, side='left') - first
+
+    # One row per (edge, point within its Y range)
+    edge = np.repeat(np.arange(starts.shape[0]), count)
+    point = order[np.arange(edge.shape[0]) - np.repeat(np.cumsum(count) - count, count) + np.repeat(first, count)]
+
+    # X coordinate where the edge crosses the horizontal line through the point
+    start, end = starts[edge], ends[edge]
+    slope = (end[:, 0] - start[:, 0]) / (end[:, 1] - start[:, 1])
+    x_crossing = start[:, 0] + (points[point, 1] - start[:, 1]) * slope
+    crossed = x_crossing > points[point, 0]
+
+    crossings = np.bincount(polygon_of_edge[edge[crossed]] * points.shape[0] + point[crossed],
+                            minlength=len(polygons) * points.shape[0])
+    return (crossings % 2 == 1).reshape(len(polygons), points.shape[0])
+
+
+def points_in_polygon(points: np.ndarray, polygon: np.ndarray):
+    """
+    Check which points are inside a polygon, see points_in_polygons().
+
+    Args:
+        points (np.array): Nx2 array of points
+        polygon (np.array): Kx2 array of corners, in order
+
+    Returns:
+        np.array: N bools, True for points inside the polygon
+    """
+    return points_in_polygons(points, [polygon])[0]
+
+
+def slice_mesh(vertices: np.ndarray, triangles: np.ndarray, heights: np.ndarray):
+    """
+    Cut a triangle mesh with horizontal planes at many heights at once.
+
+    Every (triangle, height) pair where the plane crosses the triangle gives one line segment. Segments are
+    directed by the winding of the triangles, so on a consistently oriented mesh the end of one segment is
+    the start of the segment in the neighbouring triangle. The segments are then chained into contours with
+    pointer jumping, which needs log2(longest contour) vectorized steps instead of a loop per segment.
+
+    A vertex exactly at a cut height counts as above it, so every crossing lies strictly inside an edge.
+
+    Args:
+        vertices (np.array): Nx3 vertices
+        triangles (np.array): Mx3 vertex indices
+        heights (np.array): Z coordinates of the planes, in increasing order
+
+    Returns:
+        CrossSections: For each contour, the index of its height, perimeter, area in the XY plane, whether
+                       it is closed, and its corners (Kx2 XY coordinates in order). Open contours are found
+                       where the mesh has holes or inconsistent face orientation
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.int64)
+    heights = np.asarray(heights, dtype=np.float64)
+
+    # Heights in (z_min, z_max] cross a triangle, find them for all triangles at once
+    corner_z = np.ascontiguousarray(vertices[:, 2])[triangles]
+    z_min = np.minimum(np.minimum(corner_z[:, 0], corner_z[:, 1]), corner_z[:, 2])
+    z_max = np.maximum(np.maximum(corner_z[:, 0], corner_z[:, 1]), corner_z[:, 2])
+    first = np.searchsorted(heights, z_min, side='right')
+    count = np.searchsorted(heights, z_max, side='right') - first
+    face = np.repeat(np.arange(triangles.shape[0]), count)
+    height_index = np.arange(face.shape[0]) - np.repeat(np.cumsum(count) - count, count) + np.repeat(first, count)
+    if face.shape[0] == 0:
+        return CrossSections(np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros(0, dtype=bool), [])
+
+    # Edge k goes from corner k to corner k + 1. Each crossed triangle has one edge going up through the plane,
+    # where its segment starts, and one going down, where it ends
+    above = corner_z[face] >= heights[height_index, np.newaxis]
+    above_next = np.roll(above, -1, axis=1)
+    up_edge = np.argmax(~above & above_next, axis=1)
+    down_edge = np.argmax(above & ~above_next, axis=1)
+
+    def crossing(edge):
+        a = triangles[face, edge]
+        b = triangles[face, (edge + 1) % 3]
+        t = (heights[height_index] - vertices[a, 2]) / (vertices[b, 2] - vertices[a, 2])
+        point = vertices[a, :2] + t[:, np.newaxis] * (vertices[b, :2] - vertices[a, :2])
+
+        # A crossing is identified by its edge, with sorted vertex indices, and its height
+        key = (np.minimum(a, b) * vertices.shape[0] + np.maximum(a, b)) * heights.shape[0] + height_index
+        return point, key
+
+    start, start_key = crossing(up_edge)
+    end, end_key = crossing(down_edge)
+
+    # The next segment starts where this one ends. Segments without a next one end an open contour, they
+    # point to themselves
+    segment_count = face.shape[0]
+    keys, crossing_id = np.unique(np.concatenate([start_key, end_key]), return_inverse=True)
+    segment_starting_at = np.full(keys.shape[0], -1)
+    segment_starting_at[crossing_id[:segment_count]] = np.arange(segment_count)
+    next_segment = segment_starting_at[crossing_id[segment_count:]]
+    is_end = next_segment < 0
+    next_segment[is_end] = np.flatnonzero(is_end)
+
+    # A contour cannot be longer than the number of segments at its height, which bounds the number of steps
+    steps = int(np.ceil(np.log2(np.amax(np.bincount(height_index))))) + 1
+
+    # Pointer jumping. Afterwards jump[s] is the end of an open contour, or somewhere on a closed contour,
+    # and lowest[s] is the lowest segment index along the way, i.e. on the whole closed contour
+    jump, lowest = next_segment.copy(), np.minimum(np.arange(segment_count), next_segment)
+    for _ in range(steps):
+        lowest = np.minimum(lowest, lowest[jump])
+        jump = jump[jump]
+    closed = ~is_end[jump]
+    label = np.where(closed, lowest, jump)
+
+    # Order the segments in each contour by their distance to its last segment. A closed contour is opened
+    # before its lowest segment
+    successor = np.where(closed & (next_segment == label), np.arange(segment_count), next_segment)
+    is_last = successor == np.arange(segment_count)
+    distance = (~is_last).astype(np.int64)
+    for _ in range(steps):
+        distance = distance + distance[successor]
+        successor = successor[successor]
+
+    # Each contour is labelled by one of its own segments. Contours are numbered from the lowest height up
+    contour_labels = np.flatnonzero(label == np.arange(segment_count))
+    contour_labels = contour_labels[np.argsort(height_index[contour_labels], kind='stable')]
+    contour_of_label = np.empty(segment_count, dtype=np.int64)
+    contour_of_label[contour_labels] = np.arange(contour_labels.shape[0])
+    contour_index = contour_of_label[label]
+    order = np.lexsort((-distance, contour_index))
+
+    # Perimeter, and area with the shoelace formula
+    lengths = np.linalg.norm(end - start, axis=1)
+    cross = start[:, 0] * end[:, 1] - end[:, 0] * start[:, 1]
+    perimeter = np.bincount(contour_index, weights=lengths, minlength=contour_labels.shape[0])
+    area = np.abs(np.bincount(contour_index, weights=cross, minlength=contour_labels.shape[0])) / 2
+
+    splits = np.cumsum(np.bincount(contour_index))[:-1]
+    return CrossSections(height_index[contour_labels], perimeter, area, closed[contour_labels],
+                         np.split(start[order], splits))
+
+
+def circumference_profile(sections: CrossSections, height_count: int):
+    """
+    The circumference at each height of a body that was cut with slice_mesh(). If there are several closed
+    contours at a height, e.g. a scan with both legs, the one with the largest area is used.
+
+    Args:
+        sections (CrossSections): What slice_mesh() returned
+        height_count (int): Number of heights the mesh was cut at
+
+    Returns:
+        np.array: Circumference at each height, NaN where there is no closed contour
+    """
+    profile = np.full(height_count, np.nan)
+    closed = np.flatnonzero(sections.closed)
+
+    # Sorted by area, so the largest contour at each height is written last
+    closed = closed[np.argsort(sections.area[closed], kind='stable')]
+    profile[sections.height_index[closed]] = sections.perimeter[closed]
+    return profile
+
+
+def calf_circumference(profile: np.ndarray, drop: float = 0.02):
+    """
+    Find the calf in the circumference profile of a leg standing upright. Going up from the ankle, which is the
+    narrowest part of the lower half of the leg, the calf is the first peak: the largest circumference before it
+    gets noticeably smaller again. Higher up, the knee or thigh may be wider, so they must not be included, just
+    like the horizontal cuts through the foot below the ankle.
+
+    Args:
+        profile (np.array): Circumference at evenly spaced heights from the bottom up, NaN where unknown
+        drop (float): How much smaller than the peak, relatively, the circumference must get above the calf.
+            Smaller dips are taken as noise of the scan
+
+    Returns:
+        (int, float): Index of the height of the calf, and its circumference. 'None' if not found
+    """
+    profile = np.asarray(profile, dtype=np.float64)
+    measured = np.isfinite(profile)
+    if not np.any(measured[:profile.shape[0] // 2]):
+        return None
+
+    ankle = np.argmin(np.where(measured, profile, np.inf)[:profile.shape[0] // 2])
+    above_ankle = np.flatnonzero(measured)
+    above_ankle = above_ankle[above_ankle > ankle]
+    if above_ankle.shape[0] == 0:
+        return None
+
+    # Stop at the first height that is clearly below the largest circumference so far
+    values = profile[above_ankle]
+    dropped = np.flatnonzero(values < np.maximum.accumulate(values) * (1 - drop))
+    end = dropped[0] if dropped.shape[0] else values.shape[0]
+    calf = int(above_ankle[np.argmax(values[:end])])
+    return calf, float(profile[calf])
+
+
+def fit_rings_to_profile(vertices: np.ndarray, matrix_world: np.ndarray, heights: np.ndarray, profile: np.ndarray,
+                         tolerance: float = 1.E-4):
+    """
+    Scale each horizontal ring of vertices of e.g. the prosthesis cosmetics, so its circumference matches a
+    circumference profile measured on the sound leg at the same height. Like the uniform fitting, a ring is
+    approximated as a circle, or a half circle, with the largest of its X and Y extent as the diameter.
+
+    Rings are scaled in X and Y around the origin of the object, so the object must not be rotated.
+
+    Args:
+        vertices (np.array): Nx3 vertices, object coordinates
+        matrix_world (np.array): 4x4 object to world transformation
+        heights (np.array): World Z coordinates of the profile, in increasing order
+        profile (np.array): Circumference at each height, NaN where unknown
+        tolerance (float): Vertices closer than this in world Z belong to the same ring
+
+    Returns:
+        np.array: Nx3 fitted vertices, object coordinates. Same as the input if the profile is all NaN
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    measured = np.isfinite(profile)
+    if not np.any(measured) or vertices.shape[0] == 0:
+        return vertices.copy()
+
+    # Group the vertices into rings by world height, and sort them so each ring is a contiguous slice
+    world = transform_points(vertices, matrix_world)
+    _, ring = np.unique(np.round(world[:, 2] / tolerance).astype(np.int64), return_inverse=True)
+    ring = ring.ravel()
+    order = np.argsort(ring, kind='stable')
+    ring_start = np.flatnonzero(np.r_[True, np.diff(ring[order]) != 0])
+
+    sorted_world = world[order]
+    extent = np.maximum.reduceat(sorted_world[:, :2], ring_start) - np.minimum.reduceat(sorted_world[:, :2], ring_start)
+    diameter = np.amax(extent, axis=1)
+    ring_z = sorted_world[ring_start, 2]
+
+    # Outside the measured heights, the closest measurement is used
+    target_diameter = np.interp(ring_z, np.asarray(heights)[measured], np.asarray(profile)[measured]) / np.pi
+    factor = np.ones(ring_start.shape[0])
+    np.divide(target_diameter, diameter, out=factor, where=diameter > tolerance)
+
+    fitted = vertices.copy()
+    fitted[:, :2] *= factor[ring, np.newaxis]
+    return fitted
+
+
+def fit_cylinder(points: np.ndarray, normals: np.ndarray, reference_point: np.ndarray, iterations: int = 128,
+                 inlier_distance: float = 0.001, seed: int = 0):
+    """
+    Fit a cylinder to a neighbourhood of points on e.g. a prosthesis tube, which may be tilted.
+
+    The axis is the direction that is most perpendicular to all normals, i.e. the eigenvector of the normal
+    covariance with the smallest eigenvalue. The points are then projected on a plane perpendicular to the
+    axis, and a circle is fitted with RANSAC: circles through many random triplets of points are tested at
+    once, and the one with most inliers is refined with a least squares fit. Points on other surfaces in
+    the neighbourhood, e.g. a socket, end up as outliers. The axis is estimated once more from the inliers.
+
+    Args:
+        points (np.array): Nx3 points
+        normals (np.array): Nx3 normals of the points, need not be normalized
+        reference_point (np.array): The returned center is where the axis passes this point, e.g. where the
+                                    user clicked
+        iterations (int): Number of random circles to test
+        inlier_distance (float): Largest distance from the circle for a point to count as an inlier
+        seed (int): Seed for the random sampling, so the result is repeatable
+
+    Returns:
+        Cylinder: Center on the axis, unit axis pointing upwards, and radius. 'None' if the points do not
+                  look like a cylinder, e.g. if they are on a plane
+    """
+    MINIMUM_POINTS = 10
+    points = np.asarray(points, dtype=np.float64)
+    normals = np.asarray(normals, dtype=np.float64)
+    lengths = np.linalg.norm(normals, axis=1)
+    usable = lengths > 0
+    points, normals = points[usable], normals[usable] / lengths[usable, np.newaxis]
+    if points.shape[0] < MINIMUM_POINTS:
+        return None
+
+    rng = np.random.default_rng(seed)
+    inliers = np.ones(points.shape[0], dtype=bool)
+    for _ in range(2):
+        # On a plane, or a small patch of a cylinder, the normals are all about the same. Then two
+        # eigenvalues are small, and the axis could be any direction in the plane
+        eigenvalues, eigenvectors = np.linalg.eigh(normals[inliers].T @ normals[inliers])
+        if eigenvalues[1] < 0.05 * eigenvalues[2]:
+            return None
+        axis = eigenvectors[:, 0] if eigenvectors[2, 0] >= 0 else -eigenvectors[:, 0]
+
+        # Orthonormal coordinates in the plane perpendicular to the axis
+        u = np.cross(axis, [1, 0, 0] if abs(axis[0]) < 0.9 else [0, 1, 0])
+        u /= np.linalg.norm(u)
+        plane = np.column_stack([u, np.cross(axis, u)])
+        xy = points @ plane
+
+        centers, radii = _circumcircles(xy[rng.integers(0, xy.shape[0], size=(iterations, 3))])
+        distances = np.abs(np.linalg.norm(xy[np.newaxis, :, :] - centers[:, np.newaxis, :], axis=2) -
+                           radii[:, np.newaxis])
+        inlier_counts = np.sum(distances < inlier_distance, axis=1)
+        inliers = distances[np.argmax(inlier_counts)] < inlier_distance
+        if np.sum(inliers) < MINIMUM_POINTS:
+            return None
+
+    # Least squares circle on the inliers: x^2 + y^2 = 2 a x + 2 b y + c, with radius^2 = c + a^2 + b^2
+    x, y = xy[inliers, 0], xy[inliers, 1]
+    (a, b, c), *_ = np.linalg.lstsq(np.column_stack([2 * x, 2 * y, np.ones(x.shape[0])]), x**2 + y**2, rcond=None)
+    radius = np.sqrt(c + a**2 + b**2)
+
+    center = plane @ np.array([a, b]) + axis * np.dot(reference_point, axis)
+    return Cylinder(center, axis, float(radius))
+
+
+def _circumcircles(triangles: np.ndarray):
+    """
+    Centers (Mx2) and radii (M) of the circles through the corners of M 2D triangles (Mx3x2). Degenerate
+    triangles get an infinite radius.
+    """
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    d = 2 * (a[:, 0] * (b[:, 1] - c[:, 1]) + b[:, 0] * (c[:, 1] - a[:, 1]) + c[:, 0] * (a[:, 1] - b[:, 1]))
+    a2, b2, c2 = np.sum(a**2, axis=1), np.sum(b**2, axis=1), np.sum(c**2, axis=1)
+
+    degenerate = np.abs(d) < 1.E-12
+    d[degenerate] = 1
+    centers = np.column_stack([a2 * (b[:, 1] - c[:, 1]) + b2 * (c[:, 1] - a[:, 1]) + c2 * (a[:, 1] - b[:, 1]),
+                               a2 * (c[:, 0] - b[:, 0]) + b2 * (a[:, 0] - c[:, 0]) + c2 * (b[:, 0] - a[:, 0])])
+    centers /= d[:, np.newaxis]
+    radii = np.linalg.norm(a - centers, axis=1)
+    radii[degenerate] = np.inf
+    return centers, radii
+
+
+def rotation_between(from_vector: np.ndarray, to_vector: np.ndarray):
+    """
+    The smallest rotation that turns one direction into another.
+
+    Args:
+        from_vector (np.array): 3D direction
+        to_vector (np.array): 3D direction
+
+    Returns:
+        np.array: 3x3 rotation matrix
+    """
+    a = np.asarray(from_vector, dtype=np.float64) / np.linalg.norm(from_vector)
+    b = np.asarray(to_vector, dtype=np.float64) / np.linalg.norm(to_vector)
+    v, cosine = np.cross(a, b), np.dot(a, b)
+    if cosine < -1 + 1.E-12:
+        # Opposite directions, turn half a revolution around any perpendicular axis
+        perpendicular = np.cross(a, [1, 0, 0] if abs(a[0]) < 0.9 else [0, 1, 0])
+        perpendicular /= np.linalg.norm(perpendicular)
+        return 2 * np.outer(perpendicular, perpendicular) - np.eye(3)
+
+    # Rodrigues' rotation formula
+    skew = np.array([[0, -v[2], v[1]], [v[2], 0, -v[0]], [-v[1], v[0], 0]])
+    return np.eye(3) + skew + skew @ skew / (1 + cosine)
+
+
+def cluster_vertices(vertices: np.ndarray, triangles: np.ndarray, cell_size: float):
+    """
+    Decimate a mesh by vertex clustering: all vertices in a cell of a regular grid are merged into their
+    mean. Triangles that collapse, or become copies of other triangles, are removed. Fast and good enough
+    for a preview, but the result is not guaranteed to be manifold.
+
+    Args:
+        vertices (np.array): Nx3 vertices
+        triangles (np.array): Mx3 vertex indices
+        cell_size (float): Size of the grid cells
+
+    Returns:
+        (np.array, np.array): Vertices and triangles of the decimated mesh
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    if vertices.shape[0] == 0:
+        return vertices.copy(), triangles.copy()
+
+    cells = np.floor((vertices - np.amin(vertices, axis=0)) / cell_size).astype(np.int64)
+    _, cluster = np.unique(cells, axis=0, return_inverse=True)
+    cluster = cluster.ravel()
+    counts = np.bincount(cluster)
+    clustered = np.column_stack([np.bincount(cluster, weights=vertices[:, k]) for k in range(3)]) / counts[:, None]
+
+    clustered_triangles = cluster[triangles]
+    a, b, c = clustered_triangles[:, 0], clustered_triangles[:, 1], clustered_triangles[:, 2]
+    clustered_triangles = clustered_triangles[(a != b) & (b != c) & (c != a)]
+
+    # Keep the first of triangles with the same corners, in any order
+    _, first = np.unique(np.sort(clustered_triangles, axis=1), axis=0, return_index=True)
+    return clustered, clustered_triangles[np.sort(first)]
+
+
+def detect_ankle(vertices: np.ndarray, slice_count: int = 200, z_order: np.ndarray = None):
+    """
+    Find the ankle of a leg scan, aligned with the toes along +X and the leg along +Z. The leg is cut into
+    horizontal slices, and the X extent of each slice is measured. Through the foot the slices are long,
+    and they get shorter up the instep. The ankle is at the lowest slice above the longest one that is about
+    as short as the slices of the leg.
+
+    Args:
+        vertices (np.array): Nx3 vertices
+        slice_count (int): Number of slices from the lowest to the highest vertex
+        z_order (np.array): Optional indices of the vertices sorted by Z, e.g. cached by helpers
+
+    Returns:
+        np.array: Ankle point, in the middle of the leg at the ankle height. 'None' if no foot was found
+    """
+    LEG_WIDTH_TOLERANCE = 1.1
+    MINIMUM_FOOT_TO_LEG_RATIO = 1.5
+
+    vertices = np.asarray(vertices, dtype=np.float64)
+    if z_order is None:
+        z_order = np.argsort(vertices[:, 2], kind='stable')
+    if z_order.shape[0] < slice_count:
+        return None
+    sorted_vertices = vertices[z_order]
+
+    # Slices are contiguous in the Z order, and get the same height
+    z_min, z_max = sorted_vertices[0, 2], sorted_vertices[-1, 2]
+    slice_starts = np.searchsorted(sorted_vertices[:, 2], np.linspace(z_min, z_max, slice_count + 1)[:-1])
+    slice_starts = np.unique(slice_starts)
+    extent = np.maximum.reduceat(sorted_vertices[:, 0], slice_starts) - \
+        np.minimum.reduceat(sorted_vertices[:, 0], slice_starts)
+
+    # The leg is the upper half of the scan
+    leg_extent = np.median(extent[extent.shape[0] // 2:])
+    longest = int(np.argmax(extent[:extent.shape[0] // 2]))
+    if extent[longest] < MINIMUM_FOOT_TO_LEG_RATIO * leg_extent:
+        return None
+
+    above_foot = np.flatnonzero(extent[longest:] <= LEG_WIDTH_TOLERANCE * leg_extent)
+    if above_foot.shape[0] == 0:
+        return None
+
+    ankle_slice = longest + above_foot[0]
+    end = slice_starts[ankle_slice + 1] if ankle_slice + 1 < slice_starts.shape[0] else sorted_vertices.shape[0]
+    slice_vertices = sorted_vertices[slice_starts[ankle_slice]:end]
+    center = (np.amax(slice_vertices, axis=0) + np.amin(slice_vertices, axis=0)) / 2
+    return np.array([center[0], center[1], np.mean(slice_vertices[:, 2])])
+
+
+def leg_alignment(vertices: np.ndarray, matrix_world: np.ndarray, sample_count: int = 20000, seed: int = 0):
+    """
+    Find how to rotate an L-shaped leg scan so that the toes point along +X and the leg along +Z. The principal
+    axes of a random sample of the vertices are used, so the time does not grow with the size of the scan. The
+    longest axis is roughly along the leg, tilted towards the foot. The end with the foot is the wider one,
+    and the leg is then the longest axis of the other half. The toes are where the foot sticks out from the leg.
+    The leg must be longer than the foot.
+
+    Args:
+        vertices (np.array): Nx3 vertices in object coordinates
+        matrix_world (np.array): 4x4 matrix from object to world coordinates
+        sample_count (int): Number of vertices to use
+        seed (int): Seed for the random sample, so that the same scan always gets the same result
+
+    Returns:
+        np.array: 4x4 rotation around the center of the sample, in world coordinates. Apply to the world matrix
+    """
+    FOOT_FRACTION = 0.2
+    ITERATIONS = 3
+
+    rng = np.random.default_rng(seed)
+    sample = vertices[rng.integers(0, vertices.shape[0], size=min(sample_count, vertices.shape[0]))]
+    sample = transform_points(np.asarray(sample, dtype=np.float64), np.asarray(matrix_world, dtype=np.float64))
+    center = np.mean(sample, axis=0)
+
+    def principal_axis(points: np.ndarray):
+        return np.linalg.svd(points - np.mean(points, axis=0), full_matrices=False)[2][0]
+
+    # The foot end of the longest axis is wider across that axis
+    axis = principal_axis(sample)
+    along = (sample - center) @ axis
+    low, high = np.quantile(along, [FOOT_FRACTION, 1 - FOOT_FRACTION])
+
+    def spread(points: np.ndarray):
+        across = points - np.mean(points, axis=0)
+        across -= np.outer(across @ axis, axis)
+        return np.mean(np.sum(across ** 2, axis=1))
+
+    if spread(sample[along >= high]) > spread(sample[along <= low]):
+        axis, along = -axis, -along
+
+    # The upper half is only leg, a cylinder along its longest axis. The half is cut across the axis found so
+    # far, which tilts the cylinder a little, so cut again across the better axis
+    z = axis
+    for _ in range(ITERATIONS):
+        height = (sample - center) @ z
+        leg = sample[height >= (np.amin(height) + np.amax(height)) / 2]
+        leg_axis = principal_axis(leg)
+        z = leg_axis if np.dot(leg_axis, z) > 0 else -leg_axis
+
+    # Seen from above, the foot is longest along the toes, which are in front of the leg
+    height = (sample - center) @ z
+    foot = sample[height <= np.quantile(height, FOOT_FRACTION)]
+    foot = foot - np.outer(foot @ z, z)
+    x = principal_axis(foot)
+    if np.dot(np.mean(foot, axis=0) - np.mean(leg, axis=0), x) < 0:
+        x = -x
+
+    rotation = np.eye(4)
+    rotation[:3, :3] = np.array([x, np.cross(z, x), z])
+    to_center, from_center = np.eye(4), np.eye(4)
+    to_center[:3, 3], from_center[:3, 3] = center, -center
+    return to_center @ rotation @ from_center
+
+
+def voxel_downsample(points: np.ndarray, voxel_size: float, weights: np.ndarray = None):
+    """
+    Replace all points within each cube of a grid by their mean. The grid starts at the origin, so a grid with a
+    multiple of the voxel size can be built from the result of a finer one, passing the counts as weights.
+
+    Args:
+        points (np.array): Nx3 points
+        voxel_size (float): Side of the cubes
+        weights (np.array): Optional weight of each point, e.g. the counts from a finer grid
+
+    Returns:
+        tuple of np.array: Mx3 mean of the points in each occupied cube, and the total weight in each cube
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if weights is None:
+        weights = np.ones(points.shape[0])
+
+    cells = np.floor(points / voxel_size).astype(np.int64)
+    cells -= np.amin(cells, axis=0)
+    shape = np.amax(cells, axis=0) + 1
+    _, inverse = np.unique((cells[:, 0] * shape[1] + cells[:, 1]) * shape[2] + cells[:, 2], return_inverse=True)
+    inverse = inverse.ravel()
+
+    totals = np.bincount(inverse, weights=weights)
+    means = np.column_stack([np.bincount(inverse, weights=weights * points[:, i]) for i in range(3)])
+    return means / totals[:, np.newaxis], totals
+
+
+def rigid_transform(source: np.ndarray, target: np.ndarray):
+    """
+    The rotation and translation that moves points closest to their targets, in the least squares sense
+    (Kabsch algorithm).
+
+    Args:
+        source (np.array): Nx3 points
+        target (np.array): Nx3 points, one for each source point
+
+    Returns:
+        np.array: 4x4 matrix without scale or mirroring
+    """
+    source_center, target_center = np.mean(source, axis=0), np.mean(target, axis=0)
+    u, _, vt = np.linalg.svd((source - source_center).T @ (target - target_center))
+
+    # Turn a reflection into the closest rotation
+    d = np.sign(np.linalg.det(u @ vt))
+    rotation = (u @ np.diag([1, 1, d]) @ vt).T
+
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation
+    matrix[:3, 3] = target_center - rotation @ source_center
+    return matrix
+
+
+def register_points(source: np.ndarray, target: np.ndarray, closest_point_search,
+                    voxel_sizes: tuple = (0.01, 0.005, 0.0025), iterations: int = 20, matrix: np.ndarray = None,
+                    tolerance: float = 1.E-6, max_points: int = 2000):
+    """
+    Move a point cloud onto another with the iterative closest point algorithm. Both clouds are downsampled to a
+    coarse grid first, and then to finer grids, so that most iterations are done with few points and every
+    search is among few points. The target grid is twice as fine as the source grid, so the distance to it
+    changes smoothly as the source moves. At every iteration, each source point is paired with the closest
+    target point. Pairs further apart than a few times the median distance are left out, so the clouds only
+    have to overlap in part, e.g. a scan of a whole leg and a foot template.
+
+    Args:
+        source (np.array): Nx3 points to move
+        target (np.array): Mx3 points to move onto
+        closest_point_search (callable): Takes the Lx3 target points of a level, and returns a function that
+                                          takes Kx3 points and returns the index of the closest of them to each,
+                                          e.g. by building a KD tree
+        voxel_sizes (tuple): Grid size of each level, from coarse to fine. Each must be a multiple of the next
+        iterations (int): Largest number of iterations on each level
+        matrix (np.array): Initial 4x4 transformation of the source
+        tolerance (float): Go to the next level when the RMS distance improves less than this
+        max_points (int): Largest number of source points on each level, evenly picked from the grid
+
+    Returns:
+        tuple: 4x4 rigid transformation of the source, and a list with (voxel size, iteration, RMS distance,
+               number of pairs) for each iteration. The list is empty if there are no points to pair
+    """
+    OUTLIER_FACTOR = 3
+    TARGET_REFINEMENT = 2
+
+    matrix = np.eye(4) if matrix is None else np.array(matrix, dtype=np.float64)
+    source = np.asarray(source, dtype=np.float64).reshape(-1, 3)
+    target = np.asarray(target, dtype=np.float64).reshape(-1, 3)
+    if source.shape[0] == 0 or target.shape[0] == 0:
+        return matrix, []
+
+    # Finest level first, each coarser one is built from the previous
+    def downsample(points, sizes):
+        levels = [voxel_downsample(points, sizes[-1])]
+        for voxel_size in sizes[-2::-1]:
+            levels.append(voxel_downsample(levels[-1][0], voxel_size, weights=levels[-1][1]))
+        return [means for means, _ in levels[::-1]]
+
+    source_levels = downsample(source, voxel_sizes)
+    target_levels = downsample(target, [voxel_size / TARGET_REFINEMENT for voxel_size in voxel_sizes])
+
+    residuals = []
+    for voxel_size, points, target_points in zip(voxel_sizes, source_levels, target_levels):
+        points = points[::-(-points.shape[0] // max_points)]
+        nearest = closest_point_search(target_points)
+        previous_rms = np.inf
+        for iteration in range(iterations):
+            moved = transform_points(points, matrix)
+            matched = target_points[nearest(moved)]
+            distances = np.linalg.norm(matched - moved, axis=1)
+            inliers = distances <= max(OUTLIER_FACTOR * np.median(distances), voxel_size)
+
+            rms = np.sqrt(np.mean(distances[inliers] ** 2))
+            residuals.append((voxel_size, iteration, rms, int(np.count_nonzero(inliers))))
+            if previous_rms - rms < tolerance:
+                break
+            previous_rms = rms
+
+            matrix = rigid_transform(moved[inliers], matched[inliers]) @ matrix
+
+    return matrix, residuals
+
+
+def signed_distances(points: np.ndarray, closest: np.ndarray, normals: np.ndarray):
+    """
+    Distance from points to the closest points on a surface, positive outside and negative inside the surface.
+
+    Args:
+        points (np.array): Nx3 points
+        closest (np.array): Nx3 closest point on the surface to each point. NaN where there is none
+        normals (np.array): Nx3 outwards surface normal at each closest point
+
+    Returns:
+        np.array: N signed distances, NaN where there is no closest point
+    """
+    offsets = np.asarray(points, dtype=np.float64) - closest
+    sign = np.where(np.einsum('ij,ij->i', offsets, normals) < 0, -1.0, 1.0)
+    return sign * np.linalg.norm(offsets, axis=1)
+
+
+def deviation_colors(distances: np.ndarray, max_distance: float):
+    """
+    Colors for a heatmap of signed distances, blue inside through white to red outside. Distances beyond the
+    largest get the strongest color, and missing (NaN) distances are grey.
+
+    Args:
+        distances (np.array): N signed distances
+        max_distance (float): Distance with the strongest color
+
+    Returns:
+        np.array: Nx4 RGBA colors, float32 between 0 and 1
+    """
+    NO_DISTANCE_COLOR = (0.5, 0.5, 0.5, 1)
+
+    t = np.clip(np.nan_to_num(distances) / max_distance, -1, 1)[:, np.newaxis]
+    white, red, blue = np.ones(3), np.array([1, 0, 0]), np.array([0, 0, 1])
+    rgb = np.where(t > 0, white + t * (red - white), white - t * (blue - white))
+
+    colors = np.column_stack([rgb, np.ones(rgb.shape[0])]).astype(np.float32)
+    colors[np.isnan(distances)] = NO_DISTANCE_COLOR
+    return colors
+
+
+def distance_histogram(distances: np.ndarray, max_distance: float, bin_count: int = 20):
+    """
+    Count signed distances in equal bins from -max_distance to max_distance. Distances beyond are counted in
+    the outermost bins, missing (NaN) distances are left out.
+
+    Args:
+        distances (np.array): N signed distances
+        max_distance (float): Edge of the outermost bins
+        bin_count (int): Number of bins
+
+    Returns:
+        tuple of np.array: Count in each bin, and the bin_count + 1 bin edges
+    """
+    distances = distances[~np.isnan(distances)]
+    return np.histogram(np.clip(distances, -max_distance, max_distance), bins=bin_count,
+                        range=(-max_distance, max_distance))
+
+
+def connected_regions(triangles: np.ndarray, selected: np.ndarray):
+    """
+    Label the connected regions of selected vertices, connected through the edges of the triangles.
+
+    Args:
+        triangles (np.array): Mx3 vertex indices
+        selected (np.array): N booleans, True for the vertices to label
+
+    Returns:
+        tuple: N labels, the same for all vertices in a region and -1 for vertices not selected, and the number
+               of regions. Labels are 0, 1, 2...
+    """
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    edges = np.vstack([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    edges = edges[selected[edges[:, 0]] & selected[edges[:, 1]]]
+
+    # Every vertex takes the smallest label of its neighbours, and then of the vertex that label points to
+    labels = np.arange(selected.shape[0])
+    while True:
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, edges[:, 0], labels[edges[:, 1]])
+        np.minimum.at(new_labels, edges[:, 1], labels[edges[:, 0]])
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+    roots, labels = np.unique(labels[selected], return_inverse=True)
+    all_labels = np.full(selected.shape[0], -1)
+    all_labels[selected] = labels.ravel()
+    return all_labels, roots.shape[0]
+
+
+def clearance(distances: np.ndarray, triangles: np.ndarray, intersecting: np.ndarray):
+    """
+    Summarize how far a part is from a scan. Where the part goes into the scan, the vertices inside and the
+    triangles that cut through the scan surface make up penetration regions.
+
+    Args:
+        distances (np.array): Signed distance from each vertex of the part to the scan, negative inside and
+                              NaN beyond the distance that was searched
+        triangles (np.array): Mx3 vertex indices of the part
+        intersecting (np.array): Indices of the part triangles that intersect the scan surface
+
+    Returns:
+        Clearance: Smallest distance (infinity if none was found), number of penetration regions, number of
+                   vertices inside the scan and number of intersecting triangles
+    """
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    inside = np.nan_to_num(distances, nan=np.inf) < 0
+    in_region = inside.copy()
+    in_region[triangles[np.asarray(intersecting, dtype=np.int64)].ravel()] = True
+    _, region_count = connected_regions(triangles, in_region)
+
+    found = distances[~np.isnan(distances)]
+    min_distance = float(np.amin(found)) if found.shape[0] > 0 else np.inf
+    if np.asarray(intersecting).shape[0] > 0:
+        min_distance = min(min_distance, 0.0)
+
+    return Clearance(min_distance=min_distance, region_count=region_count,
+                     penetrating_vertices=int(np.count_nonzero(inside)),
+                     intersecting_faces=int(np.unique(intersecting).shape[0]))
+
+
+def area_weighted_normals(vertices: np.ndarray, triangles: np.ndarray):
+    """
+    Vertex normals as the sum of the normals of the triangles around each vertex, weighted by their area.
+
+    Args:
+        vertices (np.array): Nx3 vertices
+        triangles (np.array): Mx3 vertex indices, counter-clockwise seen from the outside
+
+    Returns:
+        np.array: Nx3 unit normals, zero for vertices without triangles
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+
+    # The cross product is twice the area times the unit normal, so it is already weighted
+    corners = vertices[triangles]
+    face_normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    normals = np.column_stack([np.bincount(triangles.ravel(), weights=np.repeat(face_normals[:, i], 3),
+                                           minlength=vertices.shape[0]) for i in range(3)])
+
+    lengths = np.linalg.norm(normals, axis=1)
+    return normals / np.where(lengths > 0, lengths, 1)[:, np.newaxis]
+
+
+def shell_topology(triangles: np.ndarray):
+    """
+    Faces of a closed shell around a surface: the surface itself facing inwards, a copy offset along the normals
+    facing outwards, and a wall along the boundary between them. Only depends on the triangles, so it can be
+    kept while the offset changes, see offset_shell().
+
+    Args:
+        triangles (np.array): Mx3 vertex indices of the surface, counter-clockwise seen from the outside
+
+    Returns:
+        (np.array, np.array): The K vertices used by the surface, and the triangles of the shell as indices into
+                              offset_shell() of these vertices
+    """
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    vertex_indices, local = np.unique(triangles, return_inverse=True)
+    local = local.reshape(-1, 3)
+    count = vertex_indices.shape[0]
+
+    # Boundary edges are used by one triangle only, and keep the direction they have in that triangle
+    start, end = local.ravel(), np.roll(local, -1, axis=1).ravel()
+    _, edge_index, edge_count = np.unique(np.minimum(start, end) * count + np.maximum(start, end),
+                                          return_index=True, return_counts=True)
+    boundary = edge_index[edge_count == 1]
+    a, b = start[boundary], end[boundary]
+
+    # The wall faces away from the surface, as seen from its boundary
+    inner, outer = local[:, ::-1], local + count
+    wall = np.vstack([np.column_stack([a, b, b + count]), np.column_stack([a, b + count, a + count])])
+    return vertex_indices, np.vstack([inner, outer, wall])
+
+
+def offset_shell(vertices: np.ndarray, normals: np.ndarray, thickness: float, matrix_world: np.ndarray = None):
+    """
+    Vertices of a shell, see shell_topology(): the surface and a copy of it offset along the normals.
+
+    Args:
+        vertices (np.array): Kx3 vertices of the surface
+        normals (np.array): Kx3 unit normals
+        thickness (float): Offset along the normals
+        matrix_world (np.array): 4x4 matrix of the object the vertices and normals are in. The thickness is
+                                 in world units when given, also for a scaled object
+
+    Returns:
+        np.array: 2Kx3 vertices, the surface first
+    """
+    if matrix_world is not None:
+        # Normals are transformed with the inverse transpose M^-T, the offset along them back with M^-1.
+        # Together that is n M^-1 M^-T for row vectors, divided by the length of the world normal n M^-1
+        inverse = np.linalg.inv(np.asarray(matrix_world)[:3, :3])
+        offsets = normals @ (inverse @ inverse.T)
+        normals = offsets / np.sqrt(np.einsum('ij,ij->i', normals, offsets))[:, np.newaxis]
+
+    return np.vstack([vertices, vertices + thickness * normals])
+
+
+def mesh_edges(faces: np.ndarray):
+    """
+    Edges of a mesh as Blender stores them, so they do not have to be calculated again when the mesh is created.
+
+    Args:
+        faces (np.array): MxK vertex indices, all faces have K corners
+
+    Returns:
+        (np.array, np.array): Ex2 vertex indices of the edges, and MxK index of the edge from each corner to the
+                              next one
+    """
+    faces = np.asarray(faces, dtype=np.int64)
+    start, end = faces.ravel(), np.roll(faces, -1, axis=1).ravel()
+    low, high = np.minimum(start, end), np.maximum(start, end)
+    count = np.amax(faces, initial=0) + 1
+    keys, corner_edges = np.unique(low * count + high, return_inverse=True)
+    edges = np.column_stack(np.divmod(keys, count))
+    return edges, corner_edges.reshape(faces.shape)
@@ -4,15 +4,57 @@ It is a bit awkward to install packages in Blender, so we avoid that.
 """
 from cmath import pi
 from collections import namedtuple
+import itertools
 import math
 from pathlib import Path
+import time
 
 import bpy
 from bpy_extras import view3d_utils
 import mathutils
+from mathutils.bvhtree import BVHTree
+from mathutils.kdtree import KDTree
 import numpy as np
 from addon_utils import check, enable
 
+if __package__:
+    from . import asset_manifest, geometry
+else:
+    # Imported as a stand-alone module, e.g. by the unit tests
+    import asset_manifest
+    import geometry
+
+RayCastResult = namedtuple('RayCastResult', ['object', 'intersection_point', 'face_normal', 'face_index'])
+ShellTopology = namedtuple('ShellTopology', ['vertex_indices', 'vertices', 'normals', 'faces', 'edges',
+                                             'corner_edges'])
+
+# Data derived from geometry, e.g. BVH trees, that is expensive to compute and therefore kept between
+# operator calls. Each cache is a dict keyed on the datablock pointer, see _cached()
+_BVH_TREES = dict()
+_KD_TREES = dict()
+_VERTEX_COORDINATES = dict()
+_VERTEX_NORMALS = dict()
+_VERTEX_ORDERS = dict()
+_TRIANGLES = dict()
+_GEOMETRY_CACHES = (_BVH_TREES, _KD_TREES, _VERTEX_COORDINATES, _VERTEX_NORMALS, _VERTEX_ORDERS, _TRIANGLES)
+
+# Results that operators compute again on every redo. A redo undoes first, which can change pointers and sends
+# geometry updates, so these are keyed on the content of the mesh instead, see _cached_by_content()
+_CIRCUMFERENCE_PROFILES = dict()
+_SHELL_TOPOLOGIES = dict()
+_CONTENT_CACHE_SIZE = 4
+
+# Counts geometry changes per datablock pointer, for results that depend on several datablocks
+_GEOMETRY_VERSIONS = dict()
+
+# Clearance between a part and a scan, keyed on both pointers and kept until either changes, see clearance()
+_CLEARANCES = dict()
+
+# Objects from the assets folder are loaded once into hidden prototypes, that are copied on use. Keyed on
+# filename, with the file modification time and the prototype object names
+_ASSET_PROTOTYPES = dict()
+_ASSET_PROTOTYPE_PREFIX = ".orthopen_prototype_"
+
 
 def mangle_operator_name(class_name: str):
     """
@@ -37,11 +79,27 @@ def mangle_operator_name(class_name: str):
     else:
         raise ValueError("Only use this for operators, all other 'bl_idname' fields are set automatically")
 
+def inside_polygon(point: tuple, polygon: list) -> bool:
+    """
+    Check if a point is inside a polygon. Use geometry.points_in_polygons() to check many points at once,
+    that is much faster than calling this in a loop.
+
+    Args:
+        point (tuple): x, y coordinates
+        polygon (list): Corners (x, y) of the polygon, in order
+
+    Returns:
+        bool: True if the point is inside the polygon
+    """
+    return bool(geometry.points_in_polygon(np.array([point]), np.array(polygon))[0])
+
 def mouse_ray_cast(context: bpy.types.Context, mouse_coords: tuple, ignore: list = []):
     """
     Find the object that appears to be in front of the mouse cursor.
 
-    Based on template 'Operator Modal View3D raycast'
+    Based on template 'Operator Modal View3D raycast', but rays are cast against a BVH tree that is kept
+    per mesh between calls (see _bvh_tree()). Objects whose bounding box the ray misses are skipped
+    before any per-mesh work is done.
 
     Args:
         context (bpy.types.Context): Current windowmanager context
@@ -52,16 +110,14 @@ def mouse_ray_cast(context: bpy.types.Context, mouse_coords: tuple, ignore: list
         namedtuple: Data on the intersection, intersection_point is in object coordinates. All fields 'None' at no intersection.
     """
     # Get the ray from the viewport and mouse
-    RayCastResult = namedtuple('RayCastResult', ['object', 'intersection_point', 'face_normal', 'face_index'])
-
     view_vector = view3d_utils.region_2d_to_vector_3d(context.region, context.region_data, mouse_coords)
     ray_origin_world = view3d_utils.region_2d_to_origin_3d(context.region, context.region_data, mouse_coords)
-    ray_target_world = ray_origin_world + view_vector
+    ray_direction_world = view_vector.normalized()
 
-    # Loop through all objects, cast the same ray, and see if the ray intersects the object
-    best_length_squared = -1.0
-    best_obj_data = RayCastResult(None, None, None, None)
-    for dup in context.evaluated_depsgraph_get().object_instances:
+    # Find all objects whose bounding box is hit by the ray, this is cheap compared to a mesh ray cast
+    candidates = []
+    depsgraph = context.evaluated_depsgraph_get()
+    for dup in depsgraph.object_instances:
         # We have to treat instances and copies a bit differently
         if dup.is_instance:
             obj, matrix_world = (dup.instance_object, dup.matrix_world.copy())
@@ -69,25 +125,602 @@ def mouse_ray_cast(context: bpy.types.Context, mouse_coords: tuple, ignore: list
             obj, matrix_world = (dup.object, dup.object.matrix_world.copy())
 
         if (obj.name not in ignore) and (obj.type == 'MESH'):
-            # Rays are cast in the object coordinate system, so we need to transform these vectors
-            ray_origin_obj = matrix_world.inverted() @ ray_origin_world
-            ray_target_obj = matrix_world.inverted() @ ray_target_world
-
-            ray_direction_obj = ray_target_obj - ray_origin_obj
-            hit, intersection_point, normal, index = obj.ray_cast(ray_origin_obj, ray_direction_obj)
-
-            if hit:
-                length_squared = (intersection_point - ray_origin_obj).length_squared
-                # TODO(parlove@paxec.se): This criteria is not great, we sometimes
-                # get objects not perceived to be directly in front of the mouse pointer
-                if best_obj_data.object is None or length_squared < best_length_squared:
-                    # Note ".original"! Else we get some copy from the depsgraph
-                    best_obj_data = RayCastResult(object=obj.original, intersection_point=intersection_point,
-                                                  face_normal=normal, face_index=index)
-                    best_length_squared = length_squared
+            distance_to_box = _ray_box_distance(ray_origin_world, ray_direction_world,
+                                                bound_box_world(obj, matrix_world))
+            if distance_to_box is not None:
+                candidates.append((distance_to_box, obj, matrix_world))
+
+    # Closest boxes first, so we can stop as soon as the remaining boxes are behind the best hit
+    best_distance = math.inf
+    best_obj_data = RayCastResult(None, None, None, None)
+    for distance_to_box, obj, matrix_world in sorted(candidates, key=lambda candidate: candidate[0]):
+        if distance_to_box > best_distance:
+            break
+
+        # Rays are cast in the object coordinate system, so we need to transform these vectors
+        matrix_world_inverted = matrix_world.inverted()
+        ray_origin_obj = matrix_world_inverted @ ray_origin_world
+        ray_direction_obj = (matrix_world_inverted.to_3x3() @ ray_direction_world).normalized()
+
+        tree, polygon_indices = _bvh_tree(obj, depsgraph)
+        intersection_point, normal, index, _ = tree.ray_cast(ray_origin_obj, ray_direction_obj)
+
+        if intersection_point is not None:
+            # Compare in world coordinates, the objects might be scaled differently
+            distance = (matrix_world @ intersection_point - ray_origin_world).length
+            if distance < best_distance:
+                # Note ".original"! Else we get some copy from the depsgraph
+                best_obj_data = RayCastResult(object=obj.original, intersection_point=intersection_point,
+                                              face_normal=normal, face_index=int(polygon_indices[index]))
+                best_distance = distance
 
     return best_obj_data
 
+def _ray_box_distance(ray_origin: mathutils.Vector, ray_direction: mathutils.Vector, box_corners: np.ndarray):
+    """
+    Slab test of a ray against the axis aligned box enclosing some corners.
+
+    Returns:
+        float: Distance along the ray to where it enters the box (0 if starting inside), 'None' if it misses
+    """
+    box_min, box_max = np.amin(box_corners, axis=0), np.amax(box_corners, axis=0)
+    origin, direction = np.array(ray_origin), np.array(ray_direction)
+
+    # Division by zero gives +-inf for rays parallel to a slab, which is what we want
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_1 = (box_min - origin) / direction
+        t_2 = (box_max - origin) / direction
+
+    # A parallel ray starting exactly on a slab gives nan, count that as inside
+    t_near = np.nanmax(np.append(np.minimum(t_1, t_2), -math.inf))
+    t_far = np.nanmin(np.append(np.maximum(t_1, t_2), math.inf))
+
+    if t_far < max(t_near, 0):
+        return None
+
+    return max(t_near, 0)
+
+def _bvh_tree(object: bpy.types.Object, depsgraph: bpy.types.Depsgraph):
+    """
+    BVH tree over the evaluated mesh of an object, in object coordinates. The tree is built on first use
+    and then kept until the depsgraph reports a geometry change of the object.
+
+    Args:
+        object (bpy.types.Object): Evaluated Blender object
+        depsgraph (bpy.types.Depsgraph): The depsgraph the object was evaluated in
+
+    Returns:
+        (mathutils.bvhtree.BVHTree, np.array): The tree, and the polygon index of each triangle in the tree
+    """
+    def build():
+        mesh = object.to_mesh()
+        mesh.calc_loop_triangles()
+        polygon_indices = np.empty(len(mesh.loop_triangles), dtype=np.int32)
+        mesh.loop_triangles.foreach_get("polygon_index", polygon_indices)
+        object.to_mesh_clear()
+
+        # Triangles in the tree are ordered as the loop triangles, so indices can be mapped back to polygons
+        return BVHTree.FromObject(object.original, depsgraph), polygon_indices
+
+    signature = (len(object.data.vertices), len(object.data.polygons))
+    return _cached(_BVH_TREES, object.original, signature, build)
+
+def vertex_coordinates(object: bpy.types.Object, space: str = 'LOCAL', dtype: np.dtype = np.float64):
+    """
+    Get the vertex coordinates of an object's mesh. The coordinates are read once per mesh with foreach_get
+    and then cached until the depsgraph reports a geometry change, so use this instead of iterating over
+    mesh.vertices. Modifiers are not applied.
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh
+        space (str): 'LOCAL' for object coordinates, 'WORLD' for world coordinates
+        dtype (np.dtype): np.float32 or np.float64
+
+    Returns:
+        np.array: Contiguous Nx3 array. Local coordinates are shared with the cache and therefore read only
+    """
+    mesh = object.data
+
+    def build():
+        vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", vertices)
+        return {np.dtype(np.float32): _read_only(vertices.reshape(-1, 3))}
+
+    # One entry per mesh, holding the coordinates in each requested precision
+    vertices_by_dtype = _cached(_VERTEX_COORDINATES, mesh, _mesh_signature(mesh), build)
+    dtype = np.dtype(dtype)
+    if dtype not in vertices_by_dtype:
+        vertices_by_dtype[dtype] = _read_only(vertices_by_dtype[np.dtype(np.float32)].astype(dtype))
+
+    if space == 'LOCAL':
+        return vertices_by_dtype[dtype]
+    elif space == 'WORLD':
+        return geometry.transform_points(vertices_by_dtype[dtype], np.array(object.matrix_world, dtype=dtype))
+    else:
+        raise ValueError(f"Unknown space '{space}', use 'LOCAL' or 'WORLD'")
+
+def vertex_normals(object: bpy.types.Object):
+    """
+    Get the vertex normals of an object's mesh, cached like vertex_coordinates().
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh
+
+    Returns:
+        np.array: Read only Nx3 array of unit normals, object coordinates
+    """
+    mesh = object.data
+
+    def build():
+        normals = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("normal", normals)
+        return _read_only(normals.reshape(-1, 3))
+
+    return _cached(_VERTEX_NORMALS, mesh, _mesh_signature(mesh), build)
+
+def kd_tree(object: bpy.types.Object):
+    """
+    KD tree over the vertices of an object's mesh, in object coordinates. Built on first use and then
+    cached like vertex_coordinates(), so nearest vertex queries do not have to touch all vertices.
+
+    mathutils has no bulk insert, so building the tree costs one Python insert() call per vertex and then
+    balancing, O(N log N). On a large scan that is far more than a query, see benchmark_spatial_index() in
+    benchmark_in_blender.py, so only use the tree where it is queried many times. For a single query around a
+    point, vertices_near() is much cheaper.
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh
+
+    Returns:
+        mathutils.kdtree.KDTree: Tree with the vertex indices of the mesh
+    """
+    mesh = object.data
+
+    return _cached(_KD_TREES, mesh, _mesh_signature(mesh), lambda: _build_kd_tree(vertex_coordinates(object)))
+
+def _build_kd_tree(points: np.ndarray):
+    tree = KDTree(points.shape[0])
+    for index, co in enumerate(np.asarray(points).tolist()):
+        tree.insert(co, index)
+    tree.balance()
+    return tree
+
+def vertices_near(object: bpy.types.Object, point: np.ndarray, radius: float):
+    """
+    Find the vertices of an object within a distance from a point. Only the vertices in the slab of heights
+    around the point are tested, found by binary search in vertex_order(). Unlike kd_tree(), the first call
+    only has to sort the vertices, so this suits single queries, e.g. on a mouse click.
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh
+        point (np.array): World coordinates
+        radius (float): World distance
+
+    Returns:
+        np.array: Indices of the vertices
+    """
+    matrix_world = np.array(object.matrix_world)
+    point_local = geometry.transform_points(np.asarray(point)[np.newaxis, :], np.linalg.inv(matrix_world))[0]
+
+    # With a non-uniform scale, the sphere is an ellipsoid in object coordinates. Search a slab around
+    # it, no thinner than the smallest scale allows, and then check the distances in world coordinates
+    half_height = radius / np.linalg.svd(matrix_world[:3, :3], compute_uv=False)[-1]
+    indices = vertices_between(object, axis=2, low=point_local[2] - half_height, high=point_local[2] + half_height)
+
+    vertices_world = geometry.transform_points(vertex_coordinates(object)[indices], matrix_world)
+    return indices[np.linalg.norm(vertices_world - point, axis=1) <= radius]
+
+def nearest_vertices(object: bpy.types.Object, point: np.ndarray, count: int):
+    """
+    Find the vertices of an object closest to a point, using the cached KD tree.
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh
+        point (np.array): World coordinates
+        count (int): Number of vertices to find
+
+    Returns:
+        np.array: Indices of the vertices, closest first. With a non-uniform scale, the order is by distance
+                  in object coordinates
+    """
+    point_local = geometry.transform_points(np.asarray(point)[np.newaxis, :], np.linalg.inv(object.matrix_world))[0]
+    return np.array([index for _, index, _ in kd_tree(object).find_n(point_local.tolist(), count)], dtype=np.int64)
+
+def closest_point_search(points: np.ndarray):
+    """
+    Build a KD tree over points, to find the closest of them to each of many other points, e.g. for
+    geometry.register_points().
+
+    Like kd_tree(), building costs one Python insert() call per point, and the tree is queried one point at a
+    time. Most of the time is spent in the search itself, not in the Python loop: with Blender 4.2 a query
+    takes about 4 us among 100k points and 10 us among 1M, so search among as few points as will do. See
+    benchmark_registration() in benchmark_in_blender.py.
+
+    Args:
+        points (np.array): Nx3 points to search among
+
+    Returns:
+        callable: Takes Kx3 points and returns the index of the closest point to each
+    """
+    tree = _build_kd_tree(points)
+    find = tree.find
+    return lambda queries: np.array([find(point)[1] for point in np.asarray(queries).tolist()], dtype=np.int64)
+
+def nearest_surface_points(object: bpy.types.Object, points: np.ndarray, max_distance: float = None):
+    """
+    Find the closest point on the evaluated surface of an object to each of many points, using the cached
+    BVH tree. Queries are made in object coordinates and the results returned in world coordinates.
+
+    The tree is queried one point at a time, as mathutils has no batch query. Nearly all of the time is spent
+    in the search, which gets slower the further the points are from the surface compared to its triangle
+    size. With Blender 4.2, 1M points about 1 mm from a leg-like tube of 1M triangles took 3 s, and 1M points
+    2 mm from a finer patch of 2M triangles took 12 s. See benchmark_deviation() in benchmark_in_blender.py.
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh
+        points (np.array): Nx3 world coordinates
+        max_distance (float): Only look this far, in object coordinates. Points further than this from the
+                              bounding box are skipped without a search. 'None' for any distance
+
+    Returns:
+        (np.array, np.array): Nx3 closest points and Nx3 unit face normals, NaN where nothing was found
+    """
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    object_evaluated = object.evaluated_get(depsgraph)
+    tree, _ = _bvh_tree(object_evaluated, depsgraph)
+    matrix_world = np.array(object.matrix_world)
+    points_local = geometry.transform_points(np.asarray(points), np.linalg.inv(matrix_world))
+
+    # The tree is queried one point at a time, keep the Python work per point to a minimum
+    find_nearest = tree.find_nearest
+    if max_distance is None:
+        searched = np.ones(len(points_local), dtype=bool)
+        results = [find_nearest(point) for point in points_local.tolist()]
+    else:
+        # Points further than that from the bounding box can not find anything, skip them all at once
+        searched = geometry.box_distances(points_local, np.array(object_evaluated.bound_box)) <= max_distance
+        results = [find_nearest(point, max_distance) for point in points_local[searched].tolist()]
+    found = np.zeros(len(points_local), dtype=bool)
+    found[searched] = [location is not None for location, _, _, _ in results]
+    hits = [result for result in results if result[0] is not None]
+
+    # Converting each vector to an array would take longer than the queries, so flatten them all into one
+    def to_array(vectors):
+        return np.fromiter(itertools.chain.from_iterable(vectors), dtype=np.float64,
+                           count=3 * len(hits)).reshape(-1, 3)
+
+    closest, normals = np.full((len(points_local), 3), np.nan), np.full((len(points_local), 3), np.nan)
+    if len(hits) > 0:
+        closest[found] = geometry.transform_points(to_array(location for location, _, _, _ in hits), matrix_world)
+        normals_world = to_array(normal for _, normal, _, _ in hits) @ np.linalg.inv(matrix_world[:3, :3])
+        normals[found] = normals_world / np.linalg.norm(normals_world, axis=1)[:, np.newaxis]
+
+    return closest, normals
+
+def clearance(part: bpy.types.Object, scan: bpy.types.Object, search_distance: float):
+    """
+    Measure how far a part, e.g. a pad or a foot splint, is from a scan and where it goes into it. Triangles of
+    the part that cut through the scan are found by overlapping BVH trees, and the distance from every vertex
+    of the part to the scan surface is measured. Both objects are evaluated, with modifiers. The result is kept
+    until the geometry or the transform of either object changes, or either is deleted.
+
+    Args:
+        part (bpy.types.Object): Blender object with a mesh
+        scan (bpy.types.Object): Blender object with a mesh
+        search_distance (float): Distances beyond this, in object coordinates of the scan, are not measured
+
+    Returns:
+        (geometry.Clearance, bool): The clearance, and whether it was computed now instead of kept from before
+    """
+    signature = (search_distance,
+                 geometry_version(part), geometry_version(part.data), tuple(map(tuple, part.matrix_world)),
+                 geometry_version(scan), geometry_version(scan.data), tuple(map(tuple, scan.matrix_world)))
+    key = (part.as_pointer(), scan.as_pointer())
+    entry = _CLEARANCES.get(key)
+    if entry is not None and entry[0] == signature:
+        return entry[1], False
+
+    vertices, part_triangles = evaluated_triangles(part)
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    scan_tree, _ = _bvh_tree(scan.evaluated_get(depsgraph), depsgraph)
+
+    # Overlap is only found between trees in the same coordinates, the scan's tree is in its object coordinates
+    vertices_scan = geometry.transform_points(vertices, np.linalg.inv(np.array(scan.matrix_world)))
+    part_tree = BVHTree.FromPolygons(vertices_scan.tolist(), part_triangles.tolist())
+    intersecting = np.array([part_index for part_index, _ in part_tree.overlap(scan_tree)], dtype=np.int64)
+
+    closest, normals = nearest_surface_points(scan, vertices, max_distance=search_distance)
+    result = geometry.clearance(geometry.signed_distances(vertices, closest, normals), part_triangles, intersecting)
+    _CLEARANCES[key] = (signature, result)
+    return result, True
+
+def vertex_order(object: bpy.types.Object, axis: int):
+    """
+    Get the vertex indices of an object's mesh sorted along an axis, cached like vertex_coordinates(). Use
+    this to find e.g. the toes, or a band of heights, without looking at all vertices.
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh
+        axis (int): 0, 1, 2 for X, Y, Z in object coordinates
+
+    Returns:
+        np.array: Read only array of vertex indices, from the lowest to the highest coordinate
+    """
+    return _sorted_axis(object, axis)[0]
+
+def _sorted_axis(object: bpy.types.Object, axis: int):
+    mesh = object.data
+
+    # One entry per mesh, holding the order and the sorted coordinates along each requested axis
+    sorted_axes = _cached(_VERTEX_ORDERS, mesh, _mesh_signature(mesh), dict)
+    if axis not in sorted_axes:
+        order = np.argsort(vertex_coordinates(object)[:, axis], kind='stable')
+        sorted_axes[axis] = (_read_only(order), _read_only(vertex_coordinates(object)[order, axis]))
+
+    return sorted_axes[axis]
+
+def vertices_between(object: bpy.types.Object, axis: int, low: float, high: float):
+    """
+    Find the vertices of an object in a slab between two coordinates, by binary search in vertex_order().
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh
+        axis (int): 0, 1, 2 for X, Y, Z in object coordinates
+        low (float): Lowest coordinate, object coordinates
+        high (float): Highest coordinate, object coordinates
+
+    Returns:
+        np.array: Indices of the vertices, sorted along the axis
+    """
+    order, sorted_coordinates = _sorted_axis(object, axis)
+    return order[np.searchsorted(sorted_coordinates, low, side='left'):
+                 np.searchsorted(sorted_coordinates, high, side='right')]
+
+def triangles(object: bpy.types.Object):
+    """
+    Get the triangulation of an object's mesh, as vertex indices. Cached like vertex_coordinates(), and
+    modifiers are not applied either.
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh
+
+    Returns:
+        np.array: Read only Mx3 array of indices into vertex_coordinates()
+    """
+    mesh = object.data
+
+    def build():
+        mesh.calc_loop_triangles()
+        indices = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get("vertices", indices)
+        return _read_only(indices.reshape(-1, 3))
+
+    return _cached(_TRIANGLES, mesh, (len(mesh.vertices), len(mesh.polygons)), build)
+
+def shell_topology(object: bpy.types.Object):
+    """
+    Get the faces of a shell around the selected vertices of an object's mesh, and the area weighted normals
+    to offset them along, see geometry.shell_topology(). Kept for the content of the mesh and the selection,
+    so changing only the thickness in the redo panel does not compute it again.
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh, not in edit mode
+
+    Returns:
+        ShellTopology: Read only indices of the K selected vertices used by the shell, their Kx3 coordinates and
+                       Kx3 unit normals in object coordinates, the triangles of the shell and its edges, see
+                       geometry.mesh_edges()
+    """
+    mesh = object.data
+    selected = np.zeros(len(mesh.vertices), dtype=bool)
+    if bpy.app.version < (4, 0, 0):
+        mesh.vertices.foreach_get("select", selected)
+    elif ".select_vert" in mesh.attributes:
+        # Many times faster than through mesh.vertices. Missing when nothing is selected
+        mesh.attributes[".select_vert"].data.foreach_get("value", selected)
+
+    def build():
+        all_triangles = triangles(object)
+        surface = all_triangles[np.all(selected[all_triangles], axis=1)]
+        vertex_indices, faces = geometry.shell_topology(surface)
+
+        # All triangles around the selected vertices count, also those just outside the selection
+        vertices = vertex_coordinates(object)
+        around = all_triangles[np.any(selected[all_triangles], axis=1)]
+        normals = geometry.area_weighted_normals(vertices, around)[vertex_indices]
+        # As Blender stores them, so add_mesh_object() does not have to convert them on every redo
+        faces, edges, corner_edges = (array.astype(np.int32) for array in (faces, *geometry.mesh_edges(faces)))
+        return ShellTopology(*(_read_only(array) for array in (vertex_indices, vertices[vertex_indices], normals,
+                                                                faces, edges, corner_edges)))
+
+    key = (_mesh_signature(mesh), hash(np.packbits(selected).tobytes()))
+    return _cached_by_content(_SHELL_TOPOLOGIES, key, build)
+
+def circumference_profile(object: bpy.types.Object, height_count: int = 200):
+    """
+    Measure the circumference of e.g. a leg scan at many heights, see geometry.slice_mesh(). The profile is
+    kept for the content and the placement of the mesh, so it is found again after an undo or a redo.
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh
+        height_count (int): Number of heights, evenly spaced from the bottom to the top of the object
+
+    Returns:
+        (np.array, np.array): Read only arrays with the world Z coordinate of each height, and the
+                              circumference there (NaN if the mesh is not closed around at that height)
+    """
+    def build():
+        vertices = vertex_coordinates(object, space='WORLD')
+        z_min, z_max = np.amin(vertices[:, 2]), np.amax(vertices[:, 2])
+
+        # Leave out the very bottom and top, the mesh is rarely closed around there
+        heights = np.linspace(z_min, z_max, height_count + 2)[1:-1]
+        sections = geometry.slice_mesh(vertices, triangles(object), heights)
+        return _read_only(heights), _read_only(geometry.circumference_profile(sections, height_count))
+
+    key = (_mesh_signature(object.data), height_count, tuple(np.array(object.matrix_world).ravel()))
+    return _cached_by_content(_CIRCUMFERENCE_PROFILES, key, build)
+
+def evaluated_triangles(object: bpy.types.Object):
+    """
+    Get the triangulated mesh of an object in world coordinates, with all modifiers applied.
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh
+
+    Returns:
+        (np.array, np.array): Vertices (Nx3) and triangles (Mx3 vertex indices)
+    """
+    object_evaluated = object.evaluated_get(bpy.context.evaluated_depsgraph_get())
+    mesh = object_evaluated.to_mesh()
+    mesh.calc_loop_triangles()
+
+    vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", vertices)
+    triangles = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get("vertices", triangles)
+
+    matrix_world = np.array(object_evaluated.matrix_world)
+    object_evaluated.to_mesh_clear()
+
+    return geometry.transform_points(vertices.reshape(-1, 3), matrix_world), triangles.reshape(-1, 3)
+
+def clear_cached_geometry(id_data: bpy.types.ID):
+    """
+    Drop everything cached for a datablock. Call this after changing geometry from Python, as the
+    depsgraph handler that normally does this only runs after the next depsgraph update.
+
+    Args:
+        id_data (bpy.types.ID): Object or mesh
+    """
+    for cache in _GEOMETRY_CACHES:
+        cache.pop(id_data.as_pointer(), None)
+    _GEOMETRY_VERSIONS[id_data.as_pointer()] = geometry_version(id_data) + 1
+
+def geometry_version(id_data: bpy.types.ID):
+    """
+    Get a number that changes every time the geometry of a datablock changes, e.g. to tell whether a result
+    computed from several objects is outdated.
+
+    Args:
+        id_data (bpy.types.ID): Original (not evaluated) object or mesh
+
+    Returns:
+        int: Version of the geometry
+    """
+    return _GEOMETRY_VERSIONS.get(id_data.as_pointer(), 0)
+
+def _read_only(array: np.ndarray):
+    array.flags.writeable = False
+    return array
+
+def _mesh_signature(mesh: bpy.types.Mesh, samples: int = 64):
+    """
+    Signature of a mesh for the geometry caches: the number of vertices and polygons, and the coordinates of
+    a few evenly spaced vertices. This catches most edits that the depsgraph handler did not see, e.g. moved
+    vertices with an unchanged count, while reading only a handful of vertices.
+
+    Args:
+        mesh (bpy.types.Mesh): Original (not evaluated) mesh
+        samples (int): Number of vertices to read the coordinates of
+
+    Returns:
+        tuple: Compare with '!=' to tell whether the mesh has changed
+    """
+    vertex_count = len(mesh.vertices)
+    indices = np.unique(np.linspace(0, vertex_count - 1, min(samples, vertex_count), dtype=np.int64))
+    return (vertex_count, len(mesh.polygons), tuple(tuple(mesh.vertices[index].co) for index in indices.tolist()))
+
+def _cached(cache: dict, id_data: bpy.types.ID, signature: tuple, build):
+    """
+    Get an entry from one of the geometry caches, build it if it is missing or outdated.
+
+    Args:
+        cache (dict): One of the dicts in _GEOMETRY_CACHES
+        id_data (bpy.types.ID): Original (not evaluated) datablock the entry belongs to
+        signature (tuple): Cheap description of the geometry, e.g. number of vertices. An entry with another
+                           signature is outdated, this catches changes that the depsgraph handler did not see
+        build (callable): Function without arguments that computes the entry
+
+    Returns:
+        Any: What build() returns
+    """
+    key = id_data.as_pointer()
+    entry = cache.get(key)
+    if entry is None or entry[0] != signature:
+        entry = (signature, build())
+        cache[key] = entry
+
+    return entry[1]
+
+def _cached_by_content(cache: dict, key: tuple, build):
+    """
+    Get an entry from a cache keyed on content, e.g. _mesh_signature(), build it if it is missing. Only the
+    most recently used entries are kept.
+
+    Args:
+        cache (dict): _CIRCUMFERENCE_PROFILES or _SHELL_TOPOLOGIES
+        key (tuple): Description of everything the entry is computed from
+        build (callable): Function without arguments that computes the entry
+
+    Returns:
+        Any: What build() returns
+    """
+    # Dicts keep their insertion order, so the least recently used entry is first
+    entry = cache.pop(key) if key in cache else build()
+    cache[key] = entry
+    while len(cache) > _CONTENT_CACHE_SIZE:
+        del cache[next(iter(cache))]
+
+    return entry
+
+def _clear_caches(*_):
+    """
+    Handler for 'load_post'. Nothing cached belongs to the newly loaded file.
+    """
+    for cache in _GEOMETRY_CACHES:
+        cache.clear()
+    _GEOMETRY_VERSIONS.clear()
+    _CLEARANCES.clear()
+    _CIRCUMFERENCE_PROFILES.clear()
+    _SHELL_TOPOLOGIES.clear()
+    _ASSET_PROTOTYPES.clear()
+
+def _forget_deleted():
+    """
+    Drop everything kept for objects and meshes that no longer exist, e.g. deleted parts or scans. A new
+    datablock can get the pointer of a deleted one, and must not find its entries.
+    """
+    existing = {id_data.as_pointer() for id_data in itertools.chain(bpy.data.objects, bpy.data.meshes)}
+    for cache in _GEOMETRY_CACHES + (_GEOMETRY_VERSIONS,):
+        for key in [key for key in cache if key not in existing]:
+            del cache[key]
+    for key in [key for key in _CLEARANCES if not existing.issuperset(key)]:
+        del _CLEARANCES[key]
+
+def _invalidate_geometry_caches(scene: bpy.types.Scene, depsgraph: bpy.types.Depsgraph):
+    """
+    Handler for 'depsgraph_update_post'. Drops cached data for all datablocks with changed geometry, and
+    for deleted ones.
+    """
+    _forget_deleted()
+    for update in depsgraph.updates:
+        if not update.is_updated_geometry:
+            continue
+
+        # An object changes geometry with its modifiers, a mesh can be shared by several objects.
+        # Drop both to be on the safe side
+        id_data = update.id.original
+        keys = {id_data.as_pointer()}
+        if isinstance(id_data, bpy.types.Object) and id_data.data is not None:
+            keys.add(id_data.data.as_pointer())
+
+        for cache in _GEOMETRY_CACHES:
+            for key in keys:
+                cache.pop(key, None)
+        for key in keys:
+            _GEOMETRY_VERSIONS[key] = _GEOMETRY_VERSIONS.get(key, 0) + 1
+
 def set_view_to_xz():
     """
     Rotate viewport to show the X-Z plane (front orthographic), and set view to current object
@@ -115,17 +748,15 @@ def object_size(object: bpy.types.Object):
     Returns:
         np.array: Size in x,y,z direction
     """
-
-    diff = np.amax(np.array(object.bound_box), axis=0) -\
-        np.amin(np.array(object.bound_box), axis=0)
-
-    # The bounding box has to be scaled
-    return diff * np.array(object.scale)
+    return geometry.object_size(np.array(object.bound_box), np.array(object.scale))
 
 def load_assets(filename: str, names: list) -> dict:
     """
     Import all assets from a *.blend file in the assets folder.
 
+    Each file is only loaded once per session, into hidden prototype objects. Every call then returns
+    new copies of these prototypes, linked to the scene. Prototypes are loaded again if the file changes.
+
     Args:
         filename (str): Name of the *.blend file
         names (list): All objects in the assets file that are of special interest.
@@ -134,27 +765,40 @@ def load_assets(filename: str, names: list) -> dict:
     Returns:
         assets (dict of str: bpy.types.Object):  Dictionary with the objects specified in names argument
     """
-    # Import objects from file with assets
     FILE_PATH = Path(__file__).parent.joinpath("assets", filename)
+    modified_time = FILE_PATH.stat().st_mtime
 
-    with bpy.data.libraries.load(str(FILE_PATH)) as (data_from, data_to):
-        # Here .objects are strings, but then the "with" context is exited
-        # they will be replaced by corresponding real objects
-        data_to.objects = data_from.objects
-
-    # Link objects to scene and save a reference
-    assets = dict()
-    for obj in data_to.objects:
-        asset_key = obj.name
-        # If this is a "sought object", override asset name
-        for original_name in names:
-            # Blender might already have renamed my_asset --> my_asset_001 etc, due to duplicates so we
-            # cannot identify the assets names by ==
-            if original_name in obj.name:
-                asset_key = original_name
-        assets[asset_key] = obj
-
-        bpy.context.scene.collection.objects.link(obj)
+    # With a manifest we know what is in the file without opening it
+    manifest_objects = asset_manifest.objects(filename)
+    if manifest_objects is not None:
+        missing_assets = [x for x in names if x not in manifest_objects.keys()]
+        assert len(missing_assets) == 0, f"Sought assets '{missing_assets}' not found in '{FILE_PATH}'"
+
+    # Prototypes are looked up by name, the objects themselves may be gone e.g. after an undo
+    prototypes = None
+    if filename in _ASSET_PROTOTYPES and _ASSET_PROTOTYPES[filename][0] == modified_time:
+        prototypes = {asset_name: bpy.data.objects.get(prototype_name)
+                      for asset_name, prototype_name in _ASSET_PROTOTYPES[filename][1].items()}
+        if None in prototypes.values():
+            prototypes = None
+
+    if prototypes is None:
+        start = time.perf_counter()
+        _remove_asset_prototypes(filename)
+        prototypes = _load_asset_prototypes(FILE_PATH, manifest_objects)
+        if manifest_objects is not None and None in prototypes.values():
+            # The manifest is outdated after all, load whatever is in the file instead
+            print(f"Asset manifest does not match '{filename}', loading all objects in the file")
+            for prototype in [p for p in prototypes.values() if p is not None]:
+                bpy.data.objects.remove(prototype, do_unlink=True)
+            prototypes = _load_asset_prototypes(FILE_PATH)
+        _ASSET_PROTOTYPES[filename] = (modified_time, {asset_name: prototype.name
+                                                       for asset_name, prototype in prototypes.items()})
+        print(f"Loaded '{filename}' in {1000 * (time.perf_counter() - start):.1f} ms")
+
+    start = time.perf_counter()
+    assets = _copy_asset_prototypes(prototypes)
+    print(f"Copied {len(assets)} object(s) from '{filename}' in {1000 * (time.perf_counter() - start):.1f} ms")
 
     # Make sure we got it all
     missing_assets = [x for x in names if x not in assets.keys()]
@@ -162,22 +806,181 @@ def load_assets(filename: str, names: list) -> dict:
 
     return assets
 
-def bound_box_world(object: bpy.types.Object):
+def asset_available(filename: str, names: list) -> bool:
+    """
+    Check if objects are present in a *.blend file in the assets folder, using the asset manifest. Cheap
+    enough to be called from poll() and draw().
+
+    Args:
+        filename (str): Name of the *.blend file
+        names (list): Names of the objects
+
+    Returns:
+        bool: False if the manifest says that any object is missing. True if all are present, or if the
+              manifest is missing or outdated.
+    """
+    manifest_objects = asset_manifest.objects(filename)
+    return manifest_objects is None or all(name in manifest_objects for name in names)
+
+def asset_not_rotated(filename: str, assets: dict, name: str) -> bool:
+    """
+    Check that an object loaded from the assets folder is not rotated. Uses the asset manifest if possible.
+
+    Args:
+        filename (str): Name of the *.blend file the object was loaded from
+        assets (dict of str: bpy.types.Object): What load_assets() returned
+        name (str): Name of the object in the assets file
+    """
+    manifest_objects = asset_manifest.objects(filename)
+    if manifest_objects is not None and name in manifest_objects:
+        return manifest_objects[name]["not_rotated"]
+
+    asset = assets[name]
+    return np.linalg.norm(np.array(asset.matrix_world.to_quaternion()) - np.array(mathutils.Quaternion())) < 1.E-7
+
+def _load_asset_prototypes(file_path: Path, manifest_objects: dict = None) -> dict:
+    """
+    Load all objects in a *.blend file, without linking them to the scene.
+
+    Args:
+        file_path (Path): The *.blend file
+        manifest_objects (dict): Objects in the file according to the asset manifest, 'None' if not known
+
+    Returns:
+        dict of str: bpy.types.Object: Prototypes, by the object names in the file. 'None' for objects in the
+                                       manifest that are not in the file
+    """
+    with bpy.data.libraries.load(str(file_path)) as (data_from, data_to):
+        # Here .objects are strings, but then the "with" context is exited
+        # they will be replaced by corresponding real objects
+        asset_names = list(manifest_objects.keys()) if manifest_objects is not None else list(data_from.objects)
+        data_to.objects = asset_names
+
+    # Blender might already have renamed my_asset --> my_asset_001 etc, due to duplicates. Rename them
+    # so they are hidden in the user interface, and do not occupy the names the copies should get
+    prototypes = dict()
+    for asset_name, obj in zip(asset_names, data_to.objects):
+        if obj is not None:
+            obj.name = _ASSET_PROTOTYPE_PREFIX + asset_name
+        prototypes[asset_name] = obj
+
+    return prototypes
+
+def _copy_asset_prototypes(prototypes: dict) -> dict:
+    """
+    Copy prototype objects, and their meshes etc, and link the copies to the scene.
+
+    Returns:
+        dict of str: bpy.types.Object: Copies, by the object names in the assets file
+    """
+    copies = dict()
+    for asset_name, prototype in prototypes.items():
+        copies[asset_name] = prototype.copy()
+        if prototype.data is not None:
+            copies[asset_name].data = prototype.data.copy()
+        copies[asset_name].name = asset_name
+        bpy.context.scene.collection.objects.link(copies[asset_name])
+
+    # Parents, modifiers and constraints must refer to the copies and not to the prototypes
+    copy_of_prototype = {prototypes[asset_name]: copies[asset_name] for asset_name in prototypes.keys()}
+    for copy in copies.values():
+        if copy.parent in copy_of_prototype:
+            copy.parent = copy_of_prototype[copy.parent]
+
+        for item in list(copy.modifiers) + list(copy.constraints):
+            for item_property in item.bl_rna.properties:
+                if item_property.type == 'POINTER' and not item_property.is_readonly:
+                    value = getattr(item, item_property.identifier)
+                    if value in copy_of_prototype:
+                        setattr(item, item_property.identifier, copy_of_prototype[value])
+
+    return copies
+
+def _remove_asset_prototypes(filename: str = None):
+    """
+    Remove prototypes for one file, or for all files if no filename is given.
+    """
+    for cached_filename in ([filename] if filename is not None else list(_ASSET_PROTOTYPES.keys())):
+        _, prototype_names = _ASSET_PROTOTYPES.pop(cached_filename, (None, dict()))
+        for prototype_name in prototype_names.values():
+            if prototype_name in bpy.data.objects:
+                bpy.data.objects.remove(bpy.data.objects[prototype_name], do_unlink=True)
+
+def add_mesh_object(name: str, vertices: np.ndarray, faces: np.ndarray, edges: tuple = None,
+                    validate: bool = True) -> bpy.types.Object:
+    """
+    Create a mesh object from arrays, link it to the active collection and make it the active object.
+    The mesh is filled with foreach_set, which is much faster than from_pydata for large meshes.
+
+    Args:
+        name (str): Name of the object and its mesh
+        vertices (np.array): Nx3 array of vertex coordinates
+        faces (np.array): MxK array of vertex indices, all faces have K corners
+        edges (tuple): Edges and the edge from each corner, see geometry.mesh_edges(). Calculated by Blender
+                       when not given
+        validate (bool): Check the mesh and fix what is wrong, e.g. faces using a vertex twice. Only skip this
+                         for faces known to be valid
+
+    Returns:
+        bpy.types.Object: The new object
+    """
+    faces = np.asarray(faces, dtype=np.int32)
+    corner_count = faces.shape[1] if faces.ndim == 2 else 3
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(vertices))
+    if edges is not None:
+        mesh.edges.add(len(edges[0]))
+    mesh.loops.add(faces.size)
+    mesh.polygons.add(len(faces))
+    # Set one at a time, which is about twice as fast from a memoryview as from a NumPy array
+    mesh.polygons.foreach_set("loop_start", memoryview(np.arange(0, faces.size, corner_count, dtype=np.int32)))
+    if bpy.app.version < (4, 0, 0):
+        mesh.vertices.foreach_set("co", np.asarray(vertices, dtype=np.float32).ravel())
+        mesh.loops.foreach_set("vertex_index", faces.ravel())
+        if edges is not None:
+            mesh.edges.foreach_set("vertices", np.asarray(edges[0], dtype=np.int32).ravel())
+            mesh.loops.foreach_set("edge_index", np.asarray(edges[1], dtype=np.int32).ravel())
+        # Read only from Blender 4.0, where it is derived from loop_start
+        mesh.polygons.foreach_set("loop_total", np.full(len(faces), corner_count, dtype=np.int32))
+    else:
+        # The attributes behind the collections above, setting them directly is many times faster
+        mesh.attributes["position"].data.foreach_set("vector", np.asarray(vertices, dtype=np.float32).ravel())
+        if faces.size:
+            mesh.attributes[".corner_vert"].data.foreach_set("value", faces.ravel())
+        if edges is not None and faces.size:
+            mesh.attributes[".edge_verts"].data.foreach_set("value", np.asarray(edges[0], dtype=np.int32).ravel())
+            mesh.attributes[".corner_edge"].data.foreach_set("value", np.asarray(edges[1], dtype=np.int32).ravel())
+    mesh.update(calc_edges=edges is None)
+    if validate:
+        mesh.validate()
+
+    object = bpy.data.objects.new(name, mesh)
+    bpy.context.collection.objects.link(object)
+
+    # Same as after an import with Blender's own importers
+    bpy.ops.object.select_all(action='DESELECT')
+    object.select_set(True)
+    bpy.context.view_layer.objects.active = object
+
+    return object
+
+def bound_box_world(object: bpy.types.Object, matrix_world: mathutils.Matrix = None):
     """
     Get the object bounding box in world coordinates. Note that this
     does not account for any modifiers applied.
 
     Args:
         object (bpy.types.Object): Blender object
+        matrix_world (mathutils.Matrix): Use this instead of the object's own, e.g. for instances
 
     Returns:
         np.array: Corners of bounding box in world coordinates
     """
-    # Row vectors, augmented with 1 as a column vector
-    bound_box_augmented = np.hstack([np.array(object.bound_box), np.ones([8, 1])])
+    if matrix_world is None:
+        matrix_world = object.matrix_world
 
-    # For order of multiplication, remember (A * B)^T = B^T * A^T
-    return (bound_box_augmented @ np.array(object.matrix_world).T)[:, :3]
+    return geometry.bound_box_world(np.array(object.bound_box), np.array(matrix_world))
 
 def delta_size(object: bpy.types.Object):
     """
@@ -202,14 +1005,45 @@ def toggle_xray(toggle: bool):
         none
     """
 
+    # There is no screen when running in background mode
+    if bpy.context.screen is None:
+        return
+
     view3D = [area for area in bpy.context.screen.areas if area.type == 'VIEW_3D']
     for area in view3D:
-        shading = area.spaces.active.shading
-    
-    shading.show_xray = toggle
+        area.spaces.active.shading.show_xray = toggle
 
     return 
 
+def set_shading_solid():
+    """
+    Set the viewport shading of the current 3D viewport to SOLID. Does nothing if there is no 3D viewport,
+    e.g. when running in background mode.
+    """
+    space = bpy.context.space_data
+    if space is not None and space.type == 'VIEW_3D' and space.shading.type != 'SOLID':
+        space.shading.type = 'SOLID'
+
+def show_color_attribute(object: bpy.types.Object, name: str):
+    """
+    Make a color attribute the active one of an object's mesh, and show attribute colors in the current 3D
+    viewport. Does nothing to the viewport if there is none, e.g. when running in background mode.
+
+    Args:
+        object (bpy.types.Object): Blender object with a mesh
+        name (str): Name of a color attribute of the mesh
+    """
+    mesh = object.data
+    if bpy.app.version >= (3, 2, 0):
+        mesh.color_attributes.active_color = mesh.color_attributes[name]
+    else:
+        mesh.attributes.active = mesh.attributes[name]
+
+    space = bpy.context.space_data
+    if space is not None and space.type == 'VIEW_3D':
+        space.shading.type = 'SOLID'
+        space.shading.color_type = 'ATTRIBUTE' if bpy.app.version >= (3, 2, 0) else 'VERTEX'
+
 def import_activate_measureit():
     """
     Checks whether the MeasureIt addon is enabled. If not = enable
@@ -219,4 +1053,15 @@ def import_activate_measureit():
     if not loaded_status:
         bpy.ops.preferences.addon_enable(module="measureit")
 
-    return
\ No newline at end of file
+    return
+
+def register():
+    # Persistent, or the handlers would be removed when another file is loaded
+    bpy.app.handlers.depsgraph_update_post.append(bpy.app.handlers.persistent(_invalidate_geometry_caches))
+    bpy.app.handlers.load_post.append(bpy.app.handlers.persistent(_clear_caches))
+
+def unregister():
+    bpy.app.handlers.depsgraph_update_post.remove(_invalidate_geometry_caches)
+    bpy.app.handlers.load_post.remove(_clear_caches)
+    _remove_asset_prototypes()
+    _clear_caches()
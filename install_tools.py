@@ -5,14 +5,19 @@ from datetime import datetime
 import os
 import re
 import shutil
+import subprocess
 from pathlib import Path
 from zipfile import ZipFile
 
 
-def build(output_path: str = ""):
+def build(output_path: str = "", blender: str = "blender"):
     """
     Pack add-on into a zip file suitable for a Blender install
 
+    Args:
+        output_path (str): Folder for the zip file
+        blender (str): Blender executable, used for indexing the assets
+
     Returns:
         addon_name, zip_path: Name of the addon, path to the zip file
     """
@@ -31,6 +36,14 @@ def build(output_path: str = ""):
     # This is to get relative paths when creating the zip, makes it easier
     os.chdir(source_path)
 
+    # Index the assets in a headless Blender, so the add-on does not have to open the files to know what is in them
+    try:
+        subprocess.run([blender, "--background", "--factory-startup", "-noaudio", "--python",
+                        str(source_path.joinpath("asset_manifest.py"))], check=True)
+    except (OSError, subprocess.CalledProcessError) as error:
+        print(f"Could not write the asset manifest using '{blender}' ({error}). The add-on will work without it, "
+              "but has to open the asset files to find out what is in them.")
+
     # Parse gitignore
     with open(".gitignore") as gitignore:
         ignored = [line.strip() for line in gitignore.readlines()
@@ -59,6 +72,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Pack addon into a zip file")
     parser.add_argument('--output-path', '-p', type=str, default="", required=False, help="Output path of zip."
                         "Output will be in a subfolder of this script if this argument is not provided.")
+    parser.add_argument('--blender', '-b', type=str, default="blender", required=False,
+                        help="Blender executable, used for indexing the assets.")
     args = parser.parse_args()
 
-    addon_name, zip_path = build(args.output_path)
+    addon_name, zip_path = build(args.output_path, args.blender)
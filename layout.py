@@ -71,6 +71,15 @@ class TAB_PT_foot_leg(bpy.types.Panel, PanelDefaults):
         row.operator(operators.ORTHOPEN_OT_leg_prosthesis_mirror.bl_idname)
         row = layout.row()
         row.scale_y = 1.0
+        row.operator(operators.ORTHOPEN_OT_align_scan.bl_idname)
+        row = layout.row()
+        row.scale_y = 1.0
+        row.operator(operators.ORTHOPEN_OT_register_to_reference.bl_idname)
+        row = layout.row()
+        row.scale_y = 1.0
+        row.operator(operators.ORTHOPEN_OT_deviation_heatmap.bl_idname)
+        row = layout.row()
+        row.scale_y = 1.0
         row.operator(operators.ORTHOPEN_OT_model_transform_all.bl_idname)
 
         layout.label(text="Adjust foot angle")
@@ -79,6 +88,10 @@ class TAB_PT_foot_leg(bpy.types.Panel, PanelDefaults):
         row.operator(operators.ORTHOPEN_OT_set_foot_pivot.bl_idname)
         row = layout.row()
         row.scale_y = 1.0
+        row.operator(operators.ORTHOPEN_OT_set_foot_pivot.bl_idname, text="Adjust foot angle (detect ankle)"
+                     ).use_detected_ankle = True
+        row = layout.row()
+        row.scale_y = 1.0
         row.operator(operators.ORTHOPEN_OT_permanent_modifiers.bl_idname)
 
         layout.label(text="Prothesis cosmetics")
@@ -94,6 +107,13 @@ class TAB_PT_foot_leg(bpy.types.Panel, PanelDefaults):
         row = layout.row()
         row.scale_y = 1.0
         row.operator(operators.ORTHOPEN_OT_generate_foot_splint.bl_idname)
+        row = layout.row()
+        row.scale_y = 1.0
+        row.operator(operators.ORTHOPEN_OT_generate_splint_shell.bl_idname)
+
+        row = layout.row()
+        row.scale_y = 1.0
+        row.operator(operators.ORTHOPEN_OT_check_clearance.bl_idname)
 
 class TAB_PT_file_paths_asset_libraries(bpy.types.Panel, PanelDefaults):
     bl_label = "Asset Libraries"
@@ -1,6 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import copy
 import math
+import os
 from pathlib import Path
+import time
 from xml.etree.ElementTree import PI
 
 import bpy
@@ -8,7 +11,9 @@ import bpy_extras
 import mathutils
 import numpy as np
 
+from . import geometry
 from . import helpers
+from . import stl
 
 # If a bpy.types.Object contains this key, we know it is a scan we imported
 _KEY_IMPORTED_SCAN = "imported_3d_scan"
@@ -16,6 +21,18 @@ _KEY_IMPORTED_SCAN = "imported_3d_scan"
 # Key to identify armature managed by this add-on
 _KEY_MANAGED_ARMATURE = "managed_armature"
 
+# A decimated copy of a leg that is posed instead of the leg, holds the name of the leg
+_KEY_POSING_PROXY = "posing_proxy_of"
+
+# Histogram of the distances to the reference a scan was last compared with, bin edges and counts
+_KEY_DEVIATION_HISTOGRAM = "deviation_histogram"
+
+# Geometry nodes are only used in the newer versions
+if (3, 0, 0) < bpy.app.version:
+    _FOOT_SPLINT_ASSETS_FILENAME = "foot_splint_base_geo.blend"
+else:
+    _FOOT_SPLINT_ASSETS_FILENAME = "foot_splint_base.blend"
+
 def _clear_managed_armature(object: bpy.types.Object):
     """
     Identify and remove managed (automatically generated) armature attached to object
@@ -34,6 +51,88 @@ def _clear_managed_armature(object: bpy.types.Object):
         if _KEY_MANAGED_ARMATURE in object.parent.keys():
             bpy.data.objects.remove(object.parent, do_unlink=True)
 
+def _end_foot_posing(object: bpy.types.Object):
+    """
+    Remove the posing proxy of an object, if any, and show the object itself again with the full quality
+    foot deformation in the viewport. See ORTHOPEN_OT_set_foot_pivot.
+    """
+    for proxy in [o for o in bpy.data.objects if o.get(_KEY_POSING_PROXY) == object.name]:
+        mesh = proxy.data
+        bpy.data.objects.remove(proxy, do_unlink=True)
+        bpy.data.meshes.remove(mesh)
+    object.hide_viewport = False
+
+    for modifier in list(object.modifiers):
+        if modifier.name.endswith(ORTHOPEN_OT_set_foot_pivot._PREVIEW_SUFFIX):
+            object.modifiers.remove(modifier)
+        elif ORTHOPEN_OT_set_foot_pivot._FOOT_AUTOGEN_ID in modifier.name:
+            modifier.show_viewport = True
+
+class _ThrottledHover:
+    """
+    Mixin for modal operators that follow the mouse cursor, e.g. with a ray cast. Mouse moves are not
+    handled one by one, as a mouse with a high polling rate sends them faster than they can be ray cast.
+    Instead the latest position is kept, and handled on the next tick of a timer running at about the
+    redraw rate. Small moves are ignored.
+
+    Override _hover(), call _hover_start() from invoke() and _hover_stop() before the operator finishes,
+    and let _hover_event() consume events first in modal().
+    """
+    _HOVER_INTERVAL_SECONDS = 1 / 60
+    _HOVER_MIN_PIXELS = 2
+    _hover_timer = None
+
+    def _hover(self, context: bpy.types.Context, mouse_coords: tuple):
+        """
+        Called with the latest mouse position in the region, at most once per timer tick. Does nothing by default.
+        """
+        pass
+
+    def _hover_start(self, context: bpy.types.Context):
+        self._hover_timer = context.window_manager.event_timer_add(self._HOVER_INTERVAL_SECONDS,
+                                                                   window=context.window)
+        self._hover_pending = None
+        self._hover_last = None
+        self._hover_events = 0
+        self._hover_casts = 0
+        self._hover_seconds = 0
+
+    def _hover_stop(self, context: bpy.types.Context):
+        if self._hover_timer is not None:
+            context.window_manager.event_timer_remove(self._hover_timer)
+            self._hover_timer = None
+            milliseconds = 1000 * self._hover_seconds / max(self._hover_casts, 1)
+            print(f"{self.bl_idname}: handled {self._hover_events} mouse move(s) with {self._hover_casts} "
+                  f"hover update(s), {milliseconds:.1f} ms per update")
+
+    def cancel(self, context):
+        # Called by Blender e.g. when a file is loaded while the operator is running
+        self._hover_stop(context)
+
+    def _hover_event(self, context: bpy.types.Context, event: bpy.types.Event) -> bool:
+        """
+        Returns:
+            bool: True if the event was a mouse move or a hover timer tick, and has been handled
+        """
+        if event.type == 'MOUSEMOVE':
+            self._hover_events += 1
+            self._hover_pending = (event.mouse_region_x, event.mouse_region_y)
+            return True
+
+        # Events do not tell which timer ticked, but this operator only runs while its own timer is active
+        if event.type == 'TIMER' and self._hover_timer is not None:
+            mouse_coords, self._hover_pending = self._hover_pending, None
+            if mouse_coords is not None and (self._hover_last is None or
+                                             math.dist(mouse_coords, self._hover_last) >= self._HOVER_MIN_PIXELS):
+                self._hover_last = mouse_coords
+                self._hover_casts += 1
+                start = time.perf_counter()
+                self._hover(context, mouse_coords)
+                self._hover_seconds += time.perf_counter() - start
+            return True
+
+        return False
+
 class ORTHOPEN_OT_permanent_modifiers(bpy.types.Operator):
     """
     Permanently apply modifiers (e.g. changed foot angle) to the selected object. Will
@@ -58,9 +157,17 @@ class ORTHOPEN_OT_permanent_modifiers(bpy.types.Operator):
             if(len(objects_to_permanent) == 0):
                 self.report({'INFO'}, "Could not find a relevant object to permanent")
                 return {'CANCELLED'}
+        elif _KEY_POSING_PROXY in context.active_object.keys():
+            # The proxy is only for posing, the changes are applied to the leg it stands in for
+            objects_to_permanent = [bpy.data.objects[context.active_object[_KEY_POSING_PROXY]]]
         else:
             objects_to_permanent = [context.active_object]
 
+        # While posing the foot, a proxy or lower quality settings were shown in the viewport. Go back to the
+        # full quality, as that is what is applied
+        for object in objects_to_permanent:
+            _end_foot_posing(object)
+
         # Apply all modifiers, such as ankle angle changed by bones
         # See: https://docs.blender.org/api/current/bpy.types.Depsgraph.html
         depedency_graph = bpy.context.evaluated_depsgraph_get()
@@ -82,7 +189,7 @@ class ORTHOPEN_OT_permanent_modifiers(bpy.types.Operator):
         context.collection.objects.update()
 
         # Set viewport shading back to solid
-        bpy.context.space_data.shading.type = 'SOLID'
+        helpers.set_shading_solid()
 
         helpers.toggle_xray(False)
 
@@ -92,7 +199,7 @@ class ORTHOPEN_OT_permanent_modifiers(bpy.types.Operator):
 
         return {'FINISHED'}
 
-class ORTHOPEN_OT_set_foot_pivot(bpy.types.Operator):
+class ORTHOPEN_OT_set_foot_pivot(_ThrottledHover, bpy.types.Operator):
     """
     Click on the ankle. Then rotate the foot by moving the visible handle (armature) that is added
     to the foot.
@@ -105,6 +212,37 @@ class ORTHOPEN_OT_set_foot_pivot(bpy.types.Operator):
     # however we do not have that option for modifiers, vertexgroups etc
     _FOOT_AUTOGEN_ID = "foot_auto_gen"
 
+    # Modifiers with lower quality, that are only shown in the viewport while posing
+    _PREVIEW_SUFFIX = "_preview"
+
+    # Legs with more vertices are posed with a decimated proxy, with about this many cells along the
+    # longest side of the leg
+    _PROXY_MIN_VERTICES = 50000
+    _PROXY_CELLS = 150
+
+    # Corrective smoothing iterations while posing, and when rendering or applying the changes
+    _PREVIEW_SMOOTH_ITERATIONS = 10
+    _SMOOTH_ITERATIONS = 80
+
+    # Height above the ankle where the foot weights go from 1 to 0, and how far outside that the deformation
+    # is smoothed
+    _DEFORM_ZONE = 0.02
+    _SMOOTH_MARGIN = 0.005
+
+    use_detected_ankle: bpy.props.BoolProperty(
+        name="Detect ankle",
+        description="Find the ankle of the selected leg automatically, instead of clicking on it. The leg "
+        "must be aligned with the toes along X and the leg along Z",
+        default=False
+    )
+
+    use_posing_proxy: bpy.props.BoolProperty(
+        name="Fast posing",
+        description="Rotate a simplified copy of a high resolution leg, with less smoothing. The full leg "
+        "is shown again by 'Apply changes'",
+        default=True
+    )
+
     @classmethod
     def poll(cls, context):
         try:
@@ -113,21 +251,39 @@ class ORTHOPEN_OT_set_foot_pivot(bpy.types.Operator):
             return False
 
     def invoke(self, context, event):
+        if self.use_detected_ankle:
+            return self.execute(context)
+
         context.window_manager.modal_handler_add(self)
+        self._hover_start(context)
         return {'RUNNING_MODAL'}
 
+    def execute(self, context):
+        # Without a user to click on the ankle, it has to be detected
+        if not self.use_detected_ankle:
+            self.report({'INFO'}, "Click on the ankle, or use 'Detect ankle'")
+            return {'CANCELLED'}
+
+        leg = context.active_object
+        if leg is None or leg.type != 'MESH':
+            self.report({'INFO'}, "Select a leg to detect the ankle on")
+            return {'CANCELLED'}
+
+        start = time.perf_counter()
+        ankle_point = geometry.detect_ankle(helpers.vertex_coordinates(leg), z_order=helpers.vertex_order(leg, axis=2))
+        print(f"Detected ankle of '{leg.name}' in {1000 * (time.perf_counter() - start):.1f} ms")
+        if ankle_point is None:
+            self.report({'WARNING'}, f"Could not find an ankle on '{leg.name}', click on it instead")
+            return {'CANCELLED'}
+
+        return self._main(leg=leg, ankle_point=mathutils.Vector(ankle_point))
+
     def modal(self, context, event):
-        if event.type in {'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE'}:
+        if self._hover_event(context, event):
+            return {'RUNNING_MODAL'}
+        elif event.type in {'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE'}:
             # Allow navigation
             return {'PASS_THROUGH'}
-        elif event.type in {'MOUSEMOVE'}:
-            ray = helpers.mouse_ray_cast(
-                bpy.context, (event.mouse_region_x, event.mouse_region_y))
-            if ray.object is not None:
-                bpy.context.scene.cursor.location = ray.intersection_point
-
-            return {'RUNNING_MODAL'}
-
         elif event.type == 'LEFTMOUSE':
             # See if there is an object in front of the mouse cursor
             ray = helpers.mouse_ray_cast(bpy.context, (event.mouse_region_x, event.mouse_region_y))
@@ -135,38 +291,63 @@ class ORTHOPEN_OT_set_foot_pivot(bpy.types.Operator):
                 self.report({'INFO'}, "No object found in front of mouse cursor")
                 return {'RUNNING_MODAL'}
 
+            self._hover_stop(context)
             self._main(leg=ray.object, ankle_point=ray.intersection_point)
 
             return {'FINISHED'}
-        if event.type == 'MOUSEMOVE':
-            return {'PASS_THROUGH'}
         elif event.type in {'RIGHTMOUSE', 'ESC'}:
+            self._hover_stop(context)
             return {'CANCELLED'}
 
         return {'RUNNING_MODAL'}
 
+    def _hover(self, context, mouse_coords):
+        ray = helpers.mouse_ray_cast(context, mouse_coords)
+        if ray.object is not None:
+            context.scene.cursor.location = ray.intersection_point
+
     def _main(self, leg, ankle_point):
         # Identify the foot by a vertex group. First remove any
         # previously generated vertex groups
-        for vertex_group in (leg.vertex_groups):
+        for vertex_group in list(leg.vertex_groups):
             if self._FOOT_AUTOGEN_ID in vertex_group.name:
                 leg.vertex_groups.remove(vertex_group)
         foot = leg.vertex_groups.new(name=self._FOOT_AUTOGEN_ID)
 
-        # Remove previous armatures and modifiers
+        # Remove previous armatures, modifiers and proxies
+        _end_foot_posing(leg)
         _clear_managed_armature(leg)
-        for modifier in leg.modifiers:
+        for modifier in list(leg.modifiers):
             if self._FOOT_AUTOGEN_ID in modifier.name:
                 leg.modifiers.remove(modifier)
 
         # Armature and weight paint is what allows us to adjust the foot
-        self._weight_paint(foot, ankle_point)
+        self._weight_paint(foot, ankle_point, leg)
         armature = self._add_armature(ankle_point, foot.name)
 
         # This might be the most important aspect for getting an angle adjustment that looks realistic
+        # Only the band around the ankle, where the weights are between 0 and 1, needs smoothing. The vertex
+        # group only limits which vertices move, Blender still smooths the whole mesh, see
+        # benchmark_ankle_smoothing() in benchmark_in_blender.py
         corrective_smooth = leg.modifiers.new(name=self._FOOT_AUTOGEN_ID, type="CORRECTIVE_SMOOTH")
         corrective_smooth.factor = 1
-        corrective_smooth.iterations = 80
+        corrective_smooth.iterations = self._SMOOTH_ITERATIONS
+        corrective_smooth.vertex_group = self._add_smooth_band(leg, ankle_point).name
+
+        # Every bone rotation evaluates the deformation and smoothing of all vertices. While posing a high
+        # resolution leg, show less smoothing of a simplified copy in the viewport instead. The full quality is
+        # still used for rendering, and shown again by 'Apply changes'
+        if self.use_posing_proxy and len(leg.data.vertices) > self._PROXY_MIN_VERTICES:
+            proxy = self._add_posing_proxy(leg, armature, ankle_point)
+            corrective_smooth.show_viewport = False
+            preview_smooth = proxy.modifiers.new(name=self._FOOT_AUTOGEN_ID + self._PREVIEW_SUFFIX,
+                                                 type="CORRECTIVE_SMOOTH")
+            preview_smooth.factor = 1
+            preview_smooth.iterations = self._PREVIEW_SMOOTH_ITERATIONS
+            preview_smooth.show_render = False
+            preview_smooth.vertex_group = self._add_smooth_band(proxy, ankle_point).name
+            self.report({'INFO'}, f"Posing the simplified copy '{proxy.name}'. '{leg.name}' is hidden until "
+                        "'Apply changes'")
 
         # Select armature, this is probably what the user is interested in now
         bpy.ops.object.mode_set(mode='OBJECT')
@@ -177,8 +358,7 @@ class ORTHOPEN_OT_set_foot_pivot(bpy.types.Operator):
         bpy.ops.object.mode_set(mode='POSE')
 
         # To easier visualize the armature the viewport shading is set to SOLID and toggle X-ray
-        if bpy.context.space_data.shading.type != 'SOLID' : 
-            bpy.context.space_data.shading.type = 'SOLID'
+        helpers.set_shading_solid()
         
         helpers.toggle_xray(True)
 
@@ -187,28 +367,71 @@ class ORTHOPEN_OT_set_foot_pivot(bpy.types.Operator):
 
         return {'FINISHED'}
 
-    def _weight_paint(self, foot: bpy.types.VertexGroup, ankle_point: mathutils.Vector):
+    def _add_smooth_band(self, object: bpy.types.Object, ankle_point: mathutils.Vector) -> bpy.types.VertexGroup:
+        """
+        Add a vertex group with the vertices around the ankle, where the deformation should be smoothed. The
+        vertices are found in the cached Z order, without looking at the rest of the leg.
+        """
+        band = (ankle_point.z - self._SMOOTH_MARGIN, ankle_point.z + self._DEFORM_ZONE + self._SMOOTH_MARGIN)
+        group = object.vertex_groups.new(name=self._FOOT_AUTOGEN_ID + "_band")
+        group.add(index=helpers.vertices_between(object, axis=2, low=band[0], high=band[1]).tolist(), weight=1,
+                  type='REPLACE')
+        return group
+
+    def _add_posing_proxy(self, leg: bpy.types.Object, armature: bpy.types.Object, ankle_point: mathutils.Vector):
+        """
+        Add a decimated copy of the leg, deformed by the same armature, and hide the leg itself from the
+        viewport so it is not evaluated while posing.
+        """
+        start = time.perf_counter()
+        vertices = helpers.vertex_coordinates(leg)
+        cell_size = np.amax(np.ptp(vertices, axis=0)) / self._PROXY_CELLS
+        proxy = helpers.add_mesh_object(leg.name + "_posing", *geometry.cluster_vertices(
+            vertices, helpers.triangles(leg), cell_size))
+        proxy[_KEY_POSING_PROXY] = leg.name
+        proxy.matrix_world = leg.matrix_world.copy()
+        proxy.hide_render = True
+
+        foot = proxy.vertex_groups.new(name=self._FOOT_AUTOGEN_ID)
+        self._weight_paint(foot, ankle_point, proxy)
+
+        # Parenting the proxy to the bone. Order of selection is imperative
+        bpy.ops.object.select_all(action='DESELECT')
+        proxy.select_set(True)
+        armature.select_set(True)
+        bpy.context.view_layer.objects.active = armature
+        bpy.ops.object.parent_set(type='ARMATURE')
+
+        leg.hide_viewport = True
+        print(f"Added posing proxy with {len(proxy.data.vertices)} of {vertices.shape[0]} vertices in "
+              f"{1000 * (time.perf_counter() - start):.1f} ms")
+        return proxy
+
+    @staticmethod
+    def _weight_paint(foot: bpy.types.VertexGroup, ankle_point: mathutils.Vector, object: bpy.types.Object = None):
         """
         Add weight paint to the foot vertex group.
         The weight paint defines how the mesh will deform when coupled with an armature.
+
+        Args:
+            foot (bpy.types.VertexGroup): Vertex group of the object
+            ankle_point (mathutils.Vector): Ankle, object coordinates
+            object (bpy.types.Object): The object with the vertex group, the active object if not given
         """
         bpy.ops.object.mode_set(mode='OBJECT')
+        if object is None:
+            object = bpy.context.active_object
 
-        # Set the default weight to zero
-        foot.add(index=[v.index for v in bpy.context.active_object.data.vertices], weight=0, type='REPLACE')
-
-        for vertex in bpy.context.active_object.data.vertices:
-            diff_from_ankle = vertex.co - ankle_point
+        # Every call to VertexGroup.add() is expensive, so the weights are rounded to a few levels and all
+        # vertices with the same weight are added at once. The steps are small compared to the corrective smoothing
+        weights = geometry.foot_weights(helpers.vertex_coordinates(object)[:, 2], ankle_point.z,
+                                        deform_zone=ORTHOPEN_OT_set_foot_pivot._DEFORM_ZONE)
 
-            if diff_from_ankle.z >= 0:
-                # Create a deformation zone with linearly decreasing weight from 1 to 0 above the ankle
-                DEFORM_ZONE = 0.02
-                weight = np.clip(1 - diff_from_ankle.z / DEFORM_ZONE, 0, 1)
-            else:
-                # Move everyting below the ankle as a solid object
-                weight = 1
-
-            foot.add(index=[vertex.index], weight=weight, type='REPLACE')
+        unique_weights, weight_index = np.unique(weights, return_inverse=True)
+        vertex_indices = np.split(np.argsort(weight_index, kind='stable'),
+                                  np.cumsum(np.bincount(weight_index))[:-1])
+        for weight, indices in zip(unique_weights, vertex_indices):
+            foot.add(index=indices.tolist(), weight=float(weight), type='REPLACE')
 
     def _add_armature(self, ankle_point: mathutils.Vector, foot_name: str):
         """
@@ -261,6 +484,8 @@ class ORTHOPEN_OT_leg_prosthesis_generate(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO'}
 
     _SAVED_LOCATION = None
+    _SAVED_AXIS = None
+    _ASSETS_FILENAME = "cosmetics_deformed.blend"
 
     set_max_circumference: bpy.props.FloatProperty(
         name="Calf circumference (max)",
@@ -285,6 +510,15 @@ class ORTHOPEN_OT_leg_prosthesis_generate(bpy.types.Operator):
         default=0.1
     )
 
+    fitting_mode: bpy.props.EnumProperty(
+        name="Fitting",
+        description="How the cosmetics are shaped after the leg",
+        items=[('UNIFORM', "Uniform", "Scale the whole cosmetics to the calf circumference"),
+               ('PROFILE', "Measured profile", "Scale each ring of the cosmetics to the circumference of the "
+                "scanned leg at the same height. The scan must stand on the same floor as the prosthesis")],
+        default='UNIFORM'
+    )
+
     use_interactive_placement: bpy.props.BoolProperty(
         name="Interactive clip placement",
         description="After clicking 'OK' below, click a point on the prosthesis tube where"
@@ -294,6 +528,9 @@ class ORTHOPEN_OT_leg_prosthesis_generate(bpy.types.Operator):
 
     @ classmethod
     def poll(cls, context):
+        if not helpers.asset_available(cls._ASSETS_FILENAME, ["clip", "cosmetics_main"]):
+            return False
+
         # Chooses whether the option shall be available even when no model has been imported.
         # True = show || False = hide
         try:
@@ -311,13 +548,38 @@ class ORTHOPEN_OT_leg_prosthesis_generate(bpy.types.Operator):
         return {'FINISHED'}
 
     def invoke(self, context, event):
+        # Propose the calf circumference of the scanned leg, the user can still change it in the dialog
+        scan = self._find_scan(context)
+        if scan is not None and not self.properties.is_property_set("set_max_circumference"):
+            start = time.perf_counter()
+            _, profile = helpers.circumference_profile(scan)
+            calf = geometry.calf_circumference(profile)
+            print(f"Measured circumference profile of '{scan.name}' in {1000 * (time.perf_counter() - start):.1f} ms")
+            if calf is not None:
+                self.set_max_circumference = calf[1]
+
         return context.window_manager.invoke_props_dialog(self)
 
+    @staticmethod
+    def _find_scan(context):
+        """
+        The active object if it is an imported scan, otherwise the first imported scan in the scene
+        """
+        def is_scan(obj):
+            return obj.type == 'MESH' and _KEY_IMPORTED_SCAN in obj.keys() and obj.name != "Foot_ref"
+
+        if context.active_object is not None and is_scan(context.active_object):
+            return context.active_object
+
+        scans = [obj for obj in context.scene.objects if is_scan(obj)]
+        return scans[0] if len(scans) > 0 else None
+
     def draw(self, context):
         row = self.layout
         row.prop(self, "set_max_circumference", text="Calf circumference (max)")
         row.prop(self, "set_height", text="Cosmetics total height")
         row.prop(self, "set_clip_position_z", text="Clip start height")
+        row.prop(self, "fitting_mode", text="Fitting")
         # Disable option in case a cosmetic is placed. Enables the adjustable pop-up window to work.
         if not "cosmetics_main" in bpy.data.objects:
             row.prop(self, "use_interactive_placement", text="Interactive clip placement")
@@ -329,18 +591,18 @@ class ORTHOPEN_OT_leg_prosthesis_generate(bpy.types.Operator):
             return {'PASS_THROUGH'}
         elif event.type == 'LEFTMOUSE':
             # Gather information from user where to place the cosmetic
-            clamp_origin = self._determine_clamp_origin(mouse_coords=(event.mouse_region_x, event.mouse_region_y))
-
-            # Location is saved in order to keep it in place if properties are updated
-            self._SAVED_LOCATION = clamp_origin
+            tube = self._determine_clamp_cylinder(mouse_coords=(event.mouse_region_x, event.mouse_region_y))
 
-            # If no object is found, setting clamp_origin to None places the cosmetic in origo.
-            if clamp_origin is None:
+            # If no object is found, the cosmetic is placed in origo.
+            if tube is None:
                 self.report(
                     {'INFO'},
                     "Could not find a tube for the fastening clamp. Will place prosthesis at default location.")
-
-            self._main(clamp_origin)
+                self._main()
+            else:
+                # Location is saved in order to keep it in place if properties are updated
+                self._SAVED_LOCATION, self._SAVED_AXIS = tube.center, tube.axis
+                self._main(tube.center, tube.axis)
             
             return {'FINISHED'}
         elif event.type in {'RIGHTMOUSE', 'ESC'}:
@@ -348,7 +610,7 @@ class ORTHOPEN_OT_leg_prosthesis_generate(bpy.types.Operator):
 
         return {'RUNNING_MODAL'}
 
-    def _main(self, set_clamp_origin=None):
+    def _main(self, set_clamp_origin=None, set_clamp_axis=None):
         cosmetics_main, clip = self._import_from_assets_folder()
 
         # The bounding box is defined in object coordinates, and defines the mesh size with no scale applied
@@ -371,6 +633,7 @@ class ORTHOPEN_OT_leg_prosthesis_generate(bpy.types.Operator):
         if(self._SAVED_LOCATION is not None):
             self.use_interactive_placement = False
             set_clamp_origin = np.array(self._SAVED_LOCATION)
+            set_clamp_axis = self._SAVED_AXIS
 
         # This is true if the body is not rotated, and no modifiers are applied
         cosmetics_main_origin_to_z_min = (np.amin(np.array(cosmetics_main.bound_box), axis=0))[2]\
@@ -387,49 +650,80 @@ class ORTHOPEN_OT_leg_prosthesis_generate(bpy.types.Operator):
         mat[:3, 3] = cosmetics_main_translation
         cosmetics_main.matrix_world = mathutils.Matrix(list(mat))
 
+        if self.fitting_mode == 'PROFILE':
+            self._fit_to_profile(cosmetics_main, mat)
+
+        # Turn everything around the clamp origin, so the cosmetics follow a tilted tube
+        if set_clamp_axis is not None:
+            rotation = np.eye(4)
+            rotation[:3, :3] = geometry.rotation_between([0, 0, 1], set_clamp_axis)
+            rotation[:3, 3] = set_clamp_origin - rotation[:3, :3] @ set_clamp_origin
+            cosmetics_main.matrix_world = mathutils.Matrix(list(rotation @ mat))
+
         # UI updates
         bpy.ops.object.select_all(action="DESELECT")
         cosmetics_main.select_set(True)
         #helpers.set_view_to_xz()
 
-    def _determine_clamp_origin(self, mouse_coords):
+    def _fit_to_profile(self, cosmetics_main: bpy.types.Object, matrix_world: np.ndarray):
+        """
+        Shape the cosmetics after the circumference profile of the scanned leg, see geometry.fit_rings_to_profile()
         """
-        Determine an origin of the fastening clamp based on current mouse coordinates. This
-        origin should make the clamp align well with the prosthesis tube.
+        scan = self._find_scan(bpy.context)
+        if scan is None:
+            self.report({'WARNING'}, "No imported scan to measure, the cosmetics are scaled uniformly")
+            return
+
+        start = time.perf_counter()
+        heights, profile = helpers.circumference_profile(scan)
+        mesh = cosmetics_main.data
+        fitted = geometry.fit_rings_to_profile(helpers.vertex_coordinates(cosmetics_main), matrix_world,
+                                               heights, profile)
+        mesh.vertices.foreach_set("co", fitted.astype(np.float32).ravel())
+        mesh.update()
+        helpers.clear_cached_geometry(mesh)
+        print(f"Fitted '{cosmetics_main.name}' to '{scan.name}' in {1000 * (time.perf_counter() - start):.1f} ms")
+
+    def _determine_clamp_cylinder(self, mouse_coords):
+        """
+        Determine an origin and axis of the fastening clamp based on current mouse coordinates, by fitting
+        a cylinder to the prosthesis tube around the clicked point. The tube may be tilted.
+
+        Returns:
+            geometry.Cylinder: In world coordinates, 'None' if there is no tube under the mouse
         """
         ray = helpers.mouse_ray_cast(bpy.context, mouse_coords=mouse_coords)
 
         if ray.intersection_point is None:
             return None
-   
+
         # Convert from object to world coordinates
-        intersection_world = ray.object.matrix_world @ ray.intersection_point
-        vertices_world = np.array([[v.co.x, v.co.y, v.co.z, 1]
-                                for v in ray.object.data.vertices]) @ np.array(list(ray.object.matrix_world)).T
-
-        # Assume the prosthesis tube is perfectly cylindrical and parallel to the world Z-axis. Select
-        # vertices symmetrically around the ray cast intersection.
-        squared_distances_z = (vertices_world[:, 2] - intersection_world[2])**2
-        Z_SELECTION_METERS = 0.015
-        selected_vertices = vertices_world[squared_distances_z < Z_SELECTION_METERS**2, :3]
-
-        # Likely to happen for a tube created in blender, these have few vertices along their length per default
-        MINIMUM_VERTICES_FOR_VALID_RESULT = 5
-        
-        if selected_vertices.shape[0] < MINIMUM_VERTICES_FOR_VALID_RESULT:
-            return None
-            
-        # This should be the center point of a vertical tube section
-        return np.mean(selected_vertices, axis=0) 
+        intersection_world = np.array(ray.object.matrix_world @ ray.intersection_point)
+
+        # Only the vertices around the clicked point are needed, the scan may contain much more than the tube
+        NEIGHBOURHOOD_RADIUS = 0.03
+        start = time.perf_counter()
+        indices = helpers.vertices_near(ray.object, intersection_world, NEIGHBOURHOOD_RADIUS)
+        matrix_world = np.array(ray.object.matrix_world)
+        vertices_world = geometry.transform_points(helpers.vertex_coordinates(ray.object)[indices], matrix_world)
+        normals_world = helpers.vertex_normals(ray.object)[indices] @ np.linalg.inv(matrix_world[:3, :3])
+
+        tube = geometry.fit_cylinder(vertices_world, normals_world, intersection_world)
+        print(f"Fitted clamp cylinder to {indices.shape[0]} vertices in {1000 * (time.perf_counter() - start):.1f} ms")
+        if tube is not None:
+            return tube
+
+        # Too few vertices, e.g. a tube created in Blender. Assume it is parallel to the world Z-axis
+        center = geometry.clamp_origin(helpers.vertex_coordinates(ray.object, space='WORLD'), intersection_world)
+        return None if center is None else geometry.Cylinder(center, np.array([0.0, 0.0, 1.0]), None)
 
     def _import_from_assets_folder(self):
-        assets = helpers.load_assets(filename="cosmetics_deformed.blend", names=["clip", "cosmetics_main"])
+        assets = helpers.load_assets(filename=self._ASSETS_FILENAME, names=["clip", "cosmetics_main"])
 
         # In following code, it is assumed that these objects are not rotated
-        def not_rotated(object): return np.linalg.norm(np.array(object.matrix_world.to_quaternion()) -
-                                                       np.array(mathutils.Quaternion())) < 1.E-7
-        assert not_rotated(assets["cosmetics_main"]) and not_rotated(
-            assets["clip"]), "Parts in '{FILE_PATH}' must not be rotated prior to import"
+        assert helpers.asset_not_rotated(self._ASSETS_FILENAME, assets, "cosmetics_main") and \
+            helpers.asset_not_rotated(self._ASSETS_FILENAME, assets, "clip"), \
+            f"Parts in '{self._ASSETS_FILENAME}' must not be rotated prior to import"
 
         return assets["cosmetics_main"], assets["clip"]
 
@@ -455,40 +749,226 @@ class ORTHOPEN_OT_leg_prosthesis_mirror(bpy.types.Operator):
 
         return {'FINISHED'}
 
-# A function added in order to automatically align the imported object according to XYZ in order to function with the rest of the functions.
-class ORTHOPEN_OT_leg_prosthesis_test(bpy.types.Operator):
+class ORTHOPEN_OT_align_scan(bpy.types.Operator):
+    """
+    Rotate the selected 3D-model so that the toes point along the X-axis and the leg along the Z-axis,
+    as the other functions expect. Apply with "Transform all" afterwards.
+    """
     bl_idname = helpers.mangle_operator_name(__qualname__)
-    bl_label = "Test function" # NOT IN PRODUCTION
+    bl_label = "Align 3D-model"
     bl_options = {'REGISTER', 'UNDO'}
 
+    @ classmethod
+    def poll(cls, context):
+        try:
+            return context.active_object.type == 'MESH' and context.object.mode == 'OBJECT'
+        except AttributeError:
+            return False
+
     def execute(self, context):
         leg = context.active_object
-        all_vertices = np.array([(v.co.x, v.co.y, v.co.z) for v in leg.data.vertices])
 
-        # Due to the L-shaped geometry of a leg and a foot, we can get the approximate sizes of the model like this
-        imported_model_x = np.amax(all_vertices[:, 0]) - np.amin(all_vertices[:, 0])
-        imported_model_y = np.amax(all_vertices[:, 1]) - np.amin(all_vertices[:, 1])
-        imported_model_z = np.amax(all_vertices[:, 2]) - np.amin(all_vertices[:, 2])
+        # Only a fixed size sample of the vertices is used, so this takes the same time for any scan
+        start = time.perf_counter()
+        matrix = geometry.leg_alignment(helpers.vertex_coordinates(leg), np.array(leg.matrix_world))
+        leg.matrix_world = mathutils.Matrix(matrix.tolist()) @ leg.matrix_world
+        print(f"Aligned '{leg.name}' in {1000 * (time.perf_counter() - start):.1f} ms")
 
-        # Add the imported 3D model dimensions to an array and sort by value
-        model_size_data = np.sort(np.array([imported_model_x, imported_model_y, imported_model_z]))
+        return {'FINISHED'}
+
+class ORTHOPEN_OT_register_to_reference(bpy.types.Operator):
+    """
+    Move the selected 3D-model onto the foot reference, so that it can be compared with it. Align the model first,
+    with the toes along the X-axis and the leg along the Z-axis.
+    """
+    bl_idname = helpers.mangle_operator_name(__qualname__)
+    bl_label = "Snap to foot reference"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    _REFERENCE_NAME = "Foot_ref"
+
+    @ classmethod
+    def poll(cls, context):
+        try:
+            return context.active_object.type == 'MESH' and context.active_object.name != cls._REFERENCE_NAME and \
+                cls._REFERENCE_NAME in context.scene.objects
+        except AttributeError:
+            return False
+
+    def execute(self, context):
+        scan, reference = context.active_object, context.scene.objects[self._REFERENCE_NAME]
+
+        # Start with the toes, the sole and the middle of the foot in the same place
+        def landmark(object: bpy.types.Object):
+            corners = geometry.bound_box_world(np.array(object.bound_box), np.array(object.matrix_world))
+            low, high = np.amin(corners, axis=0), np.amax(corners, axis=0)
+            return np.array([high[0], (low[1] + high[1]) / 2, low[2]])
+        initial = np.eye(4)
+        initial[:3, 3] = landmark(reference) - landmark(scan)
+
+        start = time.perf_counter()
+        matrix, residuals = geometry.register_points(helpers.vertex_coordinates(scan, space='WORLD'),
+                                                     helpers.vertex_coordinates(reference, space='WORLD'),
+                                                     helpers.closest_point_search, matrix=initial)
+        seconds = time.perf_counter() - start
+        if len(residuals) == 0:
+            self.report({'WARNING'}, f"'{scan.name}' or '{reference.name}' has no vertices to snap together")
+            return {'CANCELLED'}
+        scan.matrix_world = mathutils.Matrix(matrix.tolist()) @ scan.matrix_world
+
+        for voxel_size, iteration, rms, count in residuals:
+            print(f"Voxel size {1000 * voxel_size:.1f} mm, iteration {iteration}: RMS distance {1000 * rms:.2f} mm "
+                  f"({count} points)")
+        self.report({'INFO'}, f"Snapped '{scan.name}' to '{reference.name}' in {seconds:.2f} s, "
+                    f"RMS distance {1000 * residuals[-1][2]:.2f} mm")
+
+        return {'FINISHED'}
+
+class ORTHOPEN_OT_deviation_heatmap(bpy.types.Operator):
+    """
+    Color the selected 3D-model by its distance to a reference, red where it is outside and blue where it is
+    inside. The reference is the other selected 3D-model, e.g. a scan from a previous visit, or else the foot
+    reference
+    """
+    bl_idname = helpers.mangle_operator_name(__qualname__)
+    bl_label = "Compare with reference"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    _REFERENCE_NAME = "Foot_ref"
+    _COLOR_ATTRIBUTE = "deviation"
+    _DISTANCE_ATTRIBUTE = "deviation_distance"
+
+    # Distances are only measured this many times the color range, further away they are shown grey
+    _SEARCH_FACTOR = 2
+
+    max_distance: bpy.props.FloatProperty(
+        name="Color range",
+        description="Distance with the strongest color, inside or outside the reference",
+        unit="LENGTH",
+        min=0.0001,
+        default=0.005
+    )
+
+    @ classmethod
+    def poll(cls, context):
+        try:
+            return context.active_object.type == 'MESH' and context.object.mode == 'OBJECT'
+        except AttributeError:
+            return False
+
+    def execute(self, context):
+        scan = context.active_object
+        others = [obj for obj in context.selected_objects if obj != scan and obj.type == 'MESH']
+        if len(others) == 1:
+            reference = others[0]
+        elif self._REFERENCE_NAME in context.scene.objects and scan.name != self._REFERENCE_NAME:
+            reference = context.scene.objects[self._REFERENCE_NAME]
+        else:
+            self.report({'WARNING'}, "Select one other 3D-model to compare with")
+            return {'CANCELLED'}
+
+        start = time.perf_counter()
+        vertices = helpers.vertex_coordinates(scan, space='WORLD')
+        closest, normals = helpers.nearest_surface_points(reference, vertices,
+                                                          max_distance=self._SEARCH_FACTOR * self.max_distance)
+        distances = geometry.signed_distances(vertices, closest, normals)
+        query_seconds = time.perf_counter() - start
+
+        mesh = scan.data
+        for name in (self._COLOR_ATTRIBUTE, self._DISTANCE_ATTRIBUTE):
+            if name in mesh.attributes:
+                mesh.attributes.remove(mesh.attributes[name])
+        mesh.attributes.new(self._DISTANCE_ATTRIBUTE, 'FLOAT', 'POINT').data.foreach_set(
+            "value", distances.astype(np.float32))
+        colors = mesh.attributes.new(self._COLOR_ATTRIBUTE, 'FLOAT_COLOR', 'POINT')
+        colors.data.foreach_set("color", geometry.deviation_colors(distances, self.max_distance).ravel())
+        helpers.show_color_attribute(scan, self._COLOR_ATTRIBUTE)
+
+        counts, edges = geometry.distance_histogram(distances, self.max_distance)
+        scan[_KEY_DEVIATION_HISTOGRAM] = {"edges": edges.tolist(), "counts": counts.tolist()}
+        print(f"Distance from '{scan.name}' to '{reference.name}', {len(vertices)} vertices in {query_seconds:.2f} s")
+        print(f"{'from [mm]':>10} {'to [mm]':>8} {'vertices':>9}")
+        for low, high, count in zip(edges[:-1], edges[1:], counts):
+            print(f"{1000 * low:>10.1f} {1000 * high:>8.1f} {count:>9} {'#' * int(50 * count / max(counts.max(), 1))}")
+
+        found = distances[~np.isnan(distances)]
+        if found.shape[0] > 0:
+            self.report({'INFO'}, f"Compared with '{reference.name}': median {1000 * np.median(found):.1f} mm, "
+                        f"{100 * np.count_nonzero(np.abs(found) <= self.max_distance) / len(distances):.0f} % "
+                        f"within {1000 * self.max_distance:.1f} mm, {len(distances) - found.shape[0]} vertices "
+                        f"further than {1000 * self._SEARCH_FACTOR * self.max_distance:.1f} mm")
+
+        return {'FINISHED'}
+
+class ORTHOPEN_OT_check_clearance(bpy.types.Operator):
+    """
+    Measure how far each generated part, e.g. the foot splint, toe box or a pad, is from the scans, and where it
+    goes into them. Parts that have not changed since the last check are not measured again
+    """
+    bl_idname = helpers.mangle_operator_name(__qualname__)
+    bl_label = "Check clearance"
+    bl_options = {'REGISTER'}
+
+    _REFERENCE_NAME = "Foot_ref"
+
+    required_clearance: bpy.props.FloatProperty(
+        name="Required clearance",
+        description="Parts closer to a scan than this are reported",
+        unit="LENGTH",
+        min=0.0,
+        default=0.002
+    )
+
+    search_distance: bpy.props.FloatProperty(
+        name="Search distance",
+        description="Distances beyond this are not measured, which makes the check faster",
+        unit="LENGTH",
+        min=0.001,
+        default=0.02
+    )
+
+    @ classmethod
+    def poll(cls, context):
+        try:
+            return context.mode == 'OBJECT'
+        except AttributeError:
+            return False
+
+    def execute(self, context):
+        # A posing proxy stands in for its hidden leg
+        meshes = [obj for obj in context.scene.objects if obj.type == 'MESH' and obj.visible_get() and
+                  obj.name != self._REFERENCE_NAME]
+        scans = [obj for obj in meshes if _KEY_IMPORTED_SCAN in obj.keys() or _KEY_POSING_PROXY in obj.keys()]
+        parts = [obj for obj in meshes if obj not in scans]
+        if len(scans) == 0 or len(parts) == 0:
+            self.report({'WARNING'}, "Nothing to check, needs both a scan and a generated part")
+            return {'CANCELLED'}
+
+        start = time.perf_counter()
+        measured, too_close = 0, []
+        print(f"{'part':<30} {'scan':<30} {'min distance [mm]':>18} {'regions':>8} {'inside':>8} {'faces':>6}")
+        for part in parts:
+            for scan in scans:
+                # Boxes further apart than the search distance can not be within it
+                part_box, scan_box = helpers.bound_box_world(part), helpers.bound_box_world(scan)
+                gap = np.amax(np.maximum(np.amin(part_box, axis=0) - np.amax(scan_box, axis=0),
+                                         np.amin(scan_box, axis=0) - np.amax(part_box, axis=0)))
+                if gap > self.search_distance:
+                    continue
+
+                result, is_new = helpers.clearance(part, scan, self.search_distance)
+                measured += is_new
+                if result.min_distance < self.required_clearance:
+                    too_close.append(part.name)
+                print(f"{part.name:<30} {scan.name:<30} {1000 * result.min_distance:>18.2f} {result.region_count:>8} "
+                      f"{result.penetrating_vertices:>8} {result.intersecting_faces:>6}{'' if is_new else ' (kept)'}")
+
+        message = f"Checked {len(parts)} part(s) in {time.perf_counter() - start:.2f} s, {measured} measured again"
+        if len(too_close) > 0:
+            self.report({'WARNING'}, f"{message}. Too close: {', '.join(sorted(set(too_close)))}")
+        else:
+            self.report({'INFO'}, f"{message}. All parts clear by {1000 * self.required_clearance:.1f} mm")
 
-        # Assumes that the smallest value in array is the width of the foot
-        foot_width = model_size_data[0]
-        # Assumes that the middle value in array is the length of the foot
-        foot_length = model_size_data[1]
-        # Assumes that the highest value in array is the height of the foot/leg
-        foot_height = model_size_data[2]
-
-        # foot_width/2 ska följa X-axeln, tånas riktning +X
-
-        # Define direction
-        Vector = (0, 1, 0)
-        DirectionVector = mathutils.Vector(Vector) 
-        # Apply rotation
-        leg.rotation_mode = 'QUATERNION'
-        leg.rotation_quaternion = DirectionVector.to_track_quat('Y','Z')
-        
         return {'FINISHED'}
 
 class ORTHOPEN_OT_model_transform_all(bpy.types.Operator):
@@ -510,18 +990,56 @@ class ORTHOPEN_OT_model_transform_all(bpy.types.Operator):
         except AttributeError:
             return False
 
-    def execute(self, context):    
-        # Transform all function for MESH objects 
-        for obj in bpy.context.scene.objects:
-            if obj.type == 'MESH':
-                matrix = obj.matrix_world.copy()
-                for vert in obj.data.vertices:
-                    vert.co = matrix @ vert.co
+    def execute(self, context):
+        # Read all transforms before changing anything, parents and children affect each other
+        mesh_objects = [obj for obj in bpy.context.scene.objects if obj.type == 'MESH']
+        matrices = {obj: obj.matrix_world.copy() for obj in mesh_objects}
+
+        # Several objects can share one mesh. All objects with the same transform can share the transformed
+        # mesh, all others (and users outside the scene) need a copy of their own
+        objects_by_mesh = dict()
+        for obj in mesh_objects:
+            objects_by_mesh.setdefault(obj.data, []).append(obj)
+
+        timings = []
+        for mesh, objects in objects_by_mesh.items():
+            objects_by_matrix = dict()
+            for obj in objects:
+                objects_by_matrix.setdefault(tuple(map(tuple, matrices[obj])), []).append(obj)
+
+            for same_matrix_objects in objects_by_matrix.values():
+                matrix = matrices[same_matrix_objects[0]]
+                if matrix == mathutils.Matrix.Identity(4):
+                    continue
+
+                start = time.perf_counter()
+                target_mesh = mesh
+                if len(objects_by_matrix) > 1 or mesh.users > len(objects):
+                    target_mesh = mesh.copy()
+                    for obj in same_matrix_objects:
+                        obj.data = target_mesh
+
+                target_mesh.transform(matrix, shape_keys=True)
+                target_mesh.update()
+                helpers.clear_cached_geometry(target_mesh)
+                timings.append((same_matrix_objects, time.perf_counter() - start))
+
+        # Parents first, else the children would be placed relative to the old transform of their parent
+        def depth(obj):
+            return 0 if obj.parent is None else 1 + depth(obj.parent)
+
+        for obj in sorted(mesh_objects, key=depth):
+            if matrices[obj] != mathutils.Matrix.Identity(4):
                 obj.matrix_world.identity()
 
+        for objects, seconds in timings:
+            print(f"Transformed '{', '.join([o.name for o in objects])}' in {1000 * seconds:.1f} ms")
+        self.report({'INFO'}, f"Transformed {sum([len(o) for o, _ in timings])} objects in "
+                    f"{sum([t for _, t in timings]):.2f} s")
+
         return {'FINISHED'}
 
-class ORTHOPEN_OT_generate_pad(bpy.types.Operator):
+class ORTHOPEN_OT_generate_pad(_ThrottledHover, bpy.types.Operator):
     """
     Interactively generate a pad that sticks to surfaces. Hover the object where it should be centered and click left mouse button.
     Can be used e.g. for ensuring clearance between an ankle and a foot splint.
@@ -532,6 +1050,9 @@ class ORTHOPEN_OT_generate_pad(bpy.types.Operator):
 
     @ classmethod
     def poll(cls, context):
+        if not helpers.asset_available("pad.blend", ["pad"]):
+            return False
+
         try:
             return bpy.context.object.mode == 'OBJECT'
         except AttributeError:
@@ -539,36 +1060,35 @@ class ORTHOPEN_OT_generate_pad(bpy.types.Operator):
 
     def invoke(self, context, event):
         self.pad = (helpers.load_assets(filename="pad.blend", names=["pad"]))["pad"]
+        self.preview = self._add_preview(self.pad)
 
         context.window_manager.modal_handler_add(self)
+        self._hover_start(context)
         return {'RUNNING_MODAL'}
 
     def modal(self, context, event):
-        if event.type in {'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE'}:
+        if self._hover_event(context, event):
+            return {'RUNNING_MODAL'}
+        elif event.type in {'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE'}:
             # Allow navigation
             return {'PASS_THROUGH'}
-        elif event.type in {'MOUSEMOVE'}:
-            ray = helpers.mouse_ray_cast(
-                bpy.context, (event.mouse_region_x, event.mouse_region_y), ignore=[self.pad.name])
-            if ray.object is None:
-                return {'RUNNING_MODAL'}
-
-            # Snap pad at surface normal when the user moves the cursor around
-            self.pad.matrix_world.translation = ray.object.matrix_world @ ray.intersection_point
-            self.pad.rotation_mode = 'QUATERNION'
-            self.pad.rotation_quaternion = ray.face_normal.to_track_quat('Z', 'Y')
-
-            return {'RUNNING_MODAL'}
-
         elif event.type == 'LEFTMOUSE':
             # See if there is an object in front of the mouse cursor
             ray = helpers.mouse_ray_cast(
                 bpy.context, (event.mouse_region_x, event.mouse_region_y), ignore=[
-                    self.pad.name])
+                    self.pad.name, self.preview.name])
             if (ray.object is None):
                 self.report({'INFO'}, "No object found in front of mouse cursor")
                 return {'RUNNING_MODAL'}
 
+            # Put the real pad where the preview is. Only now are its modifiers evaluated
+            self.pad.matrix_world = self.preview.matrix_world.copy()
+            self.pad.hide_viewport = False
+            self._remove_preview()
+            bpy.ops.object.select_all(action='DESELECT')
+            self.pad.select_set(True)
+            bpy.context.view_layer.objects.active = self.pad
+
             # This will make the pad wrap to surfaces
             for modifier in self.pad.modifiers:
                 if modifier.type == "SHRINKWRAP":
@@ -580,14 +1100,52 @@ class ORTHOPEN_OT_generate_pad(bpy.types.Operator):
             bpy.context.scene.tool_settings.snap_target = 'CENTER'
             bpy.context.scene.tool_settings.use_snap_align_rotation = True
 
+            self._hover_stop(context)
             return {'FINISHED'}
-        if event.type == 'MOUSEMOVE':
-            return {'PASS_THROUGH'}
         elif event.type in {'RIGHTMOUSE', 'ESC'}:
+            self.cancel(context)
             return {'CANCELLED'}
 
         return {'RUNNING_MODAL'}
 
+    def cancel(self, context):
+        # Also called by Blender e.g. when a file is loaded while placing. Do not leave unused pads behind
+        self._hover_stop(context)
+        self._remove_preview()
+        bpy.data.objects.remove(self.pad, do_unlink=True)
+
+    def _hover(self, context, mouse_coords):
+        ray = helpers.mouse_ray_cast(context, mouse_coords, ignore=[self.pad.name, self.preview.name])
+        if ray.object is None:
+            return
+
+        # Snap the preview at surface normal when the user moves the cursor around
+        self.preview.matrix_world.translation = ray.object.matrix_world @ ray.intersection_point
+        self.preview.rotation_mode = 'QUATERNION'
+        self.preview.rotation_quaternion = ray.face_normal.to_track_quat('Z', 'Y')
+
+    @staticmethod
+    def _add_preview(pad: bpy.types.Object):
+        """
+        Add a decimated copy of the pad without modifiers, that follows the cursor instead of the pad. Moving
+        the real pad would evaluate its shrinkwrap modifier against the scan, on every move. The real pad
+        is hidden from the viewport until it is placed, so it is not evaluated at all.
+        """
+        PREVIEW_CELLS = 16
+        vertices = helpers.vertex_coordinates(pad)
+        cell_size = max(np.amax(np.ptp(vertices, axis=0)) / PREVIEW_CELLS, 1.E-6)
+        preview = helpers.add_mesh_object(pad.name + "_preview", *geometry.cluster_vertices(
+            vertices, helpers.triangles(pad), cell_size))
+
+        preview.matrix_world = pad.matrix_world.copy()
+        pad.hide_viewport = True
+        return preview
+
+    def _remove_preview(self):
+        mesh = self.preview.data
+        bpy.data.objects.remove(self.preview, do_unlink=True)
+        bpy.data.meshes.remove(mesh)
+
 class ORTHOPEN_OT_generate_toe_box(bpy.types.Operator):
     """
     Generate a box around the toes. Used to ensure clearence between toes and the foot splint. Select
@@ -599,6 +1157,9 @@ class ORTHOPEN_OT_generate_toe_box(bpy.types.Operator):
 
     @ classmethod
     def poll(cls, context):
+        if not helpers.asset_available("toe_box.blend", ["toe_box"]):
+            return False
+
         try:
             return len(bpy.context.selected_objects) == 1
         except AttributeError:
@@ -607,37 +1168,12 @@ class ORTHOPEN_OT_generate_toe_box(bpy.types.Operator):
     def execute(self, context):
         toe_box = (helpers.load_assets(filename="toe_box.blend", names=["toe_box"]))["toe_box"]
         leg = context.active_object
-        all_vertices = np.array([(v.co.x, v.co.y, v.co.z) for v in leg.data.vertices])
-
-        # Due to the L-shaped geometry of a leg and a foot, we can get the approximate length of the foot like this
-        foot_length_x = np.amax(all_vertices[:, 0]) - np.amin(all_vertices[:, 0])
-
-        # The toes point in the x direction, so we find the toes by selecting all vertices
-        # a bit behind the largest x coordinate
-        sel_range_x_to_get_toes_only = foot_length_x * 0.22
-        toe_sel = all_vertices[:, 0] > (np.amax(all_vertices[:, 0]) - sel_range_x_to_get_toes_only)
-        toe_vertices = all_vertices[toe_sel, :]
-        toe_size = np.amax(toe_vertices, axis=0) - np.amin(toe_vertices, axis=0)
-
-        # Calculate how the toe box should be scaled to fit around the toes
-        toe_box_size = np.amax(np.array(toe_box.bound_box), axis=0) - np.amin(np.array(toe_box.bound_box), axis=0)
-        RATIO_OF_FOOT_BOX_SHOULD_COVER = 0.45
-        CLEARANCE_IN_FRONT_OF_TOES = 0.015
-        target_scale = np.array([(RATIO_OF_FOOT_BOX_SHOULD_COVER * foot_length_x + CLEARANCE_IN_FRONT_OF_TOES) / toe_box_size[0],
-                                 toe_size[1] / toe_box_size[1],
-                                 toe_size[2] / toe_box_size[2]])
-
-        # Place toe box at center of toes, with the closed end a little bit in front of the toes
-        target_position = np.array(leg.matrix_world) @ np.hstack([np.mean(toe_vertices, axis=0), 1])
-        toe_box_origin_to_x_max = np.amax(np.array(toe_box.bound_box)[:, 0]) * target_scale[0]
-        foot_x_max = (np.amax(helpers.bound_box_world(leg), axis=0))[0]
-        target_position[0] = foot_x_max - toe_box_origin_to_x_max + CLEARANCE_IN_FRONT_OF_TOES
-
-        # Compose homog. transformation matrix
-        mat = np.eye(4)
-        mat[:3, :3] = np.diag(target_scale)
-        mat[:, 3] = target_position
-        toe_box.matrix_world = mathutils.Matrix(list(mat))
+        toe_box.matrix_world = mathutils.Matrix(list(geometry.toe_box_matrix(
+            leg_vertices=helpers.vertex_coordinates(leg),
+            leg_matrix_world=np.array(leg.matrix_world),
+            leg_bound_box=np.array(leg.bound_box),
+            toe_box_bound_box=np.array(toe_box.bound_box),
+            x_order=helpers.vertex_order(leg, axis=0))))
 
         # This will make the toe box wrap to surfaces
         for modifier in toe_box.modifiers:
@@ -654,18 +1190,72 @@ class ORTHOPEN_OT_generate_foot_splint(bpy.types.Operator):
     bl_label = "Generate foot splint"
     bl_options = {'REGISTER', 'UNDO'}
 
+    _ASSETS_FILENAME = _FOOT_SPLINT_ASSETS_FILENAME
+
     @ classmethod
     def poll(cls, context):
+        if not helpers.asset_available(cls._ASSETS_FILENAME, ["Orthos_Base"]):
+            return False
+
         try:
             return len(bpy.context.selected_objects) == 1
         except AttributeError:
             return False
 
     def invoke(self, context, event):
-        if (3, 0, 0) < bpy.app.version:
-            assets = helpers.load_assets(filename="foot_splint_base_geo.blend", names=["Orthos_Base"])
-        else:
-            assets = helpers.load_assets(filename="foot_splint_base.blend", names=["Orthos_Base"])
+        assets = helpers.load_assets(filename=self._ASSETS_FILENAME, names=["Orthos_Base"])
+
+        return {'FINISHED'}
+
+class ORTHOPEN_OT_generate_splint_shell(bpy.types.Operator):
+    """
+    Generate a splint shell on the selected part of a 3D-model. Select the vertices in edit mode first. The
+    shell lies on the skin and grows outwards, change its thickness afterwards in the redo panel
+    """
+    bl_idname = helpers.mangle_operator_name(__qualname__)
+    bl_label = "Generate splint shell"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    thickness: bpy.props.FloatProperty(
+        name="Thickness",
+        description="Thickness of the shell, outwards from the skin",
+        unit="LENGTH",
+        min=0.0005,
+        soft_max=0.01,
+        default=0.003
+    )
+
+    @ classmethod
+    def poll(cls, context):
+        try:
+            return context.active_object.type == 'MESH' and context.active_object.mode in {'OBJECT', 'EDIT'}
+        except AttributeError:
+            return False
+
+    def execute(self, context):
+        scan = context.active_object
+        # The selection is only written to the mesh when leaving edit mode
+        if scan.mode == 'EDIT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+
+        # Topology and normals are kept for the mesh and the selection, the thickness only offsets the vertices
+        start = time.perf_counter()
+        topology = helpers.shell_topology(scan)
+        if topology.faces.shape[0] == 0:
+            self.report({'WARNING'}, f"Select the faces of '{scan.name}' to cover in edit mode first")
+            return {'CANCELLED'}
+
+        vertices = geometry.offset_shell(topology.vertices, topology.normals, self.thickness,
+                                         np.array(scan.matrix_world))
+        offset_seconds = time.perf_counter() - start
+
+        # The faces come from geometry.shell_topology(), there is nothing to fix
+        shell = helpers.add_mesh_object(f"{scan.name}_shell", vertices, topology.faces,
+                                        edges=(topology.edges, topology.corner_edges), validate=False)
+        shell.matrix_world = scan.matrix_world.copy()
+        mesh_seconds = time.perf_counter() - start - offset_seconds
+        print(f"Generated a {1000 * self.thickness:.1f} mm shell with {len(topology.faces)} faces, "
+              f"{1000 * offset_seconds:.1f} ms for topology and offset, {1000 * mesh_seconds:.1f} ms for the mesh")
 
         return {'FINISHED'}
 
@@ -679,11 +1269,42 @@ class ORTHOPEN_OT_import_file(bpy.types.Operator, bpy_extras.io_utils.ImportHelp
     bl_options = {'REGISTER', 'UNDO'}
     filter_glob: bpy.props.StringProperty(default='*.stl;*.STL', options={'HIDDEN'})
 
+    use_fast_import: bpy.props.BoolProperty(
+        name="Fast import",
+        description="Read the file with OrthOpen's own STL reader, which is much faster for large scans."
+        " Disable to use Blender's STL importer",
+        default=True
+    )
+
+    # Several scans can be selected in the file dialog, e.g. left leg, right leg and reference
+    files: bpy.props.CollectionProperty(type=bpy.types.OperatorFileListElement, options={'HIDDEN', 'SKIP_SAVE'})
+    directory: bpy.props.StringProperty(subtype='DIR_PATH', options={'HIDDEN', 'SKIP_SAVE'})
+
     def execute(self, context):
         # Import using a file opening dialog
         old_objects = set(context.scene.objects)
-        bpy.ops.import_mesh.stl(filepath=self.filepath)
-        print(f"Importing '{self.filepath}'")
+        file_paths = [str(Path(self.directory, file.name)) for file in self.files if file.name] or [self.filepath]
+
+        start = time.perf_counter()
+        if self.use_fast_import:
+            # Reading and welding is mostly numpy work that releases the GIL, so the files can be read in
+            # parallel threads. Only creating the meshes has to be done here, on the main thread
+            with ThreadPoolExecutor(max_workers=min(len(file_paths), os.cpu_count() or 1)) as executor:
+                read_files = {executor.submit(stl.read, file_path): file_path for file_path in file_paths}
+                for read_file in as_completed(read_files):
+                    file_path = read_files[read_file]
+                    # Any error in one file must not stop the others from being imported
+                    try:
+                        vertices, faces = read_file.result()
+                        print(f"Importing '{file_path}'")
+                        helpers.add_mesh_object(Path(file_path).stem, vertices, faces)
+                    except Exception as error:
+                        self.report({'WARNING'}, f"Could not import '{file_path}': {error}")
+        else:
+            for file_path in file_paths:
+                print(f"Importing '{file_path}'")
+                bpy.ops.import_mesh.stl(filepath=file_path)
+        print(f"Imported {len(file_paths)} file(s) in {time.perf_counter() - start:.2f} s")
 
         # TODO @SIMON: when multiple body parts are included - create separation of template depending on leg/arm/hand etc.
 
@@ -692,14 +1313,15 @@ class ORTHOPEN_OT_import_file(bpy.types.Operator, bpy_extras.io_utils.ImportHelp
             self.foot_template = helpers.load_assets(filename="foot_ref293.blend", names=["Foot_ref"])
             bpy.data.objects["Foot_ref"].hide_select = True
 
-        # Keep track of what objects we have imported
+        # Keep track of what objects we have imported, the foot reference included
         imported_objects = set(context.scene.objects) - old_objects
         for object in imported_objects:
             object[_KEY_IMPORTED_SCAN] = True
+            if object.name != "Foot_ref":
+                object.select_set(True)
 
         # Change to Viewport Shading to SOLID
-        if bpy.context.space_data.shading.type != 'SOLID':
-            bpy.context.space_data.shading.type = 'SOLID'
+        helpers.set_shading_solid()
 
         # Check whether measureit is available/enabled, if not, install measureit
         # helpers.import_activate_measureit()
@@ -745,29 +1367,38 @@ class ORTHOPEN_OT_asset_folders(bpy.types.Operator):
         return {'FINISHED'}
     
 classes = (
+    ORTHOPEN_OT_align_scan,
+    ORTHOPEN_OT_check_clearance,
+    ORTHOPEN_OT_deviation_heatmap,
     ORTHOPEN_OT_generate_foot_splint,
     ORTHOPEN_OT_generate_pad,
+    ORTHOPEN_OT_generate_splint_shell,
     ORTHOPEN_OT_generate_toe_box,
     ORTHOPEN_OT_import_file,
     ORTHOPEN_OT_leg_prosthesis_generate,
     ORTHOPEN_OT_leg_prosthesis_mirror,
     ORTHOPEN_OT_model_transform_all,
     ORTHOPEN_OT_permanent_modifiers,
+    ORTHOPEN_OT_register_to_reference,
     ORTHOPEN_OT_set_foot_pivot,
 )
 
 classes_3X = (
+    ORTHOPEN_OT_align_scan,
+    ORTHOPEN_OT_check_clearance,
+    ORTHOPEN_OT_deviation_heatmap,
     ORTHOPEN_OT_generate_foot_splint,
     ORTHOPEN_OT_generate_pad,
+    ORTHOPEN_OT_generate_splint_shell,
     ORTHOPEN_OT_generate_toe_box,
     ORTHOPEN_OT_import_file,
     ORTHOPEN_OT_leg_prosthesis_generate,
     ORTHOPEN_OT_leg_prosthesis_mirror,
     ORTHOPEN_OT_asset_library,
     #ORTHOPEN_OT_asset_folders,
-    #ORTHOPEN_OT_leg_prosthesis_test,
     ORTHOPEN_OT_model_transform_all,
     ORTHOPEN_OT_permanent_modifiers,
+    ORTHOPEN_OT_register_to_reference,
     ORTHOPEN_OT_set_foot_pivot,
 )
 
@@ -0,0 +1,169 @@
+"""
+Reading and writing of STL files with numpy. Does not depend on bpy, so it can be used outside of Blender
+and from worker threads.
+"""
+import os
+import re
+
+import numpy as np
+
+# Binary STL: 80 byte header, number of triangles as uint32, then one record per triangle
+_BINARY_HEADER_BYTES = 80
+_BINARY_TRIANGLE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+
+# ASCII STL is read this many bytes at a time, so we never hold the whole text in memory
+_ASCII_CHUNK_BYTES = 1 << 24
+_ASCII_VERTEX = re.compile(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)")
+
+# Coordinates are quantized to this many steps along the largest extent of the mesh before welding. That is
+# well below the resolution of any scanner, and makes all three coordinates fit in one 64 bit integer
+_WELD_STEPS = 2**21
+
+
+def read(path: str):
+    """
+    Read a binary or ASCII STL file, and weld the corners of the triangles into shared vertices.
+
+    Args:
+        path (str): Path to the STL file
+
+    Returns:
+        (np.array, np.array): Vertices (Nx3, float32) and triangles (Mx3 vertex indices, int32)
+    """
+    if is_binary(path):
+        triangle_corners = _read_binary(path)
+    else:
+        triangle_corners = _read_ascii(path)
+        if triangle_corners.shape[0] == 0:
+            # A binary file whose header starts with "solid", and with extra bytes after the last triangle
+            try:
+                triangle_corners = _read_binary(path)
+            except ValueError:
+                raise ValueError(f"'{path}' is not a valid STL file, found no triangles") from None
+
+    return weld(triangle_corners)
+
+
+def is_binary(path: str) -> bool:
+    """
+    Check if an STL file is binary. Binary files may also start with "solid", so the file size is checked first.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        header = file.read(_BINARY_HEADER_BYTES + 4)
+
+    if len(header) == _BINARY_HEADER_BYTES + 4:
+        triangle_count = int(np.frombuffer(header, dtype='<u4', offset=_BINARY_HEADER_BYTES)[0])
+        if file_size == _BINARY_HEADER_BYTES + 4 + triangle_count * _BINARY_TRIANGLE.itemsize:
+            return True
+
+    return not header.lstrip().startswith(b"solid")
+
+
+def weld(triangle_corners: np.ndarray):
+    """
+    Merge triangle corners at the same position into shared vertices. Triangles that collapse are removed.
+
+    Args:
+        triangle_corners (np.array): Mx3x3 array, three corners per triangle
+
+    Returns:
+        (np.array, np.array): Vertices (Nx3, float32) and triangles (Mx3 vertex indices, int32)
+    """
+    corners = np.asarray(triangle_corners, dtype=np.float32).reshape(-1, 3)
+    if corners.shape[0] == 0:
+        return np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.int32)
+
+    # Pack the quantized coordinates into one integer key per corner, 21 bits each
+    corner_min = np.amin(corners, axis=0)
+    largest_extent = float(np.amax(np.amax(corners, axis=0) - corner_min))
+    step = max(largest_extent, np.finfo(np.float32).tiny) / (_WELD_STEPS - 1)
+    quantized = np.rint((corners - corner_min) / step).astype(np.int64)
+    keys = (quantized[:, 0] << 42) | (quantized[:, 1] << 21) | quantized[:, 2]
+
+    _, first_corner, corner_to_vertex = np.unique(keys, return_index=True, return_inverse=True)
+    vertices = corners[first_corner]
+    triangles = corner_to_vertex.reshape(-1, 3).astype(np.int32)
+
+    collapsed = (triangles[:, 0] == triangles[:, 1]) | (triangles[:, 1] == triangles[:, 2]) |\
+        (triangles[:, 2] == triangles[:, 0])
+
+    return vertices, triangles[~collapsed]
+
+
+def write_binary(path: str, vertices: np.ndarray, triangles: np.ndarray):
+    """
+    Write a binary STL file.
+
+    Args:
+        path (str): Output path
+        vertices (np.array): Nx3 array
+        triangles (np.array): Mx3 array of vertex indices
+    """
+    corners = np.asarray(vertices, dtype=np.float32)[np.asarray(triangles)]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+
+    records = np.zeros(corners.shape[0], dtype=_BINARY_TRIANGLE)
+    records['normal'] = normals
+    records['vertices'] = corners
+
+    with open(path, "wb") as file:
+        file.write(b"Binary STL written by OrthOpen".ljust(_BINARY_HEADER_BYTES, b" "))
+        file.write(np.uint32(corners.shape[0]).astype('<u4').tobytes())
+        records.tofile(file)
+
+
+def _read_binary(path: str):
+    with open(path, "rb") as file:
+        file.seek(_BINARY_HEADER_BYTES)
+        count_bytes = file.read(4)
+    if len(count_bytes) < 4:
+        raise ValueError(f"'{path}' is not a valid STL file, it is too short for a header")
+
+    triangle_count = int(np.frombuffer(count_bytes, dtype='<u4')[0])
+    expected_size = _BINARY_HEADER_BYTES + 4 + triangle_count * _BINARY_TRIANGLE.itemsize
+    if os.path.getsize(path) < expected_size:
+        raise ValueError(f"'{path}' is truncated, {triangle_count} triangles need {expected_size} bytes but the "
+                         f"file has {os.path.getsize(path)}")
+
+    if triangle_count == 0:
+        return np.zeros((0, 3, 3), dtype=np.float32)
+
+    # Memory map instead of reading the file into a bytes object, the corners are then copied out in one go
+    records = np.memmap(path, dtype=_BINARY_TRIANGLE, mode='r', offset=_BINARY_HEADER_BYTES + 4,
+                        shape=(triangle_count,))
+    return np.array(records['vertices'])
+
+
+def _read_ascii(path: str):
+    corner_chunks = []
+    with open(path, "rb") as file:
+        remainder = b""
+        while True:
+            chunk = file.read(_ASCII_CHUNK_BYTES)
+            if not chunk:
+                break
+
+            # Only parse complete lines, the rest is carried over to the next chunk
+            text = remainder + chunk
+            last_newline = text.rfind(b"\n") + 1
+            text, remainder = text[:last_newline], text[last_newline:]
+            corner_chunks.append(_parse_ascii_vertices(text))
+
+        corner_chunks.append(_parse_ascii_vertices(remainder))
+
+    corners = np.concatenate(corner_chunks)
+    if corners.shape[0] % 3 != 0:
+        raise ValueError(f"'{path}' is not a valid STL file, found {corners.shape[0]} triangle corners")
+
+    return corners.reshape(-1, 3, 3)
+
+
+def _parse_ascii_vertices(text: bytes):
+    coordinates = _ASCII_VERTEX.findall(text)
+    if len(coordinates) == 0:
+        return np.zeros((0, 3), dtype=np.float32)
+
+    return np.array(coordinates, dtype=bytes).astype(np.float32)
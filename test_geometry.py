@@ -0,0 +1,521 @@
+import unittest
+
+import numpy as np
+
+import geometry
+
+
+def _l_shaped_leg(vertex_count: int = 20000, seed: int = 0):
+    """
+    Points on a leg standing on the XY plane, with the toes along +X. The foot is 0.25 m long and the leg 0.5 m high
+    """
+    rng = np.random.default_rng(seed)
+    foot = rng.uniform((-0.05, -0.045, 0), (0.2, 0.045, 0.08), size=(vertex_count // 2, 3))
+    angles = rng.uniform(0, 2 * np.pi, size=vertex_count - vertex_count // 2)
+    leg = np.column_stack([0.05 * np.cos(angles), 0.05 * np.sin(angles),
+                           rng.uniform(0.08, 0.5, size=angles.shape[0])])
+    return np.vstack([foot, leg])
+
+
+def _ellipsoid(count: int = 1500):
+    """
+    Evenly spread points on an ellipsoid with three different axes, so that it has no symmetry to slide along
+    """
+    i = np.arange(count) + 0.5
+    polar, azimuth = np.arccos(1 - 2 * i / count), np.pi * (1 + np.sqrt(5)) * i
+    return np.column_stack([0.12 * np.cos(azimuth) * np.sin(polar), 0.06 * np.sin(azimuth) * np.sin(polar),
+                            0.04 * np.cos(polar)])
+
+
+def _rotation_z(degrees: float, translation=(0, 0, 0)):
+    matrix = np.eye(4)
+    angle = np.radians(degrees)
+    matrix[:2, :2] = [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+    matrix[:3, 3] = translation
+    return matrix
+
+
+def _tube(radius: float = 0.05, height: float = 0.5, around: int = 64, rings: int = 20, center=(0, 0)):
+    """
+    The side of an open cylinder along Z, with faces pointing outwards, as vertex and triangle arrays
+    """
+    angles = np.linspace(0, 2 * np.pi, around, endpoint=False)
+    vertices = np.column_stack([np.tile(center[0] + radius * np.cos(angles), rings),
+                                np.tile(center[1] + radius * np.sin(angles), rings),
+                                np.repeat(np.linspace(0, height, rings), around)])
+    i = np.arange(around)
+    below = (np.arange(rings - 1) * around)[:, np.newaxis]
+    above = below + around
+    triangles = np.vstack([np.column_stack([(below + i).ravel(), (below + (i + 1) % around).ravel(),
+                                            (above + (i + 1) % around).ravel()]),
+                           np.column_stack([(below + i).ravel(), (above + (i + 1) % around).ravel(),
+                                            (above + i).ravel()])])
+    return vertices, triangles
+
+
+class TestTransforms(unittest.TestCase):
+
+    def test_bound_box_world(self):
+        bound_box = np.array([[x, y, z] for x in (0, 1) for y in (0, 2) for z in (0, 3)], dtype=float)
+        matrix_world = np.diag([2.0, 2.0, 2.0, 1.0])
+        matrix_world[:3, 3] = [1, 2, 3]
+
+        corners = geometry.bound_box_world(bound_box, matrix_world)
+        np.testing.assert_allclose(np.amin(corners, axis=0), [1, 2, 3])
+        np.testing.assert_allclose(np.amax(corners, axis=0), [3, 6, 9])
+        np.testing.assert_allclose(geometry.object_size(bound_box, [2, 2, 2]), [2, 4, 6])
+
+    def test_box_distances(self):
+        bound_box = np.array([[x, y, z] for x in (0, 1) for y in (0, 2) for z in (0, 3)], dtype=float)
+        points = np.array([[0.5, 1, 1], [2, 1, 1], [-3, 6, 3]])
+        np.testing.assert_allclose(geometry.box_distances(points, bound_box), [0, 1, 5])
+
+
+class TestFootWeights(unittest.TestCase):
+
+    def test_weights(self):
+        weights = geometry.foot_weights(np.array([-1, 0.1, 0.11, 0.12, 0.2]), ankle_z=0.1, deform_zone=0.02)
+        np.testing.assert_allclose(weights, [1, 1, 0.5, 0, 0])
+
+        # Rounded to a few levels, so they can be written to Blender in a few calls
+        weights = geometry.foot_weights(np.linspace(0, 1, 10000), ankle_z=0.5, deform_zone=0.02, levels=64)
+        self.assertLessEqual(len(np.unique(weights)), 65)
+
+
+class TestToeBox(unittest.TestCase):
+
+    def test_toe_box_covers_toes(self):
+        leg = _l_shaped_leg()
+        leg_bound_box = np.array([[x, y, z] for x in (np.amin(leg[:, 0]), np.amax(leg[:, 0]))
+                                  for y in (np.amin(leg[:, 1]), np.amax(leg[:, 1]))
+                                  for z in (np.amin(leg[:, 2]), np.amax(leg[:, 2]))])
+        unit_box = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=float)
+
+        mat = geometry.toe_box_matrix(leg, np.eye(4), leg_bound_box, unit_box)
+        toe_box = geometry.transform_points(unit_box, mat)
+
+        # The toe box should end a bit in front of the toes, and be as wide as the foot
+        self.assertAlmostEqual(np.amax(toe_box[:, 0]), np.amax(leg[:, 0]) + 0.015, places=6)
+        self.assertAlmostEqual(np.amax(toe_box[:, 1]) - np.amin(toe_box[:, 1]), 0.09, places=2)
+
+        # Same result with a precomputed sort order, as cached by helpers
+        x_order = np.argsort(leg[:, 0])
+        np.testing.assert_allclose(geometry.toe_box_matrix(leg, np.eye(4), leg_bound_box, unit_box, x_order), mat)
+
+
+class TestClampOrigin(unittest.TestCase):
+
+    def test_vertical_tube(self):
+        angles, heights = np.meshgrid(np.linspace(0, 2 * np.pi, 32, endpoint=False), np.linspace(0, 0.3, 61))
+        tube = np.column_stack([0.2 + 0.015 * np.cos(angles.ravel()), 0.1 + 0.015 * np.sin(angles.ravel()),
+                                heights.ravel()])
+
+        np.testing.assert_allclose(geometry.clamp_origin(tube, tube[500]), [0.2, 0.1, tube[500, 2]], atol=1E-3)
+
+    def test_too_few_vertices(self):
+        self.assertIsNone(geometry.clamp_origin(np.zeros((3, 3)), np.zeros(3)))
+
+
+class TestFitCylinder(unittest.TestCase):
+
+    def _tilted_tube(self, axis: np.ndarray, center: np.ndarray, radius: float = 0.015, count: int = 2000):
+        rng = np.random.default_rng(1)
+        angles, lengths = rng.uniform(0, 2 * np.pi, count), rng.uniform(-0.02, 0.02, count)
+        normals = np.column_stack([np.cos(angles), np.sin(angles), np.zeros(count)])
+        points = np.column_stack([radius * normals[:, :2], lengths]) + rng.normal(0, 0.0002, size=(count, 3))
+
+        rotation = geometry.rotation_between([0, 0, 1], axis)
+        return points @ rotation.T + center, normals @ rotation.T
+
+    def test_tilted_tube_with_outliers(self):
+        axis = np.array([0.3, -0.2, 1]) / np.linalg.norm([0.3, -0.2, 1])
+        center = np.array([0.1, 0.2, 0.3])
+        points, normals = self._tilted_tube(axis, center)
+
+        # A flat surface next to the tube, e.g. a socket
+        rng = np.random.default_rng(2)
+        outliers = np.column_stack([rng.uniform(0.12, 0.14, 600), rng.uniform(0.18, 0.22, 600), np.full(600, 0.29)])
+        points = np.vstack([points, outliers])
+        normals = np.vstack([normals, np.tile([0, 0, 1], (600, 1))])
+
+        cylinder = geometry.fit_cylinder(points, normals, reference_point=center + 0.01 * axis)
+        self.assertGreater(np.dot(cylinder.axis, axis), np.cos(np.radians(2)))
+        np.testing.assert_allclose(cylinder.center, center + 0.01 * axis, atol=5E-4)
+        self.assertAlmostEqual(cylinder.radius, 0.015, delta=5E-4)
+
+    def test_plane(self):
+        points = np.random.default_rng(0).uniform(0, 1, size=(100, 3)) * [1, 1, 0]
+        self.assertIsNone(geometry.fit_cylinder(points, np.tile([0, 0, 1], (100, 1)), np.zeros(3)))
+
+    def test_rotation_between(self):
+        for to_vector in ([0, 0, 1], [1, 2, 3], [0, 0, -1]):
+            rotation = geometry.rotation_between([0, 0, 1], to_vector)
+            np.testing.assert_allclose(rotation @ [0, 0, 1], to_vector / np.linalg.norm(to_vector), atol=1E-12)
+            np.testing.assert_allclose(rotation @ rotation.T, np.eye(3), atol=1E-12)
+
+
+class TestPointsInPolygons(unittest.TestCase):
+
+    def test_concave_polygons(self):
+        """
+        Test an L-shaped and a square polygon at once, against the known inside regions
+        """
+        l_shape = np.array([[0, 0], [2, 0], [2, 1], [1, 1], [1, 2], [0, 2]], dtype=float)
+        square = np.array([[0.5, 0.5], [1.5, 0.5], [1.5, 1.5], [0.5, 1.5]])
+        points = np.random.default_rng(0).uniform(-0.5, 2.5, size=(20000, 2))
+
+        inside = geometry.points_in_polygons(points, [l_shape, square])
+        x, y = points[:, 0], points[:, 1]
+        in_l_shape = (x > 0) & (y > 0) & (((x < 2) & (y < 1)) | ((x < 1) & (y < 2)))
+        in_square = (x > 0.5) & (x < 1.5) & (y > 0.5) & (y < 1.5)
+
+        self.assertEqual(inside.shape, (2, points.shape[0]))
+        np.testing.assert_array_equal(inside[0], in_l_shape)
+        np.testing.assert_array_equal(inside[1], in_square)
+
+    def test_corner_on_ray(self):
+        """
+        A ray through a corner of the polygon should only be counted once
+        """
+        diamond = np.array([[1, 0], [2, 1], [1, 2], [0, 1]], dtype=float)
+        inside = geometry.points_in_polygon(np.array([[1, 1], [-1, 1], [3, 1], [1, 0.5]]), diamond)
+        np.testing.assert_array_equal(inside, [True, False, False, True])
+
+    def test_empty(self):
+        self.assertEqual(geometry.points_in_polygons(np.zeros((0, 2)), [np.eye(2)]).shape, (1, 0))
+        self.assertEqual(geometry.points_in_polygons(np.zeros((3, 2)), []).shape, (0, 3))
+
+
+class TestSliceMesh(unittest.TestCase):
+
+    def test_tube(self):
+        vertices, triangles = _tube(around=64)
+        heights = np.linspace(0.01, 0.49, 50)
+        sections = geometry.slice_mesh(vertices, triangles, heights)
+
+        # One closed polygon per height, the regular 64-gon inscribed in the circle
+        self.assertEqual(len(sections.contours), heights.shape[0])
+        self.assertTrue(np.all(sections.closed))
+        np.testing.assert_array_equal(np.sort(sections.height_index), np.arange(heights.shape[0]))
+        np.testing.assert_allclose(sections.perimeter, 64 * 2 * 0.05 * np.sin(np.pi / 64))
+        np.testing.assert_allclose(sections.area, 64 / 2 * 0.05**2 * np.sin(2 * np.pi / 64))
+
+        # Corners are in order around the contour, so they form the same polygon
+        contour = sections.contours[0]
+        edges = np.linalg.norm(np.roll(contour, -1, axis=0) - contour, axis=1)
+        np.testing.assert_allclose(np.sum(edges), sections.perimeter[0])
+
+    def test_two_bodies_and_cut_through_vertices(self):
+        """
+        Two legs of different size, cut exactly at the height of some vertex rings
+        """
+        thin_vertices, thin_triangles = _tube(radius=0.03, rings=11, center=(0.2, 0))
+        thick_vertices, thick_triangles = _tube(radius=0.05, rings=11)
+        vertices = np.vstack([thin_vertices, thick_vertices])
+        triangles = np.vstack([thin_triangles, thick_triangles + thin_vertices.shape[0]])
+        heights = np.array([0.05, 0.1, 0.125, 0.25])
+        sections = geometry.slice_mesh(vertices, triangles, heights)
+
+        self.assertEqual(len(sections.contours), 2 * heights.shape[0])
+        self.assertTrue(np.all(sections.closed))
+        profile = geometry.circumference_profile(sections, heights.shape[0])
+        np.testing.assert_allclose(profile, 64 * 2 * 0.05 * np.sin(np.pi / 64))
+
+    def test_hole(self):
+        vertices, triangles = _tube(rings=3)
+        sections = geometry.slice_mesh(vertices, triangles[1:], np.array([0.1, 0.4]))
+
+        # Only the contour through the missing triangle is open
+        self.assertEqual(sections.closed.tolist(), [False, True])
+        self.assertTrue(np.isnan(geometry.circumference_profile(sections, 2)[0]))
+        self.assertEqual(sections.contours[0].shape[0], 2 * 64 - 1)
+
+    def test_nothing_to_cut(self):
+        vertices, triangles = _tube()
+        sections = geometry.slice_mesh(vertices, triangles, np.array([-1.0, 2.0]))
+        self.assertEqual(len(sections.contours), 0)
+        self.assertTrue(np.all(np.isnan(geometry.circumference_profile(sections, 2))))
+
+    def test_calf_circumference(self):
+        # Foot, ankle, calf and a wider knee
+        profile = np.array([0.6, 0.5, 0.25, 0.22, 0.28, 0.35, 0.33, 0.3, np.nan, 0.36])
+        self.assertEqual(geometry.calf_circumference(profile), (5, 0.35))
+        self.assertEqual(geometry.calf_circumference(profile[:8]), (5, 0.35))
+        self.assertIsNone(geometry.calf_circumference(np.full(10, np.nan)))
+
+    def test_calf_circumference_noise(self):
+        # A small dip below the calf is not a peak, and a leg cut off at the calf still has one
+        profile = np.array([0.5, 0.22, 0.3, 0.299, 0.34, 0.35, 0.3, 0.4])
+        self.assertEqual(geometry.calf_circumference(profile), (5, 0.35))
+        self.assertEqual(geometry.calf_circumference(profile[:6]), (5, 0.35))
+        self.assertIsNone(geometry.calf_circumference(np.array([0.3, 0.2, np.nan, np.nan])))
+
+
+class TestFitRingsToProfile(unittest.TestCase):
+
+    def test_tube(self):
+        """
+        Fit a tube placed with a scale and translation to a calf shaped profile
+        """
+        vertices, _ = _tube(radius=1, height=1, rings=11)
+        matrix_world = np.diag([0.05, 0.05, 0.2, 1])
+        matrix_world[:3, 3] = [0.1, 0, 0.1]
+        heights = np.linspace(0, 0.5, 51)
+        profile = 0.3 + 0.1 * np.sin(np.pi * heights)
+        profile[:3] = np.nan
+
+        fitted = geometry.fit_rings_to_profile(vertices, matrix_world, heights, profile)
+        world = geometry.transform_points(fitted, matrix_world)
+        np.testing.assert_allclose(world[:, 2], geometry.transform_points(vertices, matrix_world)[:, 2])
+        for z in np.unique(world[:, 2]):
+            ring = world[world[:, 2] == z]
+            diameter = np.amax(np.ptp(ring[:, :2], axis=0))
+            np.testing.assert_allclose(diameter * np.pi, 0.3 + 0.1 * np.sin(np.pi * z), rtol=1E-6)
+
+    def test_unknown_profile(self):
+        vertices, _ = _tube(rings=3)
+        fitted = geometry.fit_rings_to_profile(vertices, np.eye(4), np.array([0, 1]), np.full(2, np.nan))
+        np.testing.assert_array_equal(fitted, vertices)
+
+
+class TestClusterVertices(unittest.TestCase):
+
+    def test_tube(self):
+        vertices, triangles = _tube(radius=0.05, height=0.5, around=256, rings=201)
+        clustered, clustered_triangles = geometry.cluster_vertices(vertices, triangles, cell_size=0.02)
+
+        self.assertLess(clustered_triangles.shape[0], triangles.shape[0] / 20)
+        self.assertEqual(np.amax(clustered_triangles) + 1, clustered.shape[0])
+
+        # No collapsed or duplicated triangles, and the shape is kept within a cell
+        self.assertTrue(np.all(np.diff(np.sort(clustered_triangles, axis=1), axis=1) > 0))
+        self.assertEqual(np.unique(np.sort(clustered_triangles, axis=1), axis=0).shape[0], clustered_triangles.shape[0])
+        radii = np.linalg.norm(clustered[:, :2], axis=1)
+        self.assertTrue(np.all(np.abs(radii - 0.05) < 0.02))
+
+    def test_large_cells(self):
+        vertices, triangles = _tube()
+        clustered, clustered_triangles = geometry.cluster_vertices(vertices, triangles, cell_size=10)
+        self.assertEqual(clustered.shape[0], 1)
+        self.assertEqual(clustered_triangles.shape[0], 0)
+
+
+class TestDetectAnkle(unittest.TestCase):
+
+    def test_l_shaped_leg(self):
+        leg = _l_shaped_leg(100000)
+        ankle = geometry.detect_ankle(leg)
+        np.testing.assert_allclose(ankle, [0, 0, 0.08], atol=0.01)
+
+        # Same result with a precomputed sort order, as cached by helpers
+        np.testing.assert_allclose(geometry.detect_ankle(leg, z_order=np.argsort(leg[:, 2])), ankle)
+
+    def test_no_foot(self):
+        vertices, _ = _tube(rings=300)
+        self.assertIsNone(geometry.detect_ankle(vertices))
+
+
+class TestLegAlignment(unittest.TestCase):
+
+    @staticmethod
+    def _rotation_degrees(matrix: np.ndarray):
+        return np.degrees(np.arccos(np.clip((np.trace(matrix[:3, :3]) - 1) / 2, -1, 1)))
+
+    def test_aligned_leg(self):
+        leg = _l_shaped_leg(100000)
+        self.assertLess(self._rotation_degrees(geometry.leg_alignment(leg, np.eye(4))), 2)
+
+    def test_rotated_leg(self):
+        leg = _l_shaped_leg(100000)
+        rng = np.random.default_rng(1)
+        for _ in range(5):
+            # Random rotation and translation, the toes pointing anywhere
+            matrix_world = np.eye(4)
+            matrix_world[:3, :3] = np.linalg.qr(rng.normal(size=(3, 3)))[0]
+            matrix_world[:3, :3] *= np.linalg.det(matrix_world[:3, :3])
+            matrix_world[:3, 3] = rng.uniform(-1, 1, size=3)
+
+            aligned = geometry.leg_alignment(leg, matrix_world) @ matrix_world
+            self.assertLess(self._rotation_degrees(aligned), 2)
+
+
+class TestVoxelDownsample(unittest.TestCase):
+
+    def test_means(self):
+        points = np.array([[0.001, 0.001, 0.001], [0.003, 0.003, 0.003], [0.011, 0, 0]])
+        means, counts = geometry.voxel_downsample(points, 0.01)
+        order = np.argsort(means[:, 0])
+        np.testing.assert_allclose(means[order], [[0.002, 0.002, 0.002], [0.011, 0, 0]])
+        np.testing.assert_allclose(counts[order], [2, 1])
+
+    def test_coarse_from_fine(self):
+        points = _l_shaped_leg(20000)
+        fine, counts = geometry.voxel_downsample(points, 0.005)
+        coarse, coarse_counts = geometry.voxel_downsample(fine, 0.01, weights=counts)
+        direct, direct_counts = geometry.voxel_downsample(points, 0.01)
+
+        order, direct_order = np.lexsort(coarse.T), np.lexsort(direct.T)
+        np.testing.assert_allclose(coarse[order], direct[direct_order], atol=1E-12)
+        np.testing.assert_allclose(coarse_counts[order], direct_counts[direct_order])
+
+
+class TestRegisterPoints(unittest.TestCase):
+
+    def test_rigid_transform(self):
+        points = _ellipsoid()
+        matrix = _rotation_z(30, translation=(0.1, -0.2, 0.3))
+        np.testing.assert_allclose(geometry.rigid_transform(points, geometry.transform_points(points, matrix)), matrix,
+                                   atol=1E-12)
+
+    def test_moved_ellipsoid(self):
+        target = _ellipsoid()
+        matrix_world = _rotation_z(10, translation=(0.01, -0.005, 0.01))
+        source = geometry.transform_points(target, matrix_world)
+
+        def closest_point_search(target_points):
+            return lambda points: np.argmin(np.sum(points ** 2, axis=1)[:, np.newaxis] - 2 * points @ target_points.T
+                                            + np.sum(target_points ** 2, axis=1), axis=1)
+
+        matrix, residuals = geometry.register_points(source, target, closest_point_search)
+        np.testing.assert_allclose(matrix @ matrix_world, np.eye(4), atol=1E-4)
+
+        # One residual per iteration, on every level, getting smaller
+        self.assertEqual({voxel_size for voxel_size, _, _, _ in residuals}, {0.01, 0.005, 0.0025})
+        self.assertLess(residuals[-1][2], 0.1 * residuals[0][2])
+
+    def test_few_points_per_level(self):
+        target = _ellipsoid()
+        matrix_world = _rotation_z(10, translation=(0.01, -0.005, 0.01))
+        source = geometry.transform_points(target, matrix_world)
+
+        def closest_point_search(target_points):
+            return lambda points: np.argmin(np.sum(points ** 2, axis=1)[:, np.newaxis] - 2 * points @ target_points.T
+                                            + np.sum(target_points ** 2, axis=1), axis=1)
+
+        matrix, residuals = geometry.register_points(source, target, closest_point_search, max_points=200)
+        np.testing.assert_allclose(matrix @ matrix_world, np.eye(4), atol=1E-3)
+        self.assertLessEqual(max(count for _, _, _, count in residuals), 200)
+
+    def test_nothing_to_pair(self):
+        matrix, residuals = geometry.register_points(np.empty((0, 3)), _ellipsoid(), lambda points: None)
+        np.testing.assert_array_equal(matrix, np.eye(4))
+        self.assertEqual(residuals, [])
+
+
+class TestDeviation(unittest.TestCase):
+
+    def test_signed_distances(self):
+        # Closest points on the XY plane, with the normal up
+        points = np.array([[0, 0, 0.002], [0.1, 0, -0.003], [0, 0, 0]])
+        closest = points * [1, 1, 0]
+        closest[2] = np.nan
+        distances = geometry.signed_distances(points, closest, np.tile([0, 0, 1.0], (3, 1)))
+        np.testing.assert_allclose(distances[:2], [0.002, -0.003])
+        self.assertTrue(np.isnan(distances[2]))
+
+    def test_colors(self):
+        colors = geometry.deviation_colors(np.array([0.01, 0.005, 0, -0.0025, np.nan]), max_distance=0.005)
+        np.testing.assert_allclose(colors[:, :3], [[1, 0, 0], [1, 0, 0], [1, 1, 1], [0.5, 0.5, 1], [0.5, 0.5, 0.5]])
+        np.testing.assert_allclose(colors[:, 3], 1)
+
+    def test_histogram(self):
+        counts, edges = geometry.distance_histogram(np.array([-1, -0.0045, 0.0001, 0.0049, 2, np.nan]), 0.005,
+                                                    bin_count=10)
+        self.assertEqual(edges.shape[0], 11)
+        self.assertAlmostEqual(edges[0], -0.005)
+        self.assertEqual(counts.tolist(), [2, 0, 0, 0, 0, 1, 0, 0, 0, 2])
+
+
+class TestClearance(unittest.TestCase):
+
+    def test_connected_regions(self):
+        vertices, triangles = _tube(rings=20)
+        selected = np.zeros(vertices.shape[0], dtype=bool)
+        selected[:3 * 64] = True
+        selected[10 * 64:12 * 64] = True
+
+        labels, count = geometry.connected_regions(triangles, selected)
+        self.assertEqual(count, 2)
+        self.assertTrue(np.all(labels[~selected] == -1))
+        self.assertEqual(set(labels[:3 * 64]), {0})
+        self.assertEqual(set(labels[10 * 64:12 * 64]), {1})
+
+    def test_clear(self):
+        vertices, triangles = _tube(rings=20)
+        distances = np.full(vertices.shape[0], 0.004)
+        distances[:64] = np.nan
+        result = geometry.clearance(distances, triangles, intersecting=np.array([], dtype=np.int64))
+        self.assertEqual(result, geometry.Clearance(min_distance=0.004, region_count=0, penetrating_vertices=0,
+                                                    intersecting_faces=0))
+
+    def test_penetration(self):
+        vertices, triangles = _tube(rings=20)
+        distances = np.full(vertices.shape[0], 0.004)
+        distances[5 * 64:6 * 64] = -0.001
+
+        # The triangles below the ring inside cut through the surface, far away is another small region
+        intersecting = np.flatnonzero(np.any(np.isin(triangles, np.arange(5 * 64, 6 * 64)), axis=1))
+        result = geometry.clearance(distances, triangles, np.append(intersecting, 0))
+        self.assertEqual(result.min_distance, -0.001)
+        self.assertEqual(result.region_count, 2)
+        self.assertEqual(result.penetrating_vertices, 64)
+        self.assertEqual(result.intersecting_faces, intersecting.shape[0] + 1)
+
+
+class TestShell(unittest.TestCase):
+
+    def test_normals(self):
+        vertices, triangles = _tube(rings=10)
+        normals = geometry.area_weighted_normals(vertices, triangles)
+
+        # Outwards from the axis. On the open ends, the triangles around a vertex are lopsided
+        np.testing.assert_allclose(normals[64:-64, :2], vertices[64:-64, :2] / 0.05, atol=1E-12)
+        np.testing.assert_allclose(normals[:, :2], vertices[:, :2] / 0.05, atol=0.02)
+        np.testing.assert_allclose(normals[:, 2], 0, atol=1E-12)
+
+    def test_closed_shell(self):
+        vertices, triangles = _tube(rings=10)
+        vertex_indices, faces = geometry.shell_topology(triangles)
+        self.assertEqual(vertex_indices.shape[0], vertices.shape[0])
+
+        # Closed and consistently oriented: every edge is used once in each direction
+        edges = set(zip(faces.ravel().tolist(), np.roll(faces, -1, axis=1).ravel().tolist()))
+        self.assertEqual(len(edges), faces.size)
+        self.assertTrue(all((end, start) in edges for start, end in edges))
+
+        # Volume by the divergence theorem, positive for faces pointing outwards
+        normals = geometry.area_weighted_normals(vertices, triangles)
+        corners = geometry.offset_shell(vertices[vertex_indices], normals[vertex_indices], 0.003)[faces]
+        volume = np.sum(np.einsum('ij,ij->i', corners[:, 0], np.cross(corners[:, 1], corners[:, 2]))) / 6
+        self.assertAlmostEqual(volume, np.pi * (0.053 ** 2 - 0.05 ** 2) * 0.5, delta=2E-5)
+
+    def test_scaled_thickness(self):
+        vertices, triangles = _tube(rings=10)
+        vertex_indices, _ = geometry.shell_topology(triangles)
+        normals = geometry.area_weighted_normals(vertices, triangles)[vertex_indices]
+        matrix_world = np.diag([2.0, 0.5, 3.0, 1.0])
+        matrix_world[:3, 3] = (0.1, 0.2, 0.3)
+
+        # The thickness is in world units, along the normals of the transformed surface
+        shell = geometry.transform_points(geometry.offset_shell(vertices[vertex_indices], normals, 0.003,
+                                                                matrix_world), matrix_world)
+        inner, outer = np.split(shell, 2)
+        np.testing.assert_allclose(np.linalg.norm(outer - inner, axis=1), 0.003)
+        normals_world = normals @ np.linalg.inv(matrix_world[:3, :3])
+        np.testing.assert_allclose(np.cross(outer - inner, normals_world), 0, atol=1E-12)
+
+    def test_edges(self):
+        _, triangles = _tube(rings=10)
+        _, faces = geometry.shell_topology(triangles)
+        edges, corner_edges = geometry.mesh_edges(faces)
+
+        # Each edge once, and each corner has the edge to the next corner
+        self.assertEqual(len(np.unique(np.sort(edges, axis=1), axis=0)), len(edges))
+        np.testing.assert_array_equal(np.sort(edges[corner_edges], axis=2),
+                                      np.sort(np.stack([faces, np.roll(faces, -1, axis=1)], axis=2), axis=2))
+        # Closed, so each edge is shared by two triangles
+        self.assertEqual(2 * len(edges), faces.size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,9 +7,13 @@ See : https://wiki.blender.org/wiki/Tools/Tests/Python
 """
 import unittest
 
+import bpy
+import mathutils
+import numpy as np
 
 # TODO(parlove@paxec.se): These statements import from the local git repository,
 # would be better to call the operator as registered within Blender
+from orthopen import geometry, helpers
 from orthopen.operators import ORTHOPEN_OT_leg_prosthesis_generate
 
 
@@ -19,6 +23,171 @@ class TestFileImports(unittest.TestCase):
         ORTHOPEN_OT_leg_prosthesis_generate._import_from_assets_folder(None)
 
 
+class TestAlignment(unittest.TestCase):
+    def test_foot_template(self):
+        # The foot template is aligned as the other functions expect, the alignment should find it in any rotation
+        foot = helpers.load_assets(filename="foot_ref293.blend", names=["Foot_ref"])["Foot_ref"]
+        reference = np.array(foot.matrix_world)
+        vertices = helpers.vertex_coordinates(foot)
+
+        for angles in [(0, 0, 0), (0, 0, 1.5), (1.5, 0, 0), (0.3, -2.0, 2.5)]:
+            rotation = mathutils.Euler(angles).to_matrix().to_4x4()
+            aligned = geometry.leg_alignment(vertices, np.array(rotation @ foot.matrix_world)) @ \
+                np.array(rotation @ foot.matrix_world)
+            difference = aligned[:3, :3] @ reference[:3, :3].T
+            degrees = np.degrees(np.arccos(np.clip((np.trace(difference) - 1) / 2, -1, 1)))
+            self.assertLess(degrees, 5, f"Rotated by {angles}")
+
+
+class TestRegistration(unittest.TestCase):
+    def test_foot_template(self):
+        # A slightly moved copy of the foot template should snap back onto it
+        foot = helpers.load_assets(filename="foot_ref293.blend", names=["Foot_ref"])["Foot_ref"]
+        offset = mathutils.Matrix.Translation((0.01, -0.005, 0.008)) @ mathutils.Euler((0, 0, 0.1)).to_matrix().to_4x4()
+        source = geometry.transform_points(helpers.vertex_coordinates(foot, space='WORLD'), np.array(offset))
+
+        matrix, residuals = geometry.register_points(source, helpers.vertex_coordinates(foot, space='WORLD'),
+                                                     helpers.closest_point_search)
+        np.testing.assert_allclose(matrix @ np.array(offset), np.eye(4), atol=1E-3)
+        self.assertLess(residuals[-1][2], 0.001)
+
+
+def _box(name: str, size: float, offset: tuple):
+    # A closed box with outwards facing quads
+    vertices = np.array([[x, y, z] for x in (0, size) for y in (0, size) for z in (0, size)]) + offset
+    faces = [[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1], [2, 3, 7, 6], [0, 2, 6, 4], [1, 5, 7, 3]]
+    return helpers.add_mesh_object(name, vertices, faces)
+
+
+class TestVerticesNear(unittest.TestCase):
+    def test_scaled_and_rotated(self):
+        vertices = np.random.default_rng(0).uniform(-0.1, 0.1, size=(5000, 3))
+        cloud = helpers.add_mesh_object("near_cloud", vertices, np.zeros((0, 3)))
+        cloud.matrix_world = mathutils.Matrix.Rotation(0.7, 4, 'X') @ mathutils.Matrix.Diagonal((1, 3, 0.5, 1))
+        bpy.context.view_layer.update()
+
+        point = np.array([0.01, 0.05, -0.02])
+        vertices_world = helpers.vertex_coordinates(cloud, space='WORLD')
+        expected = np.flatnonzero(np.linalg.norm(vertices_world - point, axis=1) <= 0.04)
+        self.assertGreater(len(expected), 0)
+        np.testing.assert_array_equal(np.sort(helpers.vertices_near(cloud, point, 0.04)), expected)
+        bpy.data.objects.remove(cloud, do_unlink=True)
+
+
+class TestCircumferenceProfile(unittest.TestCase):
+    def test_kept_across_redo(self):
+        # A 10 cm wide tube, closed around at every height
+        angle, z = np.meshgrid(np.linspace(0, 2 * np.pi, 64, endpoint=False), np.linspace(0, 0.3, 31))
+        vertices = np.column_stack([0.05 * np.cos(angle.ravel()), 0.05 * np.sin(angle.ravel()), z.ravel()])
+        index = np.arange(31 * 64).reshape(31, 64)
+        following = np.roll(index, -1, axis=1)
+        quads = np.column_stack([index[:-1].ravel(), following[:-1].ravel(), following[1:].ravel(),
+                                 index[1:].ravel()])
+        scan = helpers.add_mesh_object("profile_scan", vertices, quads)
+        profile = helpers.circumference_profile(scan)
+        np.testing.assert_allclose(profile[1], 0.1 * np.pi, rtol=0.01)
+
+        # A redo undoes first, which reports the geometry as changed, but the mesh is still the same
+        helpers.clear_cached_geometry(scan)
+        helpers.clear_cached_geometry(scan.data)
+        self.assertIs(helpers.circumference_profile(scan), profile)
+
+        scan.data.vertices[0].co.x += 0.01
+        self.assertIsNot(helpers.circumference_profile(scan), profile)
+        bpy.data.objects.remove(scan, do_unlink=True)
+
+
+class TestSplintShell(unittest.TestCase):
+    def test_scaled_redo(self):
+        # The lower half of a 10 cm wide tube, scaled unevenly
+        angle, z = np.meshgrid(np.linspace(0, 2 * np.pi, 64, endpoint=False), np.linspace(0, 0.3, 31))
+        vertices = np.column_stack([0.05 * np.cos(angle.ravel()), 0.05 * np.sin(angle.ravel()), z.ravel()])
+        index = np.arange(31 * 64).reshape(31, 64)
+        following = np.roll(index, -1, axis=1)
+        quads = np.column_stack([index[:-1].ravel(), following[:-1].ravel(), following[1:].ravel(),
+                                 index[1:].ravel()])
+        scan = helpers.add_mesh_object("shell_scan", vertices, quads)
+        scan.scale = (2, 0.5, 1)
+        scan.data.vertices.foreach_set("select", vertices[:, 2] < 0.15)
+        bpy.context.view_layer.update()
+
+        self.assertEqual(bpy.ops.orthopen.generate_splint_shell(thickness=0.003), {'FINISHED'})
+        shell = bpy.context.active_object
+        # Edges are set from the cached topology instead of calculated, nothing for Blender to fix
+        self.assertFalse(shell.data.validate())
+        inner, outer = np.split(helpers.vertex_coordinates(shell, space='WORLD'), 2)
+        np.testing.assert_allclose(np.linalg.norm(outer - inner, axis=1), 0.003, rtol=1E-5)
+        topology = helpers.shell_topology(scan)
+
+        # A redo undoes first, which reports the geometry as changed, but the mesh and selection are the same
+        bpy.data.objects.remove(shell, do_unlink=True)
+        helpers.clear_cached_geometry(scan)
+        helpers.clear_cached_geometry(scan.data)
+        bpy.context.view_layer.objects.active = scan
+        self.assertEqual(bpy.ops.orthopen.generate_splint_shell(thickness=0.005), {'FINISHED'})
+        self.assertIs(helpers.shell_topology(scan), topology)
+        self.assertEqual(len(bpy.context.active_object.data.polygons), len(topology.faces))
+
+        scan.data.vertices[0].select = False
+        self.assertIsNot(helpers.shell_topology(scan), topology)
+        bpy.data.objects.remove(bpy.context.active_object, do_unlink=True)
+        bpy.data.objects.remove(scan, do_unlink=True)
+
+
+class TestClearance(unittest.TestCase):
+    def test_kept_until_deleted(self):
+        scan = _box("clearance_scan", 0.1, (0, 0, 0))
+        part = _box("clearance_part", 0.05, (0.02, 0.02, 0.105))
+        bpy.context.view_layer.update()
+
+        result, is_new = helpers.clearance(part, scan, search_distance=0.02)
+        self.assertTrue(is_new)
+        self.assertAlmostEqual(result.min_distance, 0.005, places=5)
+        self.assertEqual(result.penetrating_vertices, 0)
+        self.assertFalse(helpers.clearance(part, scan, search_distance=0.02)[1])
+
+        # Nothing is kept for a deleted scan, whose pointer a new object could get
+        key = (part.as_pointer(), scan.as_pointer())
+        bpy.data.objects.remove(scan, do_unlink=True)
+        bpy.context.view_layer.update()
+        self.assertNotIn(key, helpers._CLEARANCES)
+        bpy.data.objects.remove(part, do_unlink=True)
+
+
+class TestFootPosing(unittest.TestCase):
+    def test_applied_as_previewed(self):
+        # Without a proxy, the smoothed band around the ankle is applied exactly as it was shown while posing
+        leg = helpers.load_assets(filename="foot_ref293.blend", names=["Foot_ref"])["Foot_ref"]
+        rest = helpers.vertex_coordinates(leg).copy()
+        bpy.context.view_layer.objects.active = leg
+        leg.select_set(True)
+        result = bpy.ops.orthopen.set_foot_pivot(use_detected_ankle=True, use_posing_proxy=False)
+        self.assertEqual(result, {'FINISHED'})
+
+        bone = leg.parent.pose.bones[0]
+        bone.rotation_mode = 'XYZ'
+        bone.rotation_euler = (0.3, 0, 0)
+        bpy.context.view_layer.update()
+        evaluated = leg.evaluated_get(bpy.context.evaluated_depsgraph_get()).data
+        previewed = np.empty(len(evaluated.vertices) * 3, dtype=np.float32)
+        evaluated.vertices.foreach_get("co", previewed)
+        previewed = previewed.reshape(-1, 3)
+
+        band_group = leg.vertex_groups["foot_auto_gen_band"].index
+        band = [v.index for v in leg.data.vertices if any(g.group == band_group for g in v.groups)]
+        self.assertGreater(len(band), 0)
+
+        bpy.ops.object.mode_set(mode='OBJECT')
+        bpy.ops.object.select_all(action='DESELECT')
+        bpy.context.view_layer.objects.active = leg
+        leg.select_set(True)
+        self.assertEqual(bpy.ops.orthopen.permanent_modifiers(), {'FINISHED'})
+
+        applied = helpers.vertex_coordinates(leg)
+        self.assertGreater(np.amax(np.linalg.norm(applied - rest, axis=1)), 0.001)
+        np.testing.assert_allclose(applied[band], previewed[band], atol=1E-6)
+
+
 if __name__ == '__main__':
     import sys
     # Remove arguments from argv that unittest would complain about
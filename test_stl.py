@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import stl
+
+# A unit cube, 8 vertices and 12 triangles
+CUBE_VERTICES = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+                          [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]], dtype=np.float32)
+CUBE_TRIANGLES = np.array([[0, 2, 1], [0, 3, 2], [4, 5, 6], [4, 6, 7], [0, 1, 5], [0, 5, 4],
+                           [1, 2, 6], [1, 6, 5], [2, 3, 7], [2, 7, 6], [3, 0, 4], [3, 4, 7]])
+
+
+class TestSTL(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _write_ascii(self, triangle_corners):
+        path = os.path.join(self.directory.name, "ascii.stl")
+        with open(path, "w") as file:
+            file.write("solid cube\n")
+            for corners in triangle_corners:
+                file.write("  facet normal 0 0 0\n    outer loop\n")
+                for corner in corners:
+                    file.write(f"      vertex {corner[0]:e} {corner[1]:e} {corner[2]:e}\n")
+                file.write("    endloop\n  endfacet\n")
+            file.write("endsolid cube\n")
+        return path
+
+    def assertSameTriangles(self, vertices, triangles):
+        """
+        Vertex order is not preserved by welding, so compare the triangle corners
+        """
+        self.assertEqual(vertices.shape, CUBE_VERTICES.shape)
+        np.testing.assert_allclose(vertices[triangles], CUBE_VERTICES[CUBE_TRIANGLES], atol=1E-6)
+
+    def test_binary_round_trip(self):
+        path = os.path.join(self.directory.name, "binary.stl")
+        stl.write_binary(path, CUBE_VERTICES, CUBE_TRIANGLES)
+
+        self.assertEqual(os.path.getsize(path), 84 + 50 * len(CUBE_TRIANGLES))
+        self.assertTrue(stl.is_binary(path))
+        self.assertSameTriangles(*stl.read(path))
+
+    def test_binary_starting_with_solid(self):
+        """
+        Some exporters write "solid" in the header of binary files too
+        """
+        path = os.path.join(self.directory.name, "binary.stl")
+        stl.write_binary(path, CUBE_VERTICES, CUBE_TRIANGLES)
+        with open(path, "r+b") as file:
+            file.write(b"solid")
+
+        self.assertTrue(stl.is_binary(path))
+        self.assertSameTriangles(*stl.read(path))
+
+    def test_binary_starting_with_solid_and_padded(self):
+        """
+        With bytes after the last triangle the size check does not recognize the file as binary
+        """
+        path = os.path.join(self.directory.name, "binary.stl")
+        stl.write_binary(path, CUBE_VERTICES, CUBE_TRIANGLES)
+        with open(path, "r+b") as file:
+            file.write(b"solid")
+        with open(path, "ab") as file:
+            file.write(b"\0" * 10)
+
+        self.assertFalse(stl.is_binary(path))
+        self.assertSameTriangles(*stl.read(path))
+
+    def test_truncated_binary(self):
+        path = os.path.join(self.directory.name, "binary.stl")
+        stl.write_binary(path, CUBE_VERTICES, CUBE_TRIANGLES)
+        with open(path, "r+b") as file:
+            file.truncate(84 + 50 * 5)
+
+        with self.assertRaisesRegex(ValueError, "truncated"):
+            stl.read(path)
+
+    def test_ascii_without_triangles(self):
+        path = self._write_ascii([])
+
+        with self.assertRaisesRegex(ValueError, "no triangles"):
+            stl.read(path)
+
+    def test_ascii(self):
+        path = self._write_ascii(CUBE_VERTICES[CUBE_TRIANGLES])
+
+        self.assertFalse(stl.is_binary(path))
+        self.assertSameTriangles(*stl.read(path))
+
+    def test_weld(self):
+        """
+        Corners that only differ by float rounding should become one vertex, and collapsed triangles be removed
+        """
+        corners = CUBE_VERTICES[CUBE_TRIANGLES] + np.float32(1E-9)
+        corners = np.vstack([corners, [[[0, 0, 0], [0, 0, 0], [1, 1, 1]]]])
+
+        vertices, triangles = stl.weld(corners)
+        self.assertSameTriangles(vertices, triangles)
+
+
+if __name__ == '__main__':
+    unittest.main()